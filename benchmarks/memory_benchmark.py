@@ -0,0 +1,94 @@
+"""
+MEMORY BENCHMARK
+A year of sales as per-upload DataFrames vs the compact SalesHistory
+
+Generates 52 weeks of synthetic orders, reads each week's Product Mix
+workbook the way the app does (load_toast_data_from_file) and compares:
+
+  frames   — { label: DataFrame } as held in weekly_data, plus the
+             pd.concat + groupby every calculation used to run
+  compact  — SalesHistory.from_frames: item dictionary + float32
+             item × week arrays, summed directly
+
+The same comparison is made for the per-business-date daily_sales frame
+against SalesHistory.from_daily.
+
+Usage:
+    python benchmarks/memory_benchmark.py --items 150 --weeks 52
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("HIGHDIVE_DATA_DIR", tempfile.mkdtemp(prefix="highdive-bench-"))
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+
+import pandas as pd
+
+from run_benchmarks import app, time_stage
+from synthetic_data import generate_dataset, workbook_bytes
+
+
+def frames_bytes(frames):
+    return sum(int(df.memory_usage(deep=True).sum()) for df in frames)
+
+
+def weekly_concat_totals(weekly_data):
+    """The layout compute_weekly_ingredient_totals used before SalesHistory"""
+    combined = pd.concat(list(weekly_data.values()), ignore_index=True)
+    return combined.groupby("Item")["Qty sold"].sum()
+
+
+def report(name, frame_mb, compact_mb, frame_ms, compact_ms):
+    print(f"{name:<10} {frame_mb:>10.2f} MB {compact_mb:>10.2f} MB "
+          f"{frame_mb / compact_mb:>7.1f}x {frame_ms:>10.2f} ms {compact_ms:>10.2f} ms "
+          f"{frame_ms / max(compact_ms, 1e-6):>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sales history memory footprint")
+    parser.add_argument("--items", type=int, default=150)
+    parser.add_argument("--weeks", type=int, default=52)
+    parser.add_argument("--checks-per-day", type=int, default=250)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    dataset = generate_dataset(items=args.items, days=args.weeks * 7,
+                               checks_per_day=args.checks_per_day, seed=args.seed)
+    location = next(iter(dataset["locations"].values()))
+    weekly_data = {label: app.load_toast_data_from_file(io.BytesIO(workbook_bytes(df)))
+                   for label, df in location["product_mix"].items()}
+    daily_sales = app.aggregate_toast_orders_to_daily_sales(location["orders"])
+    print(f"{args.weeks} weeks, {args.items} items, {len(location['orders']):,} orders "
+          f"(generated in {time.perf_counter() - t0:.1f}s)\n")
+
+    weekly_history = app.SalesHistory.from_frames(weekly_data)
+    daily_history = app.SalesHistory.from_daily(daily_sales)
+
+    print(f"{'':<10} {'frames':>13} {'compact':>13} {'':>8} {'frames':>13} {'compact':>13}")
+    print(f"{'':<10} {'memory':>13} {'memory':>13} {'':>8} {'item totals':>13} {'item totals':>13}")
+    report("weekly",
+           frames_bytes(weekly_data.values()) / 1e6, weekly_history.nbytes / 1e6,
+           time_stage(lambda: weekly_concat_totals(weekly_data), args.repeat),
+           time_stage(weekly_history.item_totals, args.repeat))
+    report("daily",
+           frames_bytes([daily_sales]) / 1e6, daily_history.nbytes / 1e6,
+           time_stage(lambda: daily_sales.groupby("Item")["Qty sold"].sum(), args.repeat),
+           time_stage(daily_history.item_totals, args.repeat))
+
+    print(f"\nBuilding the compact history once: weekly "
+          f"{time_stage(lambda: app.SalesHistory.from_frames(weekly_data), args.repeat):.1f} ms, "
+          f"daily {time_stage(lambda: app.SalesHistory.from_daily(daily_sales), args.repeat):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
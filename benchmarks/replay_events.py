@@ -0,0 +1,199 @@
+"""
+TOAST EVENT REPLAYER
+Posts order events to the webhook receiver and checks the counts it keeps
+
+Turns a batch of orders (synthetic, or an orders.json written by
+synthetic_data.py) into the stream a live restaurant produces: each order
+created, some re-sent, some updated (quantity changed) or voided later, and
+some stale versions delivered after newer ones. Events are shuffled within
+a window so they arrive slightly out of order.
+
+--verify then compares the receiver's per-day item counts with the final
+state of every order. --serve starts a receiver in-process on a temporary
+database, so the whole round trip runs with one command.
+
+Usage:
+    python benchmarks/replay_events.py --serve --verify
+    python benchmarks/replay_events.py --url http://127.0.0.1:8765 --orders synthetic/location_1/orders.json
+"""
+
+import argparse
+import copy
+import hashlib
+import hmac
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+
+from synthetic_data import generate_dataset
+
+WEBHOOK_PATH = "/webhooks/toast"
+
+
+def bump_modified(order, minutes):
+    opened = datetime.strptime(order["openedDate"][:19], "%Y-%m-%dT%H:%M:%S")
+    order["modifiedDate"] = (opened + timedelta(minutes=minutes)).strftime(
+        "%Y-%m-%dT%H:%M:%S.000+0000")
+
+
+def build_events(orders, duplicates=0.1, updates=0.05, voids=0.02, stale=0.02,
+                 shuffle_window=20, seed=0):
+    """
+    Event stream for orders plus the final version of every order.
+    Returns (events, final) — events are webhook envelopes.
+    """
+    rng = random.Random(seed)
+    events, final = [], {}
+
+    def envelope(order, event_type):
+        return {"timestamp": order.get("modifiedDate") or order["openedDate"],
+                "eventCategory": "orders", "eventType": event_type,
+                "guid": f"{order['guid']}-{len(events)}",
+                "details": {"restaurantGuid": order.get("restaurantGuid"),
+                            "order": copy.deepcopy(order)}}
+
+    for base in orders:
+        order = copy.deepcopy(base)
+        bump_modified(order, 1)
+        events.append(envelope(order, "order_created"))
+        if rng.random() < duplicates:
+            events.append(envelope(order, "order_updated"))
+        versions = [copy.deepcopy(order)]
+        if rng.random() < updates:
+            order = copy.deepcopy(order)
+            selection = order["checks"][0]["selections"][0]
+            selection["quantity"] = selection["quantity"] + 1
+            bump_modified(order, 15)
+            versions.append(copy.deepcopy(order))
+            events.append(envelope(order, "order_updated"))
+        if rng.random() < voids:
+            order = copy.deepcopy(order)
+            order["voided"] = True
+            bump_modified(order, 30)
+            versions.append(copy.deepcopy(order))
+            events.append(envelope(order, "order_updated"))
+        if len(versions) > 1 and rng.random() < stale / max(updates + voids, 1e-9):
+            events.append(envelope(versions[0], "order_updated"))
+        final[order["guid"]] = order
+
+    # Deliver slightly out of order, as webhooks do
+    for start in range(0, len(events), shuffle_window):
+        window = events[start:start + shuffle_window]
+        rng.shuffle(window)
+        events[start:start + shuffle_window] = window
+    return events, final
+
+
+def expected_counts(final_orders):
+    """{ business date: { item: qty } } from the final order versions"""
+    days = {}
+    for order in final_orders.values():
+        if order.get("voided") or order.get("deleted"):
+            continue
+        day = days.setdefault(str(order["businessDate"]), {})
+        for check in order.get("checks", []):
+            if check.get("voided"):
+                continue
+            for sel in check.get("selections", []):
+                if sel.get("voided") or sel.get("deferred"):
+                    continue
+                name = sel.get("displayName") or sel.get("name", "Unknown")
+                day[name] = day.get(name, 0) + sel.get("quantity", 1)
+    return days
+
+
+def post(url, payload, secret=None):
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["Toast-Signature"] = base64.b64encode(
+            hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+    req = urllib.request.Request(url + WEBHOOK_PATH, data=body, headers=headers, method="POST")
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read())
+
+
+def get(url, path):
+    with urllib.request.urlopen(url + WEBHOOK_PATH + path, timeout=30) as resp:
+        return json.loads(resp.read())
+
+
+def serve_in_process(secret):
+    """Start the app's receiver on a free port against a temporary database"""
+    os.environ.setdefault("HIGHDIVE_DATA_DIR", tempfile.mkdtemp(prefix="highdive-replay-"))
+    from run_benchmarks import app
+    import threading
+    store = app.LiveOrderStore(Path(os.environ["HIGHDIVE_DATA_DIR"]) / "replay.db")
+    server = app.make_webhook_server(store, "127.0.0.1", 0, secret)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Toast order events")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--serve", action="store_true",
+                        help="start a receiver in-process instead of posting to --url")
+    parser.add_argument("--orders", type=Path, help="orders.json (default: synthetic)")
+    parser.add_argument("--days", type=int, default=3, help="synthetic days")
+    parser.add_argument("--checks-per-day", type=int, default=150)
+    parser.add_argument("--duplicates", type=float, default=0.1)
+    parser.add_argument("--updates", type=float, default=0.05)
+    parser.add_argument("--voids", type=float, default=0.02)
+    parser.add_argument("--stale", type=float, default=0.02)
+    parser.add_argument("--batch", type=int, default=1, help="events per POST")
+    parser.add_argument("--rate", type=float, default=0, help="events per second (0 = as fast as possible)")
+    parser.add_argument("--secret", default=os.environ.get("HIGHDIVE_WEBHOOK_SECRET", ""))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verify", action="store_true")
+    args = parser.parse_args()
+
+    if args.orders:
+        orders = json.loads(args.orders.read_text())
+    else:
+        dataset = generate_dataset(items=60, days=args.days, checks_per_day=args.checks_per_day,
+                                   start=date.today() - timedelta(days=args.days - 1),
+                                   seed=args.seed)
+        orders = next(iter(dataset["locations"].values()))["orders"]
+    events, final = build_events(orders, args.duplicates, args.updates, args.voids,
+                                 args.stale, seed=args.seed)
+    url = serve_in_process(args.secret) if args.serve else args.url.rstrip("/")
+
+    results = {}
+    t0 = time.perf_counter()
+    for i in range(0, len(events), args.batch):
+        batch = events[i:i + args.batch]
+        for result in post(url, batch if args.batch > 1 else batch[0], args.secret)["results"]:
+            results[result] = results.get(result, 0) + 1
+        if args.rate:
+            time.sleep(len(batch) / args.rate)
+    elapsed = time.perf_counter() - t0
+    print(f"{len(events):,} events for {len(orders):,} orders in {elapsed:.1f}s "
+          f"({len(events) / elapsed:,.0f}/s): "
+          + ", ".join(f"{v:,} {k}" for k, v in sorted(results.items())))
+
+    if args.verify:
+        expected = expected_counts(final)
+        mismatches = 0
+        for day, items in sorted(expected.items()):
+            got = get(url, f"/days?date={day}")["items"]
+            bad = {i: (q, got.get(i, 0)) for i, q in items.items() if abs(got.get(i, 0) - q) > 1e-6}
+            bad.update({i: (0, q) for i, q in got.items() if i not in items and abs(q) > 1e-6})
+            mismatches += len(bad)
+            print(f"  {day}: {sum(items.values()):,} items expected, "
+                  f"{sum(got.values()):,.0f} received" + (f", {len(bad)} mismatched" if bad else " ✓"))
+        sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
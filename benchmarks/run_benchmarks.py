@@ -0,0 +1,248 @@
+"""
+BENCHMARK SUITE
+Times each stage of the pipeline on synthetic data and checks for regressions
+
+Stages: Product Mix ingest, Toast order flattening and aggregation, weekly
+ingredient totals, daily usage history, order building for every vendor
+window of a week, order export (xlsx / pdf) and the stock simulation.
+Each stage runs once to warm up, then --repeat times; the fastest run is
+kept, as it is the least disturbed by whatever else the machine is doing.
+
+Baselines live in benchmarks/baselines.json. --check fails (exit 1) when a
+stage is slower than its baseline by more than the threshold ratio *and*
+by more than min_delta_ms, so millisecond noise on tiny stages is ignored.
+
+Usage:
+    python benchmarks/run_benchmarks.py                      # small + medium
+    python benchmarks/run_benchmarks.py --scale large
+    python benchmarks/run_benchmarks.py --save-baseline      # record this machine
+    python benchmarks/run_benchmarks.py --check              # compare to baselines
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# The app opens its SQLite stores at import time — keep benchmark runs away
+# from the real data directory
+os.environ.setdefault("HIGHDIVE_DATA_DIR", tempfile.mkdtemp(prefix="highdive-bench-"))
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+sys.path.insert(0, str(HERE.parent))
+
+import numpy as np
+import pandas as pd
+
+# Importing the app outside `streamlit run` executes the page script in bare
+# mode, which logs a warning per widget — keep them off the terminal
+import streamlit.logger
+_stderr = os.dup(2)
+with open(os.devnull, "w") as devnull:
+    os.dup2(devnull.fileno(), 2)
+    try:
+        import streamlit_app as app
+    finally:
+        os.dup2(_stderr, 2)
+        os.close(_stderr)
+streamlit.logger.set_log_level("ERROR")
+from synthetic_data import generate_dataset, workbook_bytes
+
+BASELINE_PATH = HERE / "baselines.json"
+DEFAULT_THRESHOLD = 1.50
+DEFAULT_MIN_DELTA_MS = 10.0
+
+SCALES = {
+    "small":  {"items": 40,  "days": 28, "checks_per_day": 200,  "selections_per_check": 3},
+    "medium": {"items": 150, "days": 56, "checks_per_day": 600,  "selections_per_check": 3},
+    "large":  {"items": 400, "days": 91, "checks_per_day": 1500, "selections_per_check": 4,
+               "ingredients": 300},
+}
+DEFAULT_SCALES = ["small", "medium"]
+
+DAY_ADJUSTMENTS = {d: 0 for d in app.DAY_ORDER}
+WASTE_FACTOR = 1.10
+
+
+def time_stage(fn, repeat):
+    """Best wall time (ms) of fn over repeat runs after one warm-up"""
+    fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return min(times)
+
+
+def build_stages(dataset):
+    """
+    { stage name: zero-argument callable } for one synthetic dataset.
+    Inputs each stage needs are prepared here, outside the timed calls.
+    """
+    recipes, vendor_mapping = dataset["recipes"], dataset["vendor_mapping"]
+    location = next(iter(dataset["locations"].values()))
+    orders = location["orders"]
+    product_mix = location["product_mix"]
+    workbook = workbook_bytes(next(iter(product_mix.values())))
+
+    matrix = app.compile_recipe_matrix(recipes, vendor_mapping)
+    weekly_data = product_mix
+    daily_sales = app.aggregate_toast_orders_to_daily_sales(orders)
+    daily_modifiers = app.aggregate_toast_modifiers(orders, daily=True)
+    modifier_data = {label: app.aggregate_toast_modifiers(orders) for label in weekly_data}
+    ingredient_totals, _, _, _ = app.compute_weekly_ingredient_totals(
+        weekly_data, recipes, vendor_mapping)
+
+    schedules = app.DEFAULT_VENDOR_SCHEDULES
+    exceptions = app.EMPTY_CALENDAR_EXCEPTIONS
+    start = dataset["start"] + timedelta(days=dataset["days"])
+    calendar = app.DeliveryCalendar(schedules, start - timedelta(days=7), 28, exceptions)
+    week = [start + timedelta(days=i) for i in range(7)]
+    windows = [w for w in calendar.windows if w["order_date"] in week]
+
+    def build_orders():
+        built = []
+        builder = app.OrderBuilder(ingredient_totals, DAY_ADJUSTMENTS, WASTE_FACTOR)
+        for w in windows:
+            df = builder.build(w["vendor"], w["order"]["covers"],
+                               coverage_weights=calendar.usage_weights(w))
+            built.append({"vendor": w["vendor"], "full_name": schedules[w["vendor"]]["full_name"],
+                          "color": schedules[w["vendor"]].get("color", "#0f3460"),
+                          "window": w["window"], "order_date": w["order_date"],
+                          "delivery_date": w["delivery_date"],
+                          "coverage_days": [f"{d:%a %m/%d}" for d in calendar.usage_weights(w)],
+                          "order_df": df})
+        return built
+
+    built_orders = [o for o in build_orders() if not o["order_df"].empty]
+    history = app.DailyUsageHistory(daily_sales, matrix)
+
+    return {
+        "ingest.product_mix_xlsx": lambda: app.load_toast_data_from_file(io.BytesIO(workbook)),
+        "ingest.flatten_orders": lambda: app.flatten_toast_orders(orders),
+        "aggregate.product_mix": lambda: app.aggregate_toast_orders_to_product_mix(orders),
+        "aggregate.daily_sales": lambda: app.aggregate_toast_orders_to_daily_sales(orders),
+        "aggregate.modifiers": lambda: app.aggregate_toast_modifiers(orders, daily=True),
+        "recipes.compile_matrix": lambda: app.compile_recipe_matrix(recipes, vendor_mapping),
+        "usage.weekly_totals": lambda: app.compute_weekly_ingredient_totals(
+            weekly_data, recipes, vendor_mapping, modifier_data),
+        "usage.daily_history": lambda: app.DailyUsageHistory(
+            daily_sales, matrix, daily_modifiers, app.load_modifier_deltas()),
+        "orders.all_vendors": build_orders,
+        "export.xlsx": lambda: app.export_orders(built_orders, "xlsx"),
+        "export.pdf": lambda: app.render_order_sheets_pdf(built_orders),
+        "simulation.stock_200": lambda: app.run_inventory_simulation(
+            ingredient_totals, matrix, schedules, exceptions, start, 28, DAY_ADJUSTMENTS,
+            WASTE_FACTOR, history=history, samples=200),
+    }
+
+
+def run_scale(scale, repeat, seed, only=None):
+    """{ stage: best ms } plus dataset size details for one scale"""
+    params = SCALES[scale]
+    t0 = time.perf_counter()
+    dataset = generate_dataset(seed=seed, **params)
+    location = next(iter(dataset["locations"].values()))
+    selections = sum(len(c["selections"]) for o in location["orders"] for c in o["checks"])
+    print(f"\n[{scale}] {params['items']} items, {params['days']} days, "
+          f"{len(location['orders']):,} orders, {selections:,} selections "
+          f"(generated in {time.perf_counter() - t0:.1f}s)")
+
+    results = {}
+    for name, fn in build_stages(dataset).items():
+        if only and not any(name.startswith(o) for o in only):
+            continue
+        results[name] = round(time_stage(fn, repeat), 2)
+        print(f"  {name:<28} {results[name]:>10.2f} ms")
+    return {"orders": len(location["orders"]), "selections": selections, "stages": results}
+
+
+def machine_info():
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def load_baselines():
+    if BASELINE_PATH.exists():
+        with open(BASELINE_PATH) as f:
+            return json.load(f)
+    return {"threshold": DEFAULT_THRESHOLD, "min_delta_ms": DEFAULT_MIN_DELTA_MS, "scales": {}}
+
+
+def check_regressions(results, baselines, threshold, min_delta_ms):
+    """List of (scale, stage, baseline ms, current ms) over the threshold"""
+    regressions = []
+    for scale, run in results.items():
+        base = baselines.get("scales", {}).get(scale, {}).get("stages", {})
+        for stage, ms in run["stages"].items():
+            if stage not in base:
+                continue
+            if ms > base[stage] * threshold and ms - base[stage] > min_delta_ms:
+                regressions.append((scale, stage, base[stage], ms))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HighDive pipeline benchmarks")
+    parser.add_argument("--scale", action="append", choices=list(SCALES),
+                        help=f"repeatable; default {' + '.join(DEFAULT_SCALES)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stage", action="append",
+                        help="only stages starting with this prefix (repeatable)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write these results to benchmarks/baselines.json")
+    parser.add_argument("--check", action="store_true",
+                        help="exit 1 when a stage regresses past the baseline threshold")
+    parser.add_argument("--threshold", type=float, help="slowdown ratio that counts as a regression")
+    parser.add_argument("--json", type=Path, help="also write results to this file")
+    args = parser.parse_args()
+
+    results = {s: run_scale(s, args.repeat, args.seed, args.stage)
+               for s in (args.scale or DEFAULT_SCALES)}
+    if args.json:
+        args.json.write_text(json.dumps({"machine": machine_info(), "scales": results}, indent=2))
+
+    baselines = load_baselines()
+    threshold = args.threshold or baselines.get("threshold", DEFAULT_THRESHOLD)
+    min_delta_ms = baselines.get("min_delta_ms", DEFAULT_MIN_DELTA_MS)
+
+    if args.save_baseline:
+        baselines.update(machine=machine_info(),
+                         recorded=datetime.now().strftime("%Y-%m-%d"), seed=args.seed,
+                         threshold=threshold, min_delta_ms=min_delta_ms)
+        for scale, run in results.items():
+            saved = baselines["scales"].setdefault(scale, {"params": SCALES[scale], "stages": {}})
+            saved.update(params=SCALES[scale], orders=run["orders"], selections=run["selections"])
+            saved["stages"].update(run["stages"])
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=2) + "\n")
+        print(f"\nBaselines saved to {BASELINE_PATH.relative_to(HERE.parent)}")
+
+    if args.check:
+        if baselines.get("machine") and baselines["machine"] != machine_info():
+            print("\nNote: baselines were recorded on a different machine or library versions")
+        regressions = check_regressions(results, baselines, threshold, min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {threshold:.2f}x baseline:")
+            for scale, stage, base, ms in regressions:
+                print(f"  [{scale}] {stage}: {base:.2f} → {ms:.2f} ms ({ms / base:.2f}x)")
+            sys.exit(1)
+        print(f"\nNo regressions over {threshold:.2f}x baseline")
+
+
+if __name__ == "__main__":
+    main()
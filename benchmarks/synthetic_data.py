@@ -0,0 +1,279 @@
+"""
+SYNTHETIC RESTAURANT DATA
+Toast-shaped orders and Product Mix workbooks at any scale
+
+Builds a menu from the real recipes (padded with synthetic dishes and
+ingredients when asked for more), then generates orders the way the Toast
+ordersBulk endpoint returns them: checks, selections, nested modifiers,
+voids and UTC timestamps spread over breakfast, lunch and dinner. Product
+Mix workbooks carry the same "Items" sheet the app reads from Toast exports.
+
+Everything is driven by a seed, so the same settings always produce the
+same data.
+
+Usage:
+    python benchmarks/synthetic_data.py --items 120 --days 56 --out synthetic/
+"""
+
+import argparse
+import json
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+
+VENDORS = ["GFS", "WCW", "EVANS", "LAST CALL", "LARDER FOODS", "AMAVIDA"]
+
+# Open Wed–Sun like High Dive; share of the week's checks per weekday (Mon = 0)
+WEEKDAY_SHARE = np.array([0.0, 0.0, 0.18, 0.20, 0.24, 0.26, 0.12])
+
+# (local hour, share of checks, spread in hours)
+MEAL_PEAKS = [(9.0, 0.30, 1.2), (12.5, 0.35, 1.0), (18.5, 0.35, 1.3)]
+
+MODIFIERS = [("Add Avocado", 1.50), ("No Cheese", 0.0), ("Extra Egg", 1.25),
+             ("Add Bacon", 2.00), ("Light Sauce", 0.0), ("Add Salmon", 4.00)]
+
+BEVERAGES = ["Drip Coffee", "Cold Brew", "Iced Tea", "Lemonade", "Draft Beer", "House Wine"]
+
+
+def _uuid(rng):
+    return str(uuid.UUID(bytes=rng.bytes(16)))
+
+
+def load_base_data():
+    """The repo's own recipes and vendor mapping, the seed for every menu"""
+    with open(ROOT / "recipes_imported.json") as f:
+        recipes = json.load(f)
+    with open(ROOT / "vendor_mapping_smart.json") as f:
+        vendor_mapping = json.load(f)
+    return recipes, vendor_mapping
+
+
+def make_menu(num_items, num_ingredients=None, seed=0):
+    """
+    Menu, recipes and vendor mapping with num_items dishes.
+
+    The first dishes are the real recipes; further ones are synthetic and
+    draw 3–8 ingredients from the real ingredients plus num_ingredients
+    synthetic ones (assigned to vendors round-robin). About one item in ten
+    is a beverage with no recipe, as in real Product Mix exports.
+
+    Returns (menu, recipes, vendor_mapping); menu rows are dicts with
+    name, price, category and popularity.
+    """
+    rng = np.random.default_rng(seed)
+    base_recipes, vendor_mapping = load_base_data()
+    recipes = dict(base_recipes)
+    vendor_mapping = dict(vendor_mapping)
+
+    pool = [(ing, d) for r in base_recipes.values() for ing, d in r.items()
+            if not ing.rstrip().endswith(":")]
+    for i in range(num_ingredients or 0):
+        name = f"synthetic ingredient {i + 1:04d}"
+        pool.append((name, {"qty": 1.0, "unit": ["oz", "each", "g", "fl oz"][i % 4]}))
+        vendor_mapping[name] = VENDORS[i % len(VENDORS)]
+
+    food_count = num_items - max(1, num_items // 10)
+    names = [n.title() for n in base_recipes][:food_count]
+    for i in range(len(names), food_count):
+        name = f"Synthetic Dish {i + 1:04d}"
+        picks = rng.choice(len(pool), size=int(rng.integers(3, 9)), replace=False)
+        recipes[name.upper()] = {
+            pool[p][0]: {"qty": round(float(pool[p][1].get("qty", 1) or 1) * rng.uniform(0.5, 1.5), 2),
+                         "unit": pool[p][1].get("unit", "each")}
+            for p in picks
+        }
+        names.append(name)
+
+    beverages = [BEVERAGES[i % len(BEVERAGES)] + ("" if i < len(BEVERAGES) else f" {i + 1}")
+                 for i in range(num_items - len(names))]
+
+    # Zipf-like popularity: a few best sellers and a long tail
+    popularity = 1 / np.arange(1, num_items + 1) ** 0.8
+    popularity = rng.permutation(popularity)
+    menu = [{"name": n, "price": round(float(rng.uniform(9, 19)), 2), "category": "Food",
+             "popularity": float(p)} for n, p in zip(names, popularity)]
+    menu += [{"name": n, "price": round(float(rng.uniform(3, 9)), 2), "category": "Beverage",
+              "popularity": float(p)} for n, p in zip(beverages, popularity[len(names):])]
+    return menu, recipes, vendor_mapping
+
+
+def generate_orders(menu, start, days, checks_per_day=250, selections_per_check=3,
+                    location_guid=None, utc_offset_hours=-5, modifier_rate=0.15,
+                    void_rate=0.01, seed=0):
+    """
+    Toast ordersBulk-shaped orders for one location.
+
+    checks_per_day is the average over open days; the weekday mix follows
+    WEEKDAY_SHARE and check times follow MEAL_PEAKS (local time, stamped
+    in UTC). selections_per_check is the mean of a Poisson draw (min 1).
+    """
+    rng = np.random.default_rng(seed)
+    location_guid = location_guid or _uuid(rng)
+    weights = np.array([m["popularity"] for m in menu])
+    weights = weights / weights.sum()
+    peak_hours = np.array([p[0] for p in MEAL_PEAKS])
+    peak_share = np.array([p[1] for p in MEAL_PEAKS])
+    peak_spread = np.array([p[2] for p in MEAL_PEAKS])
+    open_days = (WEEKDAY_SHARE > 0).sum()
+
+    orders = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        share = WEEKDAY_SHARE[day.weekday()]
+        if share == 0:
+            continue
+        num_checks = int(rng.poisson(checks_per_day * share * open_days))
+        peaks = rng.choice(len(MEAL_PEAKS), size=num_checks, p=peak_share)
+        hours = np.clip(rng.normal(peak_hours[peaks], peak_spread[peaks]), 6.5, 22.5)
+        sizes = np.maximum(1, rng.poisson(selections_per_check, size=num_checks))
+        items = rng.choice(len(menu), size=int(sizes.sum()), p=weights)
+        quantities = np.where(rng.random(len(items)) < 0.08, 2, 1)
+        with_modifier = rng.random(len(items)) < modifier_rate
+        modifier_pick = rng.integers(len(MODIFIERS), size=len(items))
+        voided = rng.random(len(items)) < void_rate
+        business_date = int(day.strftime("%Y%m%d"))
+        midnight_utc = datetime.combine(day, datetime.min.time()) - timedelta(hours=utc_offset_hours)
+
+        k = 0
+        for c in range(num_checks):
+            opened = midnight_utc + timedelta(hours=float(hours[c]))
+            stamp = opened.strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+            selections = []
+            for _ in range(sizes[c]):
+                item = menu[items[k]]
+                modifiers = []
+                if with_modifier[k] and item["category"] == "Food":
+                    mod_name, mod_price = MODIFIERS[modifier_pick[k]]
+                    modifiers.append({"guid": _uuid(rng), "displayName": mod_name,
+                                      "quantity": 1, "price": mod_price,
+                                      "voided": False, "modifiers": []})
+                selections.append({
+                    "guid": _uuid(rng),
+                    "displayName": item["name"],
+                    "quantity": int(quantities[k]),
+                    "price": item["price"],
+                    "voided": bool(voided[k]),
+                    "createdDate": stamp,
+                    "salesCategory": {"name": item["category"]},
+                    "modifiers": modifiers,
+                })
+                k += 1
+            orders.append({
+                "guid": _uuid(rng),
+                "restaurantGuid": location_guid,
+                "businessDate": business_date,
+                "openedDate": stamp,
+                "checks": [{"guid": _uuid(rng), "openedDate": stamp, "voided": False,
+                            "selections": selections}],
+            })
+    return orders
+
+
+def product_mix_frame(orders, menu):
+    """Toast Product Mix "Items" sheet for a batch of orders"""
+    qty, sales = {}, {}
+    for order in orders:
+        for check in order["checks"]:
+            for sel in check["selections"]:
+                if sel["voided"]:
+                    continue
+                name = sel["displayName"]
+                qty[name] = qty.get(name, 0) + sel["quantity"]
+                sales[name] = sales.get(name, 0.0) + sel["price"] * sel["quantity"]
+    categories = {m["name"]: m["category"] for m in menu}
+    df = pd.DataFrame({"Item": list(qty), "Qty sold": list(qty.values()),
+                       "Net sales": [round(sales[n], 2) for n in qty]})
+    df["Sales Category"] = df["Item"].map(categories)
+    return df.sort_values("Qty sold", ascending=False).reset_index(drop=True)
+
+
+def weekly_product_mix(orders, menu, start, days):
+    """{ "ProductMix_<start>_<end>.xlsx": Items frame } per whole week"""
+    by_date = {}
+    for order in orders:
+        by_date.setdefault(order["businessDate"], []).append(order)
+    weeks = {}
+    for w in range(days // 7):
+        first = start + timedelta(days=7 * w)
+        last = first + timedelta(days=6)
+        batch = [o for d in range(7)
+                 for o in by_date.get(int((first + timedelta(days=d)).strftime("%Y%m%d")), [])]
+        weeks[f"ProductMix_{first:%Y-%m-%d}_{last:%Y-%m-%d}.xlsx"] = product_mix_frame(batch, menu)
+    return weeks
+
+
+def workbook_bytes(df):
+    """Product Mix frame as .xlsx bytes"""
+    import io
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        df.to_excel(writer, sheet_name="Items", index=False)
+    return buf.getvalue()
+
+
+def generate_dataset(items=40, locations=1, days=28, checks_per_day=250,
+                     selections_per_check=3, ingredients=0, start=None, seed=0):
+    """
+    A complete synthetic dataset.
+
+    Returns dict: menu, recipes, vendor_mapping, start, days and
+    locations { location_guid: { "orders": [...], "product_mix": { file: df } } }
+    """
+    start = start or date(2026, 1, 5)
+    menu, recipes, vendor_mapping = make_menu(items, ingredients, seed)
+    rng = np.random.default_rng(seed)
+    dataset = {"menu": menu, "recipes": recipes, "vendor_mapping": vendor_mapping,
+               "start": start, "days": days, "locations": {}}
+    for loc in range(locations):
+        guid = _uuid(rng)
+        orders = generate_orders(menu, start, days, checks_per_day, selections_per_check,
+                                 location_guid=guid, seed=seed * 1000 + loc)
+        dataset["locations"][guid] = {
+            "orders": orders,
+            "product_mix": weekly_product_mix(orders, menu, start, days),
+        }
+    return dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Toast data")
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--ingredients", type=int, default=0,
+                        help="synthetic ingredients added to the real ones")
+    parser.add_argument("--locations", type=int, default=1)
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--checks-per-day", type=int, default=250)
+    parser.add_argument("--selections-per-check", type=float, default=3)
+    parser.add_argument("--start", type=lambda s: datetime.strptime(s, "%Y-%m-%d").date(),
+                        default=date(2026, 1, 5))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=Path("synthetic"))
+    args = parser.parse_args()
+
+    dataset = generate_dataset(args.items, args.locations, args.days, args.checks_per_day,
+                               args.selections_per_check, args.ingredients, args.start, args.seed)
+    args.out.mkdir(parents=True, exist_ok=True)
+    with open(args.out / "recipes.json", "w") as f:
+        json.dump(dataset["recipes"], f, indent=2)
+    with open(args.out / "vendor_mapping.json", "w") as f:
+        json.dump(dataset["vendor_mapping"], f, indent=2)
+
+    for n, (guid, data) in enumerate(dataset["locations"].items(), 1):
+        loc_dir = args.out / f"location_{n}"
+        loc_dir.mkdir(exist_ok=True)
+        with open(loc_dir / "orders.json", "w") as f:
+            json.dump(data["orders"], f)
+        for file_name, df in data["product_mix"].items():
+            (loc_dir / file_name).write_bytes(workbook_bytes(df))
+        selections = sum(len(c["selections"]) for o in data["orders"] for c in o["checks"])
+        print(f"location_{n} ({guid}): {len(data['orders']):,} orders, "
+              f"{selections:,} selections, {len(data['product_mix'])} Product Mix weeks")
+
+
+if __name__ == "__main__":
+    main()
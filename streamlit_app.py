@@ -11,14 +11,268 @@ Version: 1.0
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import io
 import json
 import os
+import atexit
+import base64
+import hmac
+import sys
+import re
+import difflib
+import fnmatch
+import hashlib
+import functools
+import time
+import uuid
+import zipfile
+import sqlite3
+import threading
+import multiprocessing
 import requests
+from collections import deque
+from queue import Empty
+from collections.abc import MutableMapping
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 from pathlib import Path
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
 import plotly.graph_objects as go
 import plotly.express as px
 
+# Sessions share cached frames as shallow copies (SharedDatasetCache) and are
+# only isolated from each other's writes under copy-on-write — always on from
+# pandas 3, opt-in before it
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# TELEMETRY (timing spans and counters for the pipeline stages)
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _NoopSpan:
+    """Stand-in returned while telemetry is off — every call does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+    def end(self, error=None):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("telemetry", "name", "attrs", "parent", "started", "wall")
+
+    def __init__(self, telemetry, name, attrs):
+        self.telemetry = telemetry
+        self.name = name
+        self.attrs = attrs
+        stack = telemetry._stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.wall = time.time()
+        self.started = time.perf_counter()
+
+    def set(self, **attrs):
+        """Attach attributes (rows, bytes, vendor, …) to the span"""
+        self.attrs.update(attrs)
+        return self
+
+    def end(self, error=None):
+        elapsed = time.perf_counter() - self.started
+        stack = self.telemetry._stack()
+        if self in stack:
+            stack.remove(self)
+        self.telemetry._record(self, elapsed, error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc_type.__name__ if exc_type else None)
+        return False
+
+
+class Telemetry:
+    """
+    In-process spans and counters, shared by every session of the app.
+
+    Spans record duration plus numeric attributes (rows, bytes) and are
+    summed per name; the most recent max_spans are kept for inspection.
+    When disabled, span() returns a shared no-op and count() returns
+    immediately, so instrumented code pays one attribute check.
+    """
+
+    def __init__(self, enabled=False, max_spans=2000):
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = deque(maxlen=self.max_spans)
+            self.stats = {}
+            self.counters = {}
+            self.since = datetime.now()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, **attrs):
+        """Context manager timing one stage: with telemetry.span("x") as s: s.set(rows=n)"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, attrs)
+
+    def start_run(self, name, **attrs):
+        """Root span for one script run; drops spans a stopped run left open"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        self._local.stack = []
+        return _Span(self, name, attrs)
+
+    def count(self, name, value=1, **labels):
+        """Add to a counter, e.g. count("export_cache", fmt="pdf", result="hit")"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def cache_lookup(self, cache, fn, *args, **kwargs):
+        """
+        Call a memoised fn and count a hit or miss for cache — the memoised
+        body calls mark_miss() when it actually runs.
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        self._local.missed = False
+        result = fn(*args, **kwargs)
+        self.count("cache_lookups", cache=cache, result="miss" if self._local.missed else "hit")
+        return result
+
+    def mark_miss(self):
+        if self.enabled:
+            self._local.missed = True
+
+    def _record(self, span, elapsed, error):
+        with self._lock:
+            self.spans.append({"name": span.name, "parent": span.parent,
+                               "start": datetime.fromtimestamp(span.wall).isoformat(timespec="milliseconds"),
+                               "ms": round(elapsed * 1000, 3), "error": error, **span.attrs})
+            stat = self.stats.get(span.name)
+            if stat is None:
+                stat = self.stats[span.name] = {"count": 0, "seconds": 0.0, "max": 0.0,
+                                                "errors": 0, "rows": 0, "bytes": 0}
+            stat["count"] += 1
+            stat["seconds"] += elapsed
+            stat["max"] = max(stat["max"], elapsed)
+            stat["errors"] += error is not None
+            for key in ("rows", "bytes"):
+                if isinstance(span.attrs.get(key), (int, float, np.integer)):
+                    stat[key] += int(span.attrs[key])
+
+    def summary(self):
+        """DataFrame of per-span totals, slowest first"""
+        with self._lock:
+            rows = [{"Span": name, "Calls": s["count"], "Total ms": s["seconds"] * 1000,
+                     "Mean ms": s["seconds"] * 1000 / s["count"], "Max ms": s["max"] * 1000,
+                     "Rows": s["rows"], "Bytes": s["bytes"], "Errors": s["errors"]}
+                    for name, s in self.stats.items()]
+        if not rows:
+            return pd.DataFrame()
+        return pd.DataFrame(rows).sort_values("Total ms", ascending=False).round(2)
+
+    def counter_table(self):
+        with self._lock:
+            rows = [{"Counter": name, "Labels": ", ".join(f"{k}={v}" for k, v in labels),
+                     "Value": value} for (name, labels), value in sorted(self.counters.items())]
+        return pd.DataFrame(rows)
+
+    def to_json(self):
+        with self._lock:
+            return json.dumps({
+                "since": self.since.isoformat(timespec="seconds"),
+                "stats": self.stats,
+                "counters": [{"name": n, "labels": dict(l), "value": v}
+                             for (n, l), v in self.counters.items()],
+                "spans": list(self.spans),
+            }, indent=2, default=str)
+
+    def to_prometheus(self, prefix="highdive"):
+        """Prometheus text exposition format"""
+        def labels(pairs):
+            if not pairs:
+                return ""
+            return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\")
+                                                   .replace('"', '\\"').replace("\n", "\\n"))
+                                  for k, v in pairs) + "}"
+
+        with self._lock:
+            lines = [f"# HELP {prefix}_span_seconds Time spent in each pipeline stage",
+                     f"# TYPE {prefix}_span_seconds summary"]
+            for name, s in sorted(self.stats.items()):
+                lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {s["count"]}')
+                lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {s["seconds"]:.6f}')
+            for metric, key, kind in (("span_seconds_max", "max", "gauge"),
+                                      ("span_rows_total", "rows", "counter"),
+                                      ("span_bytes_total", "bytes", "counter"),
+                                      ("span_errors_total", "errors", "counter")):
+                lines.append(f"# TYPE {prefix}_{metric} {kind}")
+                lines.extend(f'{prefix}_{metric}{{span="{name}"}} {s[key]}'
+                             for name, s in sorted(self.stats.items()))
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.extend(f"{prefix}_{name}_total{labels(l)} {v}"
+                             for (n, l), v in sorted(self.counters.items()) if n == name)
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource(show_spinner=False)
+def get_telemetry():
+    return Telemetry(enabled=os.environ.get("HIGHDIVE_TELEMETRY", "") == "1")
+
+
+telemetry = get_telemetry()
+
+
+def traced(name, measure=None):
+    """
+    Decorator running a function inside a telemetry span.
+    measure: optional result → { attr: value } (e.g. rows) added to the span
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not telemetry.enabled:
+                return fn(*args, **kwargs)
+            with telemetry.span(name) as span:
+                result = fn(*args, **kwargs)
+                if measure is not None:
+                    span.set(**measure(result))
+                return result
+        return wrapper
+    return decorate
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # TOAST API CLIENT (embedded for single-file deployment)
 # ─────────────────────────────────────────────────────────────────────────────
@@ -73,10 +327,13 @@ class ToastAPIClient:
             "Content-Type": "application/json"
         }
         
-        if method.upper() == "GET":
-            response = requests.get(url, headers=headers, params=params, timeout=60)
-        else:
-            response = requests.post(url, headers=headers, json=params, timeout=60)
+        with telemetry.span("toast.request", endpoint=endpoint) as span:
+            if method.upper() == "GET":
+                response = requests.get(url, headers=headers, params=params, timeout=60)
+            else:
+                response = requests.post(url, headers=headers, json=params, timeout=60)
+            span.set(status=response.status_code, bytes=len(response.content))
+        telemetry.count("toast_requests", status=response.status_code)
         
         if response.status_code == 401:
             self._access_token = None
@@ -103,59 +360,148 @@ class ToastAPIClient:
         params = {"businessDate": business_date, "pageSize": 100, "page": page}
         return self._make_request("GET", "/orders/v2/ordersBulk", params)
     
-    def get_orders_for_date_range(self, start_date: datetime, end_date: datetime) -> list:
-        """Get all orders between two dates"""
-        all_orders = []
+    def get_orders_for_day(self, business_date: str) -> list:
+        """Every page of orders for one business date (YYYYMMDD); raises on API errors"""
+        day_orders = []
+        page = 1
+        while True:
+            orders = self.get_orders_for_business_date(business_date, page)
+            if not orders:
+                break
+            day_orders.extend(orders)
+            if len(orders) < 100:
+                break
+            page += 1
+        return day_orders
+
+    @traced("toast.fetch_range", measure=lambda result: {"rows": len(result[0])})
+    def get_orders_for_date_range(self, start_date: datetime, end_date: datetime) -> tuple:
+        """
+        Get all orders between two dates. A day that fails is skipped, not fatal.
+        Returns (orders, errors) — errors: { business date (YYYYMMDD): message }
+        """
+        all_orders, errors = [], {}
         current_date = start_date
         
         while current_date <= end_date:
             business_date = current_date.strftime("%Y%m%d")
-            page = 1
-            while True:
-                try:
-                    orders = self.get_orders_for_business_date(business_date, page)
-                    if not orders:
-                        break
-                    all_orders.extend(orders)
-                    if len(orders) < 100:
-                        break
-                    page += 1
-                except Exception as e:
-                    st.warning(f"Error fetching {business_date}: {e}")
-                    break
+            try:
+                all_orders.extend(self.get_orders_for_day(business_date))
+            except Exception as e:
+                errors[business_date] = str(e)
             current_date += timedelta(days=1)
         
-        return all_orders
+        return all_orders, errors
 
 
-def aggregate_toast_orders_to_product_mix(orders: list) -> pd.DataFrame:
-    """Convert raw Toast orders into a product mix DataFrame similar to Toast export"""
-    product_mix = {}
-    
+@traced("toast.flatten", measure=lambda result: {"rows": len(result[0]) + len(result[1])})
+def flatten_toast_orders(orders: list):
+    """
+    Flatten raw Toast orders into column arrays in a single pass.
+
+    Returns (selections, modifiers) DataFrames:
+      selections: Business Date, Item, Qty sold, Net sales, Opened — one row per
+                  selection; Opened is the raw UTC timestamp the item was rung in
+      modifiers:  Business Date, Item, Modifier, Qty — one row per applied modifier
+    Modifier Qty is the modifier quantity times its parent's quantity (the
+    selection, or the modifier a nested one hangs off); nested modifiers count
+    against the same menu item.
+    """
+    s_date, s_item, s_qty, s_sales, s_opened = [], [], [], [], []
+    m_date, m_item, m_name, m_qty = [], [], [], []
+
     for order in orders:
-        business_date = order.get("businessDate", "")
-        
+        business_date = str(order.get("businessDate", ""))
+        order_opened = order.get("openedDate")
+
         for check in order.get("checks", []):
             if check.get("voided"):
                 continue
-            
+            check_opened = check.get("openedDate") or order_opened
+
             for selection in check.get("selections", []):
                 if selection.get("voided") or selection.get("deferred"):
                     continue
-                
+
                 item_name = selection.get("displayName") or selection.get("name", "Unknown")
                 quantity = selection.get("quantity", 1)
                 price = selection.get("price", 0) or 0
-                
-                if item_name not in product_mix:
-                    product_mix[item_name] = {"Qty sold": 0, "Net sales": 0.0}
-                
-                product_mix[item_name]["Qty sold"] += quantity
-                product_mix[item_name]["Net sales"] += price * quantity
-    
+
+                s_date.append(business_date)
+                s_item.append(item_name)
+                s_qty.append(quantity)
+                s_sales.append(price * quantity)
+                s_opened.append(selection.get("createdDate") or check_opened)
+
+                stack = [(mod, quantity) for mod in selection.get("modifiers") or []]
+                while stack:
+                    mod, parent_qty = stack.pop()
+                    if mod.get("voided"):
+                        continue
+                    mod_qty = (mod.get("quantity") or 1) * parent_qty
+                    m_date.append(business_date)
+                    m_item.append(item_name)
+                    m_name.append(mod.get("displayName") or mod.get("name", "Unknown"))
+                    m_qty.append(mod_qty)
+                    stack.extend((child, mod_qty) for child in mod.get("modifiers") or [])
+
+    selections = pd.DataFrame({"Business Date": s_date, "Item": s_item,
+                               "Qty sold": s_qty, "Net sales": s_sales, "Opened": s_opened})
+    modifiers = pd.DataFrame({"Business Date": m_date, "Item": m_item,
+                              "Modifier": m_name, "Qty": m_qty})
+    return selections, modifiers
+
+
+@traced("aggregate.product_mix", measure=lambda df: {"rows": len(df)})
+def aggregate_toast_orders_to_product_mix(orders: list, flat=None) -> pd.DataFrame:
+    """
+    Convert raw Toast orders into a product mix DataFrame similar to Toast export.
+    flat: the orders' flatten_toast_orders result, when the caller already has it
+    """
+    selections, _ = flat or flatten_toast_orders(orders)
+    if selections.empty:
+        return pd.DataFrame(columns=["Item", "Qty sold", "Net sales"])
+
     # Convert to DataFrame matching Toast export format
-    rows = [{"Item": item, **data} for item, data in product_mix.items()]
-    return pd.DataFrame(rows)
+    return (selections.groupby("Item", sort=False)[["Qty sold", "Net sales"]]
+            .sum().reset_index())
+
+
+def _parse_business_dates(df):
+    df["Business Date"] = pd.to_datetime(df["Business Date"], format="%Y%m%d", errors="coerce")
+    return df[df["Business Date"].notna()].reset_index(drop=True)
+
+
+@traced("aggregate.daily_sales", measure=lambda df: {"rows": len(df)})
+def aggregate_toast_orders_to_daily_sales(orders: list, flat=None) -> pd.DataFrame:
+    """Convert raw Toast orders into per-business-date item sales (long format)"""
+    selections, _ = flat or flatten_toast_orders(orders)
+    daily = (selections.groupby(["Business Date", "Item"], sort=False)[["Qty sold", "Net sales"]]
+             .sum().reset_index())
+    return _parse_business_dates(daily)
+
+
+@traced("aggregate.modifiers", measure=lambda df: {"rows": len(df)})
+def aggregate_toast_modifiers(orders: list, daily=False, flat=None) -> pd.DataFrame:
+    """Modifier counts per menu item (and per business date when daily)"""
+    _, modifiers = flat or flatten_toast_orders(orders)
+    keys = ["Business Date", "Item", "Modifier"] if daily else ["Item", "Modifier"]
+    agg = modifiers.groupby(keys, sort=False)["Qty"].sum().reset_index()
+    return _parse_business_dates(agg) if daily else agg
+
+
+def merge_daily_sales(existing, new):
+    """Add newly fetched daily rows, replacing any business dates fetched again"""
+    if existing is None or existing.empty:
+        return new.reset_index(drop=True)
+    keep = existing[~existing["Business Date"].isin(new["Business Date"].unique())]
+    return (pd.concat([keep, new], ignore_index=True)
+            .sort_values(["Business Date", "Item"], ignore_index=True))
+
+
+def _without_dates(df, dates):
+    """Daily frame minus the given business dates (None stays None)"""
+    return df[~df["Business Date"].isin(list(dates))] if df is not None and dates else df
 
 
 def get_toast_client():
@@ -171,6 +517,228 @@ def get_toast_client():
         pass
     return None
 
+# ─────────────────────────────────────────────────────────────────────────────
+# BACKGROUND FETCH JOBS (Toast date ranges fetched day by day off the page)
+# ─────────────────────────────────────────────────────────────────────────────
+
+FETCH_JOBS_KEPT = 20
+FETCH_POLL_SECONDS = 1.0
+
+
+class FetchJob:
+    """
+    One Toast date range fetched day by day on a background thread.
+
+    days maps each business date to pending / running / done / failed and
+    orders keeps what every finished day returned, so sessions can fold
+    completed days into their data while the rest are still loading.
+    cancel() stops after the day in flight; resume() starts a new thread
+    over every day that isn't done yet, failed days included.
+    """
+
+    def __init__(self, job_id, client, label, start, end):
+        self.id = job_id
+        self.client = client
+        self.label = label
+        self.days = {start + timedelta(days=i): "pending" for i in range((end - start).days + 1)}
+        self.orders = {}
+        self.errors = {}
+        self.status = "queued"
+        self.created = datetime.now()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._cancel.clear()
+        self.status, self.finished = "running", None
+        self._thread = threading.Thread(target=self._run, name=f"toast-fetch-{self.id}",
+                                        daemon=True)
+        self._thread.start()
+
+    resume = start
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self):
+        with self._lock:
+            todo = sorted(d for d, state in self.days.items() if state != "done")
+        for day in todo:
+            if self._cancel.is_set():
+                break
+            with self._lock:
+                self.days[day] = "running"
+            try:
+                with telemetry.span("toast.fetch_day", job=self.id, date=str(day)) as span:
+                    orders = self.client.get_orders_for_day(day.strftime("%Y%m%d"))
+                    span.set(rows=len(orders))
+            except Exception as e:
+                with self._lock:
+                    self.days[day] = "failed"
+                    self.errors[day] = str(e)
+                continue
+            with self._lock:
+                self.orders[day] = orders
+                self.days[day] = "done"
+                self.errors.pop(day, None)
+        # A cancel that lands during the last day doesn't undo a finished job
+        counts = self.progress()
+        if counts["pending"]:
+            self.status = "cancelled"
+        else:
+            self.status = "failed" if counts["failed"] else "done"
+        self.finished = datetime.now()
+
+    def progress(self):
+        """{ state: number of days }"""
+        with self._lock:
+            counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+            for state in self.days.values():
+                counts[state] += 1
+            return counts
+
+    def completed(self, exclude=()):
+        """{ day: orders } for finished days not in exclude"""
+        with self._lock:
+            return {d: o for d, o in self.orders.items() if d not in exclude}
+
+    def last_completed(self):
+        """Latest day in the unbroken run of done days from the start, or None"""
+        last = None
+        with self._lock:
+            for day in sorted(self.days):
+                if self.days[day] != "done":
+                    break
+                last = day
+        return last
+
+
+class FetchJobs:
+    """Process-wide registry of fetch jobs by id; keeps the newest FETCH_JOBS_KEPT"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, client, label, start, end):
+        job = FetchJob(uuid.uuid4().hex[:8], client, label, start, end)
+        with self._lock:
+            self._jobs[job.id] = job
+            idle = [j for j in self._jobs.values() if not j.running]
+            for old in sorted(idle, key=lambda j: j.created)[:max(0, len(self._jobs) - FETCH_JOBS_KEPT)]:
+                del self._jobs[old.id]
+        job.start()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+
+@st.cache_resource
+def get_fetch_jobs():
+    return FetchJobs()
+
+
+def start_fetch_job(client, label, start, end):
+    """Submit a background fetch and track it in this session"""
+    job = get_fetch_jobs().submit(client, label, start, end)
+    st.session_state.fetch_jobs[job.id] = {"applied": set(), "flat": {}, "was_running": True}
+    telemetry.count("fetch_jobs", result="started")
+    return job
+
+
+def _concat_flat(parts):
+    """Stack (selections, modifiers) pairs from flatten_toast_orders"""
+    return (pd.concat([p[0] for p in parts], ignore_index=True),
+            pd.concat([p[1] for p in parts], ignore_index=True))
+
+
+def apply_fetch_job(job, tracked):
+    """
+    Fold days the job has finished since the last call into this session's
+    datasets. Each day's orders are flattened once and kept in tracked["flat"];
+    the job's dataset is rebuilt from every finished day and covers exactly
+    those days; daily sales, modifiers and the demand profile take just the
+    new ones.
+    Returns the number of days applied.
+    """
+    applied, flat_days = tracked["applied"], tracked.setdefault("flat", {})
+    new = job.completed(exclude=applied)
+    if not new:
+        return 0
+    for day in new:
+        flat_days[day] = flatten_toast_orders(new[day])
+    new_flat = _concat_flat([flat_days[day] for day in sorted(new)])
+    all_flat = _concat_flat([flat_days[day] for day in sorted(flat_days)])
+    if not all_flat[0].empty:
+        st.session_state.weekly_data.add(job.label, aggregate_toast_orders_to_daily_sales(None, flat=all_flat),
+                                         "toast", dates=list(flat_days))
+        st.session_state.modifier_data[job.label] = aggregate_toast_modifiers(None, flat=all_flat)
+    if not new_flat[0].empty:
+        fetched = {pd.Timestamp(day) for day in new}
+        st.session_state.daily_modifiers = _without_dates(
+            st.session_state.daily_modifiers, fetched & st.session_state.live_dates)
+        st.session_state.live_dates -= fetched
+        st.session_state.daily_sales = merge_daily_sales(
+            st.session_state.daily_sales, aggregate_toast_orders_to_daily_sales(None, flat=new_flat))
+        st.session_state.daily_modifiers = merge_daily_sales(
+            st.session_state.daily_modifiers, aggregate_toast_modifiers(None, daily=True, flat=new_flat))
+        ingest_toast_orders_to_profile(None, flat=new_flat)
+        st.session_state.toast_connected = True
+    applied.update(new)
+    return len(new)
+
+
+def fetch_jobs_panel():
+    """Sidebar progress for this session's fetch jobs, applying finished days as it polls"""
+    jobs = get_fetch_jobs()
+    finished_now = False
+    for job_id, tracked in list(st.session_state.fetch_jobs.items()):
+        job = jobs.get(job_id)
+        if job is None:
+            del st.session_state.fetch_jobs[job_id]
+            continue
+        apply_fetch_job(job, tracked)
+        counts = job.progress()
+        total = len(job.days)
+        st.progress(counts["done"] / total,
+                    text=f"{job.label}: {counts['done']}/{total} days"
+                         + (f", {counts['failed']} failed" if counts["failed"] else ""))
+        if job.running:
+            if st.button("⏹ Cancel", key=f"fetch_cancel_{job_id}", use_container_width=True):
+                job.cancel()
+        else:
+            if tracked["was_running"]:
+                tracked["was_running"] = False
+                finished_now = True
+            last = job.last_completed()
+            st.caption(f"{job.status.title()}"
+                       + (f" · complete through {last:%b %d}" if last else ""))
+            if job.errors:
+                with st.expander(f"{len(job.errors)} failed day(s)"):
+                    for day, error in sorted(job.errors.items()):
+                        st.markdown(f"- **{day:%a %b %d}** — {error}")
+            bcol1, bcol2 = st.columns(2)
+            if job.status in ("cancelled", "failed") and bcol1.button(
+                    "▶ Resume", key=f"fetch_resume_{job_id}", use_container_width=True):
+                job.resume()
+                tracked["was_running"] = True
+                st.rerun()
+            if bcol2.button("✖ Dismiss", key=f"fetch_dismiss_{job_id}", use_container_width=True):
+                del st.session_state.fetch_jobs[job_id]
+                st.rerun()
+    if finished_now:
+        st.rerun()
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # PAGE CONFIG
 # ─────────────────────────────────────────────────────────────────────────────
@@ -378,12 +946,23 @@ st.markdown("""
 
 @st.cache_data
 def load_recipes():
-    path = Path(__file__).parent / "recipes_imported.json"
-    if path.exists():
-        with open(path) as f:
-            return json.load(f)
+    """Recipes last imported in the app (data directory), else the bundled set"""
+    for path in (DATA_DIR / "recipes_imported.json",
+                 Path(__file__).parent / "recipes_imported.json"):
+        if path.exists():
+            with open(path) as f:
+                return json.load(f)
     return {}
 
+
+def save_recipes(recipes):
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    path = DATA_DIR / "recipes_imported.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(recipes, indent=1))
+    tmp.replace(path)
+    load_recipes.clear()
+
 @st.cache_data
 def load_vendor_mapping():
     path = Path(__file__).parent / "vendor_mapping_smart.json"
@@ -478,12 +1057,14 @@ def load_vendor_schedules():
 def load_toast_data_from_file(uploaded_file):
     """Load Toast Product Mix data from uploaded Excel file"""
     try:
-        df = pd.read_excel(uploaded_file, sheet_name="Items")
-        df = df[df["Item"].notna()].copy()
-        numeric_cols = ["Qty sold", "Net sales"]
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors="coerce")
+        with telemetry.span("file.product_mix", bytes=getattr(uploaded_file, "size", 0)) as span:
+            df = pd.read_excel(uploaded_file, sheet_name="Items")
+            df = df[df["Item"].notna()].copy()
+            numeric_cols = ["Qty sold", "Net sales"]
+            for col in numeric_cols:
+                if col in df.columns:
+                    df[col] = pd.to_numeric(df[col], errors="coerce")
+            span.set(rows=len(df))
         return df
     except Exception as e:
         st.error(f"Error reading file: {e}")
@@ -552,21 +1133,27 @@ def build_day_of_week_sales(weekly_datasets):
 
     return dow_sales
 
-def calculate_ingredient_usage(sales_df, recipes, vendor_mapping, adjustments=None):
+def is_recipe_meta_line(ingredient):
+    """Plate-cost summary rows ("RECIPE COST:", "MENU PRICE:") aren't ingredients"""
+    return str(ingredient).strip().endswith(":")
+
+@traced("usage.calculate", measure=lambda r: {"rows": len(r[0]), "unmatched": len(r[2])})
+def calculate_ingredient_usage(sales_df, recipes, vendor_mapping, adjustments=None,
+                               item_resolver=None, vendor_resolver=None):
     """
     Given a sales dataframe and recipes, calculate ingredient usage.
     adjustments: dict { item_name: multiplier } for event/weather
+    item_resolver / vendor_resolver: NameResolver overrides (default: shared ones)
     """
     if adjustments is None:
         adjustments = {}
+    item_resolver = item_resolver or get_item_resolver(recipes)
+    vendor_resolver = vendor_resolver or get_vendor_resolver(vendor_mapping)
 
     ingredient_totals = {}
     matched_items = []
     unmatched_items = []
 
-    # Normalise recipe keys to upper for matching
-    recipes_upper = {k.upper(): v for k, v in recipes.items()}
-
     for _, row in sales_df.iterrows():
         item = str(row.get("Item", "")).strip()
         qty  = row.get("Qty sold", 0)
@@ -577,19 +1164,18 @@ def calculate_ingredient_usage(sales_df, recipes, vendor_mapping, adjustments=No
         adj = adjustments.get(item, 1.0)
         qty_adjusted = qty * adj
 
-        recipe_key = item.upper()
-        if recipe_key in recipes_upper:
+        recipe_key = item_resolver.resolve(item)
+        if recipe_key is not None:
             matched_items.append(item)
-            recipe = recipes_upper[recipe_key]
+            recipe = recipes[recipe_key]
             for ingredient, details in recipe.items():
-                ing_lower = ingredient.lower()
-                vendor = vendor_mapping.get(ing_lower,
-                         vendor_mapping.get(ingredient, "UNMAPPED"))
+                if is_recipe_meta_line(ingredient):
+                    continue
                 if ingredient not in ingredient_totals:
                     ingredient_totals[ingredient] = {
                         "qty_used": 0,
                         "unit": details.get("unit", "each"),
-                        "vendor": vendor,
+                        "vendor": resolve_vendor(ingredient, vendor_mapping, vendor_resolver),
                     }
                 ingredient_totals[ingredient]["qty_used"] += details["qty"] * qty_adjusted
         else:
@@ -598,52 +1184,5114 @@ def calculate_ingredient_usage(sales_df, recipes, vendor_mapping, adjustments=No
     return ingredient_totals, matched_items, unmatched_items
 
 
-def build_order_for_vendor(vendor_key, coverage_days, dow_averages,
-                           recipes, vendor_mapping, waste_factor=1.10):
+@traced("usage.weekly_totals", measure=lambda r: {"rows": len(r[0])})
+def compute_weekly_ingredient_totals(weekly_data, recipes, vendor_mapping, modifier_data=None):
+    """
+    Average weekly ingredient usage across every loaded dataset.
+
+    modifier_data: optional { dataset label: modifier counts (Item, Modifier, Qty) }
+        — modifier deltas are added on top of the base recipes
+    Returns: (ingredient_totals, matched, unmatched, history) — history is the
+        SalesHistory the totals were read from
+    """
+    history = sales_history(weekly_data)
+
+    # Item sales across all weeks, straight from the item × period arrays
+    num_weeks = weeks_loaded(weekly_data)
+    item_totals = (pd.DataFrame({"Item": history.items,
+                                 "Qty sold": history.item_totals() / num_weeks})
+                   .sort_values("Item", ignore_index=True))
+
+    ingredient_totals, matched, unmatched = calculate_ingredient_usage(
+        item_totals,
+        recipes,
+        vendor_mapping
+    )
+
+    # A load partly superseded by another counts only for the dates it supplies
+    modifier_frames = [
+        frame if share == 1 else frame.assign(Qty=frame["Qty"] * share)
+        for label in weekly_data if modifier_data and label in modifier_data
+        for frame, share in [(modifier_data[label],
+                              weekly_data.share_in_use(label)
+                              if hasattr(weekly_data, "share_in_use") else 1.0)]
+        if share > 0]
+    if modifier_frames:
+        matrix = get_recipe_matrix(recipes, vendor_mapping)
+        delta, _ = modifier_usage(pd.concat(modifier_frames, ignore_index=True),
+                                  matrix, load_modifier_deltas())
+        for col in np.flatnonzero(delta):
+            ingredient = matrix.ingredients[col]
+            if ingredient not in ingredient_totals:
+                ingredient_totals[ingredient] = {"qty_used": 0, "unit": matrix.units[col],
+                                                 "vendor": matrix.vendors[col]}
+            entry = ingredient_totals[ingredient]
+            entry["qty_used"] = max(0.0, entry["qty_used"] + delta[col] / num_weeks)
+
+    return ingredient_totals, matched, unmatched, history
+
+
+class OrderBuilder:
+    """
+    Weekly ingredient usage compiled once for every vendor window.
+
+    usage is the ingredient × day matrix (weekly qty × day weight × adjustment)
+    in one broadcast; vendor_idx partitions its rows, so an order is a row
+    selection times the window's coverage mask and the waste factor.
+
+    usage: optional ingredient × DAY_ORDER matrix replacing that broadcast,
+        rows in ingredient_totals order (ScenarioEngine.evaluate)
+    """
+
+    def __init__(self, ingredient_totals, day_adjustments, waste_factor=1.10, usage=None):
+        data = list(ingredient_totals.values())
+        self.ingredients = np.array(list(ingredient_totals), dtype=object)
+        self.units = np.array([d["unit"] for d in data], dtype=object)
+        self.weekly = np.array([d["qty_used"] for d in data], dtype=float)
+        self.vendor_idx, vendors = pd.factorize(np.array([d["vendor"] for d in data], dtype=object))
+        self.vendor_codes = {v: i for i, v in enumerate(vendors)}
+        self.row_of = {name: i for i, name in enumerate(self.ingredients)}
+        self.day_factor = self.day_factors(day_adjustments)
+        self.usage = (self.weekly[:, None] * self.day_factor if usage is None
+                      else np.asarray(usage, dtype=float))
+        self.daily = self.usage.round(1)
+        self.waste_factor = waste_factor
+
+    @staticmethod
+    def day_factors(day_adjustments):
+        """Share of a week's usage on each DAY_ORDER day, slider adjustments applied"""
+        return np.array([
+            0.0 if day in CLOSED_DAYS else TYPICAL_WEIGHTS[day] * (1 + day_adjustments.get(day, 0) / 100)
+            for day in DAY_ORDER])
+
+    @staticmethod
+    def coverage_mask(coverage_days=(), coverage_weights=None):
+        """Fraction of each weekday (DAY_ORDER) a window covers"""
+        mask = np.zeros(len(DAY_ORDER))
+        if coverage_weights is not None:
+            for d, frac in coverage_weights.items():
+                mask[d.weekday()] += frac
+        else:
+            mask[[DAY_ORDER.index(day) for day in coverage_days]] = 1.0
+        return mask
+
+    def vendor_rows(self, vendor_key):
+        code = self.vendor_codes.get(vendor_key)
+        return (np.flatnonzero(self.vendor_idx == code) if code is not None
+                else np.empty(0, dtype=np.intp))
+
+    def window_quantities(self, rows, coverage_days=(), coverage_weights=None,
+                          ingredient_coverage=None):
+        """Unrounded order quantity for each of rows over one window"""
+        mask = np.tile(self.coverage_mask(coverage_days, coverage_weights), (len(rows), 1))
+        if ingredient_coverage:
+            position = dict(zip(rows, range(len(rows))))
+            for ingredient, weights in ingredient_coverage.items():
+                i = position.get(self.row_of.get(ingredient))
+                if i is not None:
+                    mask[i] = self.coverage_mask(coverage_weights=weights)
+        window = self.usage[rows] * mask * self.waste_factor
+        return window.sum(axis=1)
+
+    def frame(self, rows, qty):
+        """Order rows for quantities, largest first, zero lines dropped"""
+        order_qty = np.asarray(qty, dtype=float).round(1)
+        keep = rows[order_qty > 0]
+        order_qty = order_qty[order_qty > 0]
+        ranked = np.argsort(-order_qty, kind="stable")
+        keep, order_qty = keep[ranked], order_qty[ranked]
+        order_df = pd.DataFrame(self.daily[keep], columns=[DAY_SHORT[d] for d in DAY_ORDER])
+        order_df.insert(0, "Ingredient", self.ingredients[keep])
+        order_df.insert(1, "Unit", self.units[keep])
+        order_df["ORDER QTY"] = order_qty
+        return order_df
+
+    def build(self, vendor_key, coverage_days=(), coverage_weights=None, ingredient_coverage=None):
+        """One vendor window — see build_vendor_order_df"""
+        rows = self.vendor_rows(vendor_key)
+        if not len(rows):
+            return pd.DataFrame()
+        return self.frame(rows, self.window_quantities(rows, coverage_days, coverage_weights,
+                                                       ingredient_coverage))
+
+
+@traced("order.build", measure=lambda df: {"rows": len(df)})
+def build_vendor_order_df(ingredient_totals, vendor_key, coverage_days,
+                          day_adjustments, waste_factor=1.10, coverage_weights=None,
+                          ingredient_coverage=None):
+    """
+    Spread weekly ingredient usage across the week for one vendor window.
+
+    ingredient_totals: output of calculate_ingredient_usage (weekly basis)
+    coverage_weights: optional { date: fraction } of open days from
+        DeliveryCalendar.usage_weights — when given the order covers those
+        dates (holidays, fractional cover_days) instead of coverage_days
+    ingredient_coverage: optional { ingredient: { date: fraction } } overriding
+        the window's coverage for single ingredients (ShelfLifePlan.window_coverage)
+    Returns: DataFrame with Ingredient, Unit, one column per day and ORDER QTY
+        (largest first)
+
+    Building several windows from the same totals? Make one OrderBuilder and
+    call build for each instead.
+    """
+    return OrderBuilder(ingredient_totals, day_adjustments, waste_factor).build(
+        vendor_key, coverage_days, coverage_weights, ingredient_coverage)
+
+
+def order_fingerprint(weekly_data, recipes, vendor_mapping, day_adjustments,
+                      vendor_key, order_window, waste_pct, modifier_data=None):
+    """
+    Stable hash of every input that feeds an order.
+
+    Two orders with the same fingerprint were computed from identical sales
+    data, modifiers, recipes, mapping, adjustments and buffer.
+    """
+    h = hashlib.sha1()
+    if hasattr(weekly_data, "meta"):
+        # Which load supplies which date depends on load order and merge policy
+        h.update(json.dumps(weekly_data.versions(), default=str).encode())
+    for label in sorted(weekly_data):
+        h.update(label.encode())
+        if hasattr(weekly_data, "versions"):
+            # Content versions already hash every column — no need to re-read
+            h.update(weekly_data.version(label).encode())
+            if hasattr(modifier_data, "versions") and label in modifier_data:
+                h.update(modifier_data.version(label).encode())
+            continue
+        df = weekly_data[label]
+        cols = [c for c in ("Item", "Qty sold") if c in df.columns]
+        h.update(pd.util.hash_pandas_object(df[cols], index=False).values.tobytes())
+        mods = (modifier_data or {}).get(label)
+        if mods is not None and not mods.empty:
+            h.update(pd.util.hash_pandas_object(mods[["Item", "Modifier", "Qty"]],
+                                                index=False).values.tobytes())
+    h.update(json.dumps(recipes, sort_keys=True).encode())
+    h.update(json.dumps(vendor_mapping, sort_keys=True).encode())
+    h.update(json.dumps(day_adjustments, sort_keys=True).encode())
+    h.update(json.dumps([vendor_key, order_window, waste_pct], sort_keys=True,
+                        default=str).encode())
+    return h.hexdigest()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# ORDER LEDGER (append-only order history)
+# ─────────────────────────────────────────────────────────────────────────────
+
+DATA_DIR = Path(os.environ.get("HIGHDIVE_DATA_DIR", Path(__file__).parent / "data"))
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ledger_orders (
+    order_id      INTEGER PRIMARY KEY,
+    vendor        TEXT    NOT NULL,
+    order_window  TEXT    NOT NULL,
+    order_date    INTEGER NOT NULL,
+    delivery_date INTEGER NOT NULL,
+    coverage      TEXT    NOT NULL,
+    waste_pct     REAL    NOT NULL,
+    fingerprint   TEXT    NOT NULL,
+    created_at    TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_ledger_vendor_date ON ledger_orders (vendor, delivery_date);
+CREATE INDEX IF NOT EXISTS ix_ledger_date ON ledger_orders (delivery_date);
+
+CREATE TABLE IF NOT EXISTS ledger_ingredients (
+    ingredient_id INTEGER PRIMARY KEY,
+    name          TEXT NOT NULL UNIQUE,
+    unit          TEXT NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS ledger_lines (
+    order_id      INTEGER NOT NULL,
+    ingredient_id INTEGER NOT NULL,
+    qty           REAL    NOT NULL,
+    PRIMARY KEY (order_id, ingredient_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_lines_ingredient ON ledger_lines (ingredient_id, order_id);
+
+CREATE TRIGGER IF NOT EXISTS ledger_orders_no_update BEFORE UPDATE ON ledger_orders
+BEGIN SELECT RAISE(ABORT, 'order ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS ledger_orders_no_delete BEFORE DELETE ON ledger_orders
+BEGIN SELECT RAISE(ABORT, 'order ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS ledger_lines_no_update BEFORE UPDATE ON ledger_lines
+BEGIN SELECT RAISE(ABORT, 'order ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS ledger_lines_no_delete BEFORE DELETE ON ledger_lines
+BEGIN SELECT RAISE(ABORT, 'order ledger is append-only'); END;
+"""
+
+
+class OrderLedger:
+    """
+    Append-only history of generated vendor orders, stored in SQLite.
+
+    Dates are stored as proleptic ordinals and ingredient names are interned
+    into a lookup table, so years of orders stay small and every query by
+    vendor or date range is answered from an index.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(LEDGER_SCHEMA)
+
+    def _ingredient_ids(self, lines):
+        """Intern ingredient names, returning { name: ingredient_id }"""
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO ledger_ingredients (name, unit) VALUES (?, ?)",
+            [(name, unit or "") for name, (_, unit) in lines.items()]
+        )
+        names = list(lines)
+        ids = {}
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            ids.update(self._conn.execute(
+                f"SELECT name, ingredient_id FROM ledger_ingredients WHERE name IN ({marks})",
+                chunk
+            ).fetchall())
+        return ids
+
+    def record(self, vendor, order_window, order_date, delivery_date,
+               coverage_days, lines, fingerprint, waste_pct=0):
+        """
+        Append an order. lines: { ingredient: (qty, unit) }
+
+        Re-recording the same inputs for the same delivery is a no-op and
+        returns the existing order id.
+        """
+        with self._lock, self._conn:
+            existing = self._conn.execute(
+                "SELECT order_id, fingerprint FROM ledger_orders "
+                "WHERE vendor = ? AND delivery_date = ? AND order_window = ? "
+                "ORDER BY order_id DESC LIMIT 1",
+                (vendor, delivery_date.toordinal(), order_window)
+            ).fetchone()
+            if existing and existing[1] == fingerprint:
+                return existing[0]
+
+            cur = self._conn.execute(
+                "INSERT INTO ledger_orders (vendor, order_window, order_date, delivery_date, "
+                "coverage, waste_pct, fingerprint, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (vendor, order_window, order_date.toordinal(), delivery_date.toordinal(),
+                 ",".join(coverage_days), float(waste_pct), fingerprint,
+                 datetime.now().isoformat(timespec="seconds"))
+            )
+            order_id = cur.lastrowid
+            ids = self._ingredient_ids(lines)
+            self._conn.executemany(
+                "INSERT INTO ledger_lines (order_id, ingredient_id, qty) VALUES (?, ?, ?)",
+                [(order_id, ids[name], float(qty)) for name, (qty, _) in lines.items()]
+            )
+            return order_id
+
+    def orders(self, vendor=None, start=None, end=None, limit=None):
+        """Order headers, newest delivery first, filtered by vendor and date range"""
+        where, params = [], []
+        if vendor:
+            where.append("vendor = ?")
+            params.append(vendor)
+        if start:
+            where.append("delivery_date >= ?")
+            params.append(start.toordinal())
+        if end:
+            where.append("delivery_date <= ?")
+            params.append(end.toordinal())
+        sql = "SELECT * FROM ledger_orders"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY delivery_date DESC, order_id DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            df = pd.read_sql_query(sql, self._conn, params=params)
+        for col in ("order_date", "delivery_date"):
+            df[col] = [datetime.fromordinal(int(d)).date() for d in df[col]]
+        return df
+
+    def lines(self, order_id):
+        """Ingredient quantities for one order"""
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT i.name AS Ingredient, l.qty AS Qty, i.unit AS Unit "
+                "FROM ledger_lines l JOIN ledger_ingredients i USING (ingredient_id) "
+                "WHERE l.order_id = ? ORDER BY l.qty DESC",
+                self._conn, params=(int(order_id),)
+            )
+
+    def previous_order(self, vendor, order_window, before_date):
+        """Most recent order id for the same vendor window delivered before a date"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT order_id FROM ledger_orders "
+                "WHERE vendor = ? AND order_window = ? AND delivery_date < ? "
+                "ORDER BY delivery_date DESC, order_id DESC LIMIT 1",
+                (vendor, order_window, before_date.toordinal())
+            ).fetchone()
+        return row[0] if row else None
+
+    def ordered_totals(self, start, end, vendor=None):
+        """Total quantity ordered per ingredient for deliveries in [start, end]"""
+        sql = ("SELECT i.name AS Ingredient, i.unit AS Unit, o.vendor AS Vendor, "
+               "SUM(l.qty) AS Ordered "
+               "FROM ledger_orders o JOIN ledger_lines l USING (order_id) "
+               "JOIN ledger_ingredients i USING (ingredient_id) "
+               "WHERE o.delivery_date BETWEEN ? AND ?")
+        params = [start.toordinal(), end.toordinal()]
+        if vendor:
+            sql += " AND o.vendor = ?"
+            params.append(vendor)
+        sql += " GROUP BY i.ingredient_id, o.vendor ORDER BY Ordered DESC"
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+    def compare(self, current_lines, previous_id):
+        """
+        Diff an order against a recorded one.
+
+        current_lines: { ingredient: qty }
+        Returns: DataFrame with Ingredient, Current, Previous, Change, Change %
+        """
+        prev = self.lines(previous_id).set_index("Ingredient")["Qty"] if previous_id else pd.Series(dtype=float)
+        cur = pd.Series(current_lines, dtype=float)
+        diff = pd.concat([cur.rename("Current"), prev.rename("Previous")], axis=1).fillna(0.0)
+        diff["Change"] = diff["Current"] - diff["Previous"]
+        prev_nonzero = diff["Previous"].where(diff["Previous"] != 0)
+        diff["Change %"] = (diff["Change"] / prev_nonzero * 100).round(1)
+        diff.index.name = "Ingredient"
+        return diff.reset_index().sort_values("Current", ascending=False, ignore_index=True)
+
+
+@st.cache_resource
+def get_order_ledger():
+    return OrderLedger(DATA_DIR / "highdive.db")
+
+
+def order_window_label(order):
+    return f"{order['order_day']} → {order['delivery_day']}"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# NAME RESOLUTION (Toast item names → recipes, ingredients → vendor mapping)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Words that describe portion or size rather than the dish itself
+# Words naming the standard portion, dropped when matching. Words that change
+# the portion ("Double", "Half", "Lg") are kept, so "Double X" doesn't count
+# as one X — link such items with an alias if they really are the recipe.
+SIZE_WORDS = {"reg", "regular", "single", "full", "whole", "each", "ea"}
+PORTION_WORDS = {"sm", "small", "lg", "large", "med", "medium", "half", "double", "dbl",
+                 "triple", "side", "cup", "xl", "mini"}
+NAME_STOPWORDS = {"w", "with", "the", "a", "an", "of", "and"}
+
+
+def normalize_name(name):
+    """
+    Canonical form for matching: lowercase, '&' → 'and', parenthesised text
+    (except portion words) and standard-size words dropped, quantities like
+    '12oz' or '2 pc' removed, punctuation collapsed to single spaces.
+    """
+    s = str(name).lower().replace("&", " and ")
+    s = re.sub(r"\([^)]*\)|\[[^\]]*\]",
+               lambda m: " " + " ".join(w for w in re.findall(r"[a-z]+", m.group(0))
+                                        if w in PORTION_WORDS) + " ", s)
+    s = re.sub(r"\b\d+(\.\d+)?\s*(oz|fl oz|pc|pcs|piece|pieces|ct|in|inch|g|lb)\b", " ", s)
+    s = re.sub(r"\b\d+/\d+\b", " ", s)
+    s = re.sub(r"[^a-z0-9]+", " ", s)
+    tokens = [t for t in s.split() if t not in SIZE_WORDS]
+    return " ".join(tokens)
+
+
+def _token_key(normalized):
+    return " ".join(sorted(set(normalized.split()) - NAME_STOPWORDS))
+
+
+def _trigrams(s):
+    padded = f"  {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameResolver:
+    """
+    Maps free-form names onto a fixed set of target names.
+
+    Resolution order: saved alias → exact (case-insensitive) → normalized
+    form → same set of words. Anything else is unmatched, but suggest()
+    ranks likely targets via a character-trigram index and edit similarity.
+    Every resolution is cached, so repeat lookups are a single dict hit.
+    """
+
+    def __init__(self, targets, aliases=None):
+        self.targets = list(targets)
+        self._exact = {}
+        self._normalized = {}
+        self._token_sets = {}
+        self._grams = {}
+        for t in self.targets:
+            self._exact.setdefault(t.strip().upper(), t)
+            norm = normalize_name(t)
+            self._normalized.setdefault(norm, t)
+            self._token_sets.setdefault(_token_key(norm), t)
+            for g in _trigrams(norm):
+                self._grams.setdefault(g, set()).add(t)
+        self.aliases = {k.strip().upper(): v for k, v in (aliases or {}).items()
+                        if v in self.targets}
+        self._cache = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def resolve(self, name):
+        """Target name for name, or None"""
+        key = str(name).strip()
+        try:
+            result = self._cache[key]
+            self.stats["hits"] += 1
+            telemetry.count("cache_lookups", cache="name_resolver", result="hit")
+            return result
+        except KeyError:
+            self.stats["misses"] += 1
+            telemetry.count("cache_lookups", cache="name_resolver", result="miss")
+        result = self._resolve(key)
+        self._cache[key] = result
+        return result
+
+    def resolve_many(self, names):
+        """Resolve a column of names, paying once per distinct name"""
+        names = pd.Series(names, dtype=object).astype(str).str.strip()
+        uniques = names.unique()
+        lookup = {n: self.resolve(n) for n in uniques}
+        return names.map(lookup)
+
+    def _resolve(self, key):
+        upper = key.upper()
+        if upper in self.aliases:
+            return self.aliases[upper]
+        if upper in self._exact:
+            return self._exact[upper]
+        norm = normalize_name(key)
+        if norm in self._normalized:
+            return self._normalized[norm]
+        return self._token_sets.get(_token_key(norm))
+
+    def suggest(self, name, limit=3, min_score=0.35):
+        """[(target, score)] best approximate matches, highest score first"""
+        norm = normalize_name(name)
+        grams = _trigrams(norm)
+        overlap = {}
+        for g in grams:
+            for t in self._grams.get(g, ()):
+                overlap[t] = overlap.get(t, 0) + 1
+        candidates = sorted(overlap, key=overlap.get, reverse=True)[:25]
+        scored = []
+        for t in candidates:
+            t_norm = normalize_name(t)
+            jaccard = overlap[t] / len(grams | _trigrams(t_norm))
+            ratio = difflib.SequenceMatcher(None, norm, t_norm).ratio()
+            score = round(0.5 * jaccard + 0.5 * ratio, 3)
+            if score >= min_score:
+                scored.append((t, score))
+        return sorted(scored, key=lambda x: -x[1])[:limit]
+
+    def set_alias(self, alias, target):
+        self.aliases[alias.strip().upper()] = target
+        self._cache.clear()
+
+    def remove_alias(self, alias):
+        self.aliases.pop(alias.strip().upper(), None)
+        self._cache.clear()
+
+
+ALIAS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS name_aliases (
+    kind       TEXT NOT NULL,
+    alias      TEXT NOT NULL,
+    target     TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (kind, alias)
+);
+"""
+
+
+class AliasStore:
+    """Saved name aliases by kind ("item" → recipe, "ingredient" → vendor mapping key)"""
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(ALIAS_SCHEMA)
+
+    def load(self, kind):
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT alias, target FROM name_aliases WHERE kind = ?", (kind,)).fetchall())
+
+    def add(self, kind, alias, target):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO name_aliases (kind, alias, target, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (kind, alias.strip(), target, datetime.now().isoformat(timespec="seconds")))
+
+    def remove(self, kind, alias):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM name_aliases WHERE kind = ? AND alias = ?",
+                               (kind, alias.strip()))
+
+
+@st.cache_resource
+def get_alias_store():
+    return AliasStore(DATA_DIR / "highdive.db")
+
+
+@st.cache_resource(max_entries=8)
+def get_name_resolver(kind, targets):
+    """Shared resolver for a target set (tuple), seeded with saved aliases"""
+    return NameResolver(targets, get_alias_store().load(kind))
+
+
+def get_item_resolver(recipes):
+    return get_name_resolver("item", tuple(recipes))
+
+
+def get_vendor_resolver(vendor_mapping):
+    return get_name_resolver("ingredient", tuple(vendor_mapping))
+
+
+def save_name_alias(kind, resolver, alias, target):
+    """Persist an alias and apply it to the live resolver"""
+    get_alias_store().add(kind, alias, target)
+    resolver.set_alias(alias, target)
+
+
+def resolve_vendor(ingredient, vendor_mapping, resolver=None):
+    """Vendor for an ingredient: case-normalized mapping key, then the name resolver"""
+    index = getattr(vendor_mapping, "index", None)
+    vendor = (index.vendor_of(ingredient) if index is not None
+              else vendor_mapping.get(ingredient.lower(), vendor_mapping.get(ingredient)))
+    if vendor is not None:
+        return vendor
+    resolver = resolver or get_vendor_resolver(vendor_mapping)
+    key = resolver.resolve(ingredient)
+    return vendor_mapping[key] if key is not None else "UNMAPPED"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# VENDOR MAPPING STORE (in-app edits, pattern rules and history)
+# ─────────────────────────────────────────────────────────────────────────────
+
+VENDOR_MAPPING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vendor_mapping_edits (
+    ingredient TEXT PRIMARY KEY,    -- case-normalized
+    name       TEXT NOT NULL,       -- as first entered
+    vendor     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vendor_mapping_rules (
+    pattern  TEXT PRIMARY KEY,
+    vendor   TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vendor_mapping_history (
+    version  INTEGER NOT NULL,
+    saved_at TEXT NOT NULL,
+    note     TEXT,
+    kind     TEXT NOT NULL,         -- edit / rule
+    key      TEXT NOT NULL,         -- ingredient name or rule pattern
+    old      TEXT,                  -- NULL when it didn't exist
+    new      TEXT                   -- NULL when removed
+);
+CREATE INDEX IF NOT EXISTS vendor_mapping_history_version ON vendor_mapping_history (version);
+"""
+
+
+def mapping_rule_matches(pattern, names):
+    """
+    Boolean mask of names a rule pattern covers: a case-insensitive
+    substring ("lettuce"), or a glob when it has * or ? ("*greens").
+    """
+    pattern = pattern.strip().lower()
+    names = pd.Series(list(names), dtype=object).astype(str).str.lower()
+    if any(c in pattern for c in "*?["):
+        return names.map(lambda n: fnmatch.fnmatchcase(n, pattern)).to_numpy(bool)
+    return names.str.contains(pattern, regex=False).to_numpy(bool)
+
+
+class VendorIndex:
+    """
+    A vendor mapping compiled for lookup: each case-normalized ingredient
+    name gets an id, and codes[id] is the id of its vendor in vendors.
+    spellings keeps every mapping key behind a normalized name, so a name
+    only leaves the index with its last spelling. A lowercase mapping key
+    wins over other spellings of the same name, as the dict lookup it
+    replaces did. updated() recompiles only changed names.
+    """
+
+    def __init__(self, mapping=None):
+        self.vendors, self.vendor_ids = [], {}
+        self.spellings = {}       # normalized name → { mapping key: vendor code }
+        for name, vendor in (mapping or {}).items():
+            key = str(name).strip().lower()
+            self.spellings.setdefault(key, {})[name] = self.vendor_code(vendor)
+        self.ids = {key: i for i, key in enumerate(self.spellings)}
+        self.codes = np.array([self._code(key) for key in self.spellings], dtype=np.int32)
+
+    def _code(self, key):
+        """The lowercase spelling's vendor when it is mapped, else the first spelling's"""
+        spellings = self.spellings[key]
+        return spellings[key] if key in spellings else next(iter(spellings.values()))
+
+    def vendor_code(self, vendor):
+        code = self.vendor_ids.get(vendor)
+        if code is None:
+            code = self.vendor_ids[vendor] = len(self.vendors)
+            self.vendors.append(vendor)
+        return code
+
+    def vendor_of(self, name):
+        i = self.ids.get(str(name).strip().lower())
+        return self.vendors[self.codes[i]] if i is not None else None
+
+    def lookup(self, names):
+        """Vendor id per name (-1 when the name isn't mapped)"""
+        ids = pd.Series(list(names), dtype=object).astype(str).str.strip().str.lower().map(self.ids)
+        found = ids.notna().to_numpy()
+        out = np.full(len(ids), -1, dtype=np.int32)
+        out[found] = self.codes[ids[found].to_numpy(int)]
+        return out
+
+    def updated(self, changes):
+        """Copy with { name: vendor } changes applied (None removes the name)"""
+        index = VendorIndex()
+        index.ids, index.vendors = dict(self.ids), list(self.vendors)
+        index.vendor_ids = dict(self.vendor_ids)
+        index.spellings = dict(self.spellings)
+        codes = self.codes.tolist()
+        removed = False
+        for name, vendor in changes.items():
+            key = str(name).strip().lower()
+            spellings = index.spellings[key] = dict(index.spellings.get(key, {}))
+            if vendor is None:
+                spellings.pop(name, None)
+            else:
+                spellings[name] = index.vendor_code(vendor)
+            if not spellings:
+                del index.spellings[key]
+                removed = True
+                continue
+            if key in index.ids:
+                codes[index.ids[key]] = index._code(key)
+            else:
+                index.ids[key] = len(codes)
+                codes.append(index._code(key))
+        if removed:
+            keep = [(k, codes[i]) for k, i in index.ids.items() if k in index.spellings]
+            index.ids = {k: i for i, (k, _) in enumerate(keep)}
+            codes = [c for _, c in keep]
+        index.codes = np.array(codes, dtype=np.int32)
+        return index
+
+
+class VendorMapping(dict):
+    """
+    The effective vendor mapping: a plain dict, plus its VendorIndex, the
+    store version and where each entry came from (file / rule: … / edited)
+    """
+
+    def __init__(self, mapping, index=None, version=0, sources=None):
+        super().__init__(mapping)
+        self.index = index if index is not None else VendorIndex(mapping)
+        self.version = version
+        self.sources = sources or {}
+
+
+class VendorMappingStore:
+    """
+    In-app changes to vendor_mapping_smart.json, in SQLite.
+
+    The effective mapping is the file, then pattern rules (first matching
+    rule wins) over every ingredient it lists, then individual edits. Each
+    save is one numbered version in vendor_mapping_history holding the old
+    and new value of everything it touched, so any version can be
+    inspected and reverted to (a revert is itself a new version).
+    """
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(VENDOR_MAPPING_SCHEMA)
+        self._compiled = None           # (key, VendorMapping) last built
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(MAX(version), 0) FROM vendor_mapping_history").fetchone()[0]
+
+    def edits(self):
+        """{ case-normalized ingredient: (name, vendor) }"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ingredient, name, vendor FROM vendor_mapping_edits").fetchall()
+        return {key: (name, vendor) for key, name, vendor in rows}
+
+    def rules(self):
+        """[(pattern, vendor)] in priority order"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT pattern, vendor FROM vendor_mapping_rules ORDER BY position").fetchall()
+
+    def mapping(self, base):
+        """
+        Effective VendorMapping over base (the mapping file). Rebuilt once per
+        store version; the index is updated from the previous build's for
+        just the names whose vendor changed.
+        """
+        key = (self.version, _content_version(base))
+        if self._compiled is not None and self._compiled[0] == key:
+            return self._compiled[1]
+        mapping = dict(base)
+        names = list(mapping)
+        sources = dict.fromkeys(names, "file")
+        assigned = np.zeros(len(names), dtype=bool)
+        for pattern, vendor in self.rules():
+            hit = mapping_rule_matches(pattern, names) & ~assigned
+            for i in np.flatnonzero(hit):
+                mapping[names[i]] = vendor
+                sources[names[i]] = f"rule: {pattern}"
+            assigned |= hit
+        by_key = {}
+        for name in names:
+            by_key.setdefault(name.strip().lower(), []).append(name)
+        for key_name, (name, vendor) in self.edits().items():
+            for existing in by_key.get(key_name, [name]):
+                mapping[existing] = vendor
+                sources[existing] = "edited"
+
+        previous = self._compiled[1] if self._compiled is not None else None
+        if previous is not None:
+            changes = {n: v for n, v in mapping.items() if previous.get(n) != v}
+            changes.update({n: None for n in previous if n not in mapping})
+            index = previous.index.updated(changes)
+        else:
+            index = VendorIndex(mapping)
+        compiled = VendorMapping(mapping, index, key[0], sources)
+        self._compiled = (key, compiled)
+        return compiled
+
+    def save(self, edits=None, rules=None, note=""):
+        """
+        Save { ingredient: vendor } edits (None drops an edit) and/or a new
+        rule list [(pattern, vendor)] as one version. Returns the version, or
+        None when nothing changed.
+        """
+        current = self.edits()
+        rows = []
+        for name, vendor in (edits or {}).items():
+            old = current.get(name.strip().lower(), (None, None))[1]
+            if old != vendor:
+                rows.append(("edit", name.strip(), old, vendor))
+        if rules is not None:
+            rules = [(str(p).strip(), v) for p, v in rules if str(p).strip()]
+            old_rules = self.rules()
+            if [tuple(r) for r in old_rules] != rules:
+                rows.append(("rules", "rules", json.dumps(old_rules), json.dumps(rules)))
+        if not rows:
+            return None
+
+        with self._lock, self._conn:
+            version = self._conn.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM vendor_mapping_history").fetchone()[0]
+            saved_at = datetime.now().isoformat(timespec="seconds")
+            self._conn.executemany(
+                "INSERT INTO vendor_mapping_history VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(version, saved_at, note, kind, key, old, new) for kind, key, old, new in rows])
+            for kind, name, _, vendor in rows:
+                if kind == "rules":
+                    self._conn.execute("DELETE FROM vendor_mapping_rules")
+                    self._conn.executemany(
+                        "INSERT INTO vendor_mapping_rules (pattern, vendor, position) "
+                        "VALUES (?, ?, ?)", [(p, v, i) for i, (p, v) in enumerate(rules)])
+                elif vendor is None:
+                    self._conn.execute("DELETE FROM vendor_mapping_edits WHERE ingredient = ?",
+                                       (name.lower(),))
+                else:
+                    self._conn.execute(
+                        "INSERT INTO vendor_mapping_edits (ingredient, name, vendor) "
+                        "VALUES (?, ?, ?) ON CONFLICT(ingredient) DO UPDATE SET "
+                        "vendor = excluded.vendor", (name.lower(), name, vendor))
+        return version
+
+    def history(self):
+        """One row per version: when, note and how many entries it changed"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, MIN(saved_at), MIN(note), COUNT(*) FROM vendor_mapping_history "
+                "GROUP BY version ORDER BY version DESC").fetchall()
+        return pd.DataFrame(rows, columns=["Version", "Saved", "Note", "Changes"])
+
+    def changes(self, version):
+        """What one version changed — edited ingredients, and the rule list"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, key, old, new FROM vendor_mapping_history WHERE version = ? "
+                "ORDER BY rowid", (version,)).fetchall()
+
+        def shown(kind, value):
+            if kind == "rules" and value is not None:
+                return "; ".join(f"{p} → {v}" for p, v in json.loads(value)) or "(none)"
+            return value or ""
+        return pd.DataFrame([(kind, key, shown(kind, old), shown(kind, new))
+                             for kind, key, old, new in rows],
+                            columns=["Kind", "Name", "Was", "Now"])
+
+    def revert(self, version, note=None):
+        """Undo every change saved after version, itself saved as a new version"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, key, old FROM vendor_mapping_history WHERE version > ? "
+                "ORDER BY version DESC, rowid DESC", (version,)).fetchall()
+        target = {}
+        for kind, key, old in rows:          # newest first, so the oldest value wins
+            target[(kind, key)] = old
+        edits = {key: old for (kind, key), old in target.items() if kind == "edit"}
+        rules = (json.loads(target[("rules", "rules")]) if ("rules", "rules") in target
+                 else None)
+        return self.save(edits, rules, note or f"Revert to version {version}")
+
+
+def vendors_for(ingredients, vendor_mapping, resolver=None):
+    """Vendor per ingredient as an object array — one index lookup, resolver for the rest"""
+    ingredients = list(ingredients)
+    index = getattr(vendor_mapping, "index", None)
+    if index is None:
+        return np.array([resolve_vendor(i, vendor_mapping, resolver) for i in ingredients],
+                        dtype=object)
+    codes = index.lookup(ingredients)
+    out = np.array(index.vendors + [None], dtype=object)[codes]
+    for i in np.flatnonzero(codes < 0):
+        out[i] = resolve_vendor(ingredients[i], vendor_mapping, resolver)
+    return out
+
+
+@st.cache_resource
+def get_vendor_mapping_store():
+    return VendorMappingStore(DATA_DIR / "highdive.db")
+
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# DELIVERY CALENDAR (schedules → concrete dated order windows)
+# ─────────────────────────────────────────────────────────────────────────────
+
+EMPTY_CALENDAR_EXCEPTIONS = {"closed_dates": [], "vendor_holidays": {}, "skips": []}
+
+
+def load_calendar_exceptions():
+    """
+    Holiday closures and one-off skips, from calendar_exceptions.json:
+
+    {"closed_dates": ["2026-12-25"],                    restaurant closed
+     "vendor_holidays": {"ALL": [...], "GFS": [...]},   no deliveries
+     "skips": [{"vendor": "WCW", "delivery_date": "2026-11-27"}]}
+    """
+    path = Path(__file__).parent / "calendar_exceptions.json"
+    if path.exists():
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            return {**EMPTY_CALENDAR_EXCEPTIONS, **data}
+        except Exception:
+            pass
+    return json.loads(json.dumps(EMPTY_CALENDAR_EXCEPTIONS))
+
+
+CALENDAR_EXCEPTION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calendar_exceptions (
+    location  TEXT NOT NULL,
+    kind      TEXT NOT NULL,
+    vendor    TEXT NOT NULL,
+    date      TEXT NOT NULL,
+    active    INTEGER NOT NULL DEFAULT 1,
+    saved_at  TEXT NOT NULL,
+    PRIMARY KEY (location, kind, vendor, date)
+);
+"""
+
+# kind → label; closed dates are stored with vendor ""
+CALENDAR_EXCEPTION_KINDS = {
+    "closed":  "Restaurant closed",
+    "holiday": "Vendor holiday (no delivery)",
+    "skip":    "Skip one delivery",
+}
+
+
+def calendar_exception_rows(exceptions):
+    """(kind, vendor, date) for every entry of an exceptions dict"""
+    rows = [("closed", "", str(d)) for d in exceptions.get("closed_dates", [])]
+    rows += [("holiday", vendor, str(d))
+             for vendor, days in exceptions.get("vendor_holidays", {}).items() for d in days]
+    rows += [("skip", s["vendor"], str(s["delivery_date"])) for s in exceptions.get("skips", [])]
+    return rows
+
+
+class CalendarExceptionStore:
+    """
+    Closures, vendor holidays and skipped deliveries per location, in SQLite.
+
+    calendar_exceptions.json seeds every location. A removed entry is kept
+    as inactive rather than deleted, so the seed doesn't bring it back.
+    """
+
+    def __init__(self, db_path, seed=None):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        self.seed = calendar_exception_rows(seed or EMPTY_CALENDAR_EXCEPTIONS)
+        with self._lock:
+            self._conn.executescript(CALENDAR_EXCEPTION_SCHEMA)
+
+    def load(self, location=None):
+        """Active entries in the calendar_exceptions.json layout"""
+        location = location or data_location()
+        saved_at = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO calendar_exceptions "
+                "(location, kind, vendor, date, active, saved_at) VALUES (?, ?, ?, ?, 1, ?)",
+                [(location, kind, vendor, date, saved_at) for kind, vendor, date in self.seed])
+            rows = self._conn.execute(
+                "SELECT kind, vendor, date FROM calendar_exceptions "
+                "WHERE location = ? AND active = 1 ORDER BY date, kind, vendor",
+                (location,)).fetchall()
+        exceptions = json.loads(json.dumps(EMPTY_CALENDAR_EXCEPTIONS))
+        for kind, vendor, date in rows:
+            if kind == "closed":
+                exceptions["closed_dates"].append(date)
+            elif kind == "holiday":
+                exceptions["vendor_holidays"].setdefault(vendor, []).append(date)
+            else:
+                exceptions["skips"].append({"vendor": vendor, "delivery_date": date})
+        return exceptions
+
+    def _set(self, kind, vendor, date, active, location):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO calendar_exceptions "
+                "(location, kind, vendor, date, active, saved_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (location or data_location(), kind, vendor or "", str(date), int(active),
+                 datetime.now().isoformat(timespec="seconds")))
+
+    def add(self, kind, date, vendor="", location=None):
+        self._set(kind, vendor, date, True, location)
+
+    def remove(self, kind, date, vendor="", location=None):
+        self._set(kind, vendor, date, False, location)
+
+
+@st.cache_resource
+def get_calendar_exception_store():
+    return CalendarExceptionStore(DATA_DIR / "highdive.db", load_calendar_exceptions())
+
+
+def _parse_dates(values):
+    return {datetime.strptime(str(v), "%Y-%m-%d").date() for v in values or []}
+
+
+class DeliveryCalendar:
+    """
+    Vendor schedules expanded into dated order windows over a horizon.
+
+    Each window is a dict with vendor, order (the schedule entry), window
+    label, order_date, delivery_date and coverage { date: fraction }.
+    Fractional cover_days (e.g. 7.5) extend coverage past the listed days.
+    A window whose delivery lands on a vendor holiday or a one-off skip is
+    dropped and its coverage folded into the vendor's previous delivery.
+    """
+
+    def __init__(self, vendor_schedules, start, horizon_days=28, exceptions=None,
+                 closed_weekdays=None):
+        exceptions = exceptions or EMPTY_CALENDAR_EXCEPTIONS
+        self.start = start
+        self.end = start + timedelta(days=horizon_days)
+        self.closed_weekdays = {DAY_ORDER.index(d) for d in
+                                (CLOSED_DAYS if closed_weekdays is None else closed_weekdays)}
+        self.closed_dates = _parse_dates(exceptions.get("closed_dates"))
+        holidays = exceptions.get("vendor_holidays", {})
+        skips = {(s["vendor"], datetime.strptime(s["delivery_date"], "%Y-%m-%d").date())
+                 for s in exceptions.get("skips", [])}
+
+        self.windows = []
+        self.skipped = []
+        for v_key, v_data in vendor_schedules.items():
+            blocked = _parse_dates(holidays.get("ALL")) | _parse_dates(holidays.get(v_key))
+            vendor_windows = sorted(
+                (w for o in v_data.get("orders", []) for w in self._expand(v_key, o)),
+                key=lambda w: w["delivery_date"]
+            )
+            kept = []
+            for w in vendor_windows:
+                if w["delivery_date"] in blocked or (v_key, w["delivery_date"]) in skips:
+                    self.skipped.append(w)
+                    target = kept[-1] if kept else None
+                    if target is None:
+                        continue
+                    for d, frac in w["coverage"].items():
+                        target["coverage"][d] = min(1.0, target["coverage"].get(d, 0) + frac)
+                    target["absorbed"].append(w["delivery_date"])
+                else:
+                    kept.append(w)
+            self.windows.extend(kept)
+
+        self.by_order_date = {}
+        self.by_delivery_date = {}
+        for w in self.windows:
+            self.by_order_date.setdefault(w["order_date"], []).append(w)
+            self.by_delivery_date.setdefault(w["delivery_date"], []).append(w)
+
+    def _expand(self, vendor_key, order):
+        order_wd = DAY_ORDER.index(order["order_day"])
+        delivery_gap = (DAY_ORDER.index(order["delivery_day"]) - order_wd) % 7 or 7
+        delivery_wd = (order_wd + delivery_gap) % 7
+        cover_gaps = sorted((DAY_ORDER.index(d) - delivery_wd) % 7 for d in order["covers"])
+        cover_days = order.get("cover_days")
+
+        order_date = self.start + timedelta(days=(order_wd - self.start.weekday()) % 7)
+        while order_date < self.end:
+            delivery = order_date + timedelta(days=delivery_gap)
+            if cover_days:
+                first = delivery + timedelta(days=cover_gaps[0])
+                full, part = int(cover_days), cover_days - int(cover_days)
+                coverage = {first + timedelta(days=i): 1.0 for i in range(full)}
+                if part:
+                    coverage[first + timedelta(days=full)] = part
+            else:
+                coverage = {delivery + timedelta(days=g): 1.0 for g in cover_gaps}
+            yield {
+                "vendor": vendor_key,
+                "order": order,
+                "window": order_window_label(order),
+                "order_date": order_date,
+                "delivery_date": delivery,
+                "coverage": coverage,
+                "absorbed": [],
+            }
+            order_date += timedelta(days=7)
+
+    def is_open(self, d):
+        return d.weekday() not in self.closed_weekdays and d not in self.closed_dates
+
+    def due_on(self, d):
+        """Every vendor order to be placed on date d"""
+        return self.by_order_date.get(d, [])
+
+    def deliveries_on(self, d):
+        return self.by_delivery_date.get(d, [])
+
+    def vendor_windows(self, vendor_key, from_date=None):
+        return [w for w in self.windows if w["vendor"] == vendor_key
+                and (from_date is None or w["order_date"] >= from_date)]
+
+    def usage_weights(self, window):
+        """{ date: fraction } for the days of a window the restaurant is open"""
+        return {d: frac for d, frac in sorted(window["coverage"].items()) if self.is_open(d)}
+
+
+def describe_coverage(coverage):
+    """'Wed 10/28, Thu 10/29, Wed 11/04 (½)' style coverage summary"""
+    parts = []
+    for d, frac in sorted(coverage.items()):
+        label = f"{d:%a %m/%d}"
+        if frac < 1:
+            label += " (½)" if frac == 0.5 else f" ({frac:g})"
+        parts.append(label)
+    return ", ".join(parts)
+
+
+@st.cache_resource(max_entries=8)
+def get_delivery_calendar(vendor_schedules, exceptions, start, horizon_days=28):
+    """Shared calendar for a schedule/exceptions version — treat as read-only"""
+    return DeliveryCalendar(vendor_schedules, start, horizon_days, exceptions)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# RECIPE MATRIX (items × ingredients, compiled once per recipe/mapping version)
+# ─────────────────────────────────────────────────────────────────────────────
+
+class RecipeMatrix:
+    """
+    Recipes compiled into a dense item × ingredient quantity matrix.
+
+    Row i holds the per-serving ingredient quantities of items[i], so usage
+    for any sales vector (or a days × items sales matrix) is one matmul.
+    """
+
+    def __init__(self, items, ingredients, units, vendors, matrix, resolver=None):
+        self.items = items                      # upper-cased recipe names
+        self.item_index = {name: i for i, name in enumerate(items)}
+        self.resolver = resolver                # NameResolver over recipe names
+        self.ingredients = ingredients
+        self.ingredient_index = {name: j for j, name in enumerate(ingredients)}
+        self.units = units
+        self.vendors = np.asarray(vendors, dtype=object)
+        self.matrix = matrix
+
+    def patched(self, changed, removed=(), vendor_mapping=None, vendor_resolver=None,
+                item_resolver=None):
+        """
+        New matrix with only some recipes compiled: changed { name: recipe }
+        rows are rebuilt (appended when new), removed names dropped, every
+        other row copied. Ingredients new to the set get columns at the end;
+        an existing column takes the unit a changed recipe now gives it.
+        """
+        drop = {name.upper() for name in removed}
+        keep = [i for i, name in enumerate(self.items) if name not in drop]
+        items = [self.items[i] for i in keep]
+        item_index = {name: i for i, name in enumerate(items)}
+        ingredients, units = list(self.ingredients), list(self.units)
+        vendors = list(self.vendors)
+        ingredient_index = dict(self.ingredient_index)
+        rebuilt, entries, new_columns = [], [], []
+
+        for recipe_name, recipe in changed.items():
+            row = item_index.get(recipe_name.upper())
+            if row is None:
+                row = item_index[recipe_name.upper()] = len(items)
+                items.append(recipe_name.upper())
+            rebuilt.append(row)
+            for ingredient, details in recipe.items():
+                if is_recipe_meta_line(ingredient):
+                    continue
+                col = ingredient_index.get(ingredient)
+                if col is None:
+                    col = ingredient_index[ingredient] = len(ingredients)
+                    ingredients.append(ingredient)
+                    units.append(details.get("unit", "each"))
+                    new_columns.append(ingredient)
+                elif col < len(self.ingredients):
+                    units[col] = details.get("unit", "each")
+                entries.append((row, col, float(details.get("qty", 0) or 0)))
+        vendors.extend(vendors_for(new_columns, vendor_mapping or {}, vendor_resolver))
+
+        matrix = np.zeros((len(items), len(ingredients)))
+        matrix[:len(keep), :self.matrix.shape[1]] = self.matrix[keep]
+        matrix[rebuilt] = 0.0
+        for row, col, qty in entries:
+            matrix[row, col] += qty
+        return RecipeMatrix(items, ingredients, units, vendors, matrix,
+                            item_resolver or self.resolver)
+
+    def item_rows(self, item_names):
+        """Matrix row for each sales item name (-1 when there is no recipe)"""
+        names = pd.Series(item_names, dtype=object).astype(str).str.strip()
+        if self.resolver is not None:
+            names = self.resolver.resolve_many(names)
+        rows = names.str.upper().map(self.item_index)
+        return rows.fillna(-1).to_numpy(dtype=np.int64)
+
+    def vendor_columns(self, vendor_key):
+        """Ingredient column indexes supplied by one vendor"""
+        return np.flatnonzero(self.vendors == vendor_key)
+
+    def usage(self, item_names, quantities):
+        """Ingredient usage vector for parallel arrays of item names and quantities"""
+        rows = self.item_rows(item_names)
+        hit = rows >= 0
+        qty = np.zeros(len(self.items))
+        np.add.at(qty, rows[hit], np.asarray(quantities, dtype=float)[hit])
+        return qty @ self.matrix
+
+
+@traced("recipes.compile_matrix", measure=lambda m: {"rows": len(m.items)})
+def compile_recipe_matrix(recipes, vendor_mapping, item_resolver=None, vendor_resolver=None):
+    """Build a RecipeMatrix from the recipe and vendor mapping dicts"""
+    empty = RecipeMatrix([], [], [], [], np.zeros((0, 0)), item_resolver)
+    return empty.patched(recipes, (), vendor_mapping, vendor_resolver)
+
+
+def recipe_matrix_key(recipes, vendor_mapping):
+    """Matrix version: recipes, mapping and the saved aliases both are resolved through"""
+    aliases = [get_item_resolver(recipes).aliases, get_vendor_resolver(vendor_mapping).aliases]
+    return "/".join([data_location(), "recipe_matrix",
+                     _content_version([recipes, vendor_mapping, aliases])])
+
+
+def get_recipe_matrix(recipes, vendor_mapping):
+    """
+    Shared compiled matrix — treat as read-only. Memoised in the shared cache
+    by recipe_matrix_key, so an alias saved later gets a fresh matrix.
+    """
+    return get_shared_cache().memo(
+        recipe_matrix_key(recipes, vendor_mapping),
+        lambda: compile_recipe_matrix(recipes, vendor_mapping, get_item_resolver(recipes),
+                                      get_vendor_resolver(vendor_mapping)))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# RECIPE IMPORT (plate-cost workbooks → recipes, diffed against the current set)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Header cells (lowercase, letters only) that name a plate-cost column
+PLATE_COST_COLUMNS = {
+    "ingredient": "name", "ingredients": "name", "item": "name", "product": "name",
+    "description": "name",
+    "qty": "qty", "quantity": "qty", "amount": "qty", "portion": "qty", "portionsize": "qty",
+    "unit": "unit", "units": "unit", "uom": "unit", "measure": "unit",
+}
+# Label cells whose neighbour is a recipe name ("Recipe: | NOODLE BOWL")
+PLATE_COST_TITLE_LABELS = {"recipe", "recipename", "menuitem", "item", "itemname", "dish", "plate"}
+
+
+def _cell_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace("$", "").replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+def _plate_cost_row(row, columns):
+    """
+    One worksheet row → ("header", columns) / ("title", name) /
+    ("line", ingredient, qty, unit) / None
+    """
+    cells = [(i, v.strip() if isinstance(v, str) else v) for i, v in enumerate(row)
+             if v is not None and not (isinstance(v, str) and not v.strip())]
+    if not cells:
+        return None
+    texts = [(i, v) for i, v in cells if isinstance(v, str) and _cell_number(v) is None]
+    numbers = [(i, n) for i, v in cells if (n := _cell_number(v)) is not None]
+
+    header = {PLATE_COST_COLUMNS[k]: i for i, v in texts
+              if (k := re.sub(r"[^a-z]", "", v.lower())) in PLATE_COST_COLUMNS}
+    if not numbers and "name" in header and "qty" in header:
+        return ("header", header)
+    if len(texts) == 2 and re.sub(r"[^a-z]", "", texts[0][1].lower()) in PLATE_COST_TITLE_LABELS:
+        return ("title", texts[1][1]) if not numbers else None
+    if not numbers:
+        return ("title", texts[0][1]) if len(texts) == 1 else None
+
+    if columns and not (texts and texts[0][1].endswith(":")):
+        values = dict(cells)
+        name, qty = values.get(columns["name"]), _cell_number(values.get(columns["qty"]))
+        if isinstance(name, str) and qty is not None:
+            unit = values.get(columns.get("unit"))
+            return ("line", name, qty, str(unit).strip() if unit is not None else "each")
+    if not texts:
+        return None
+    name_at, name = texts[0]
+    after = [(i, n) for i, n in numbers if i > name_at]
+    if not after:
+        return None
+    qty_at, qty = after[0]
+    units = ([v for i, v in texts if i > qty_at] or [v for i, v in texts if name_at < i < qty_at]
+             or ["each"])
+    return ("line", name, qty, units[0])
+
+
+@traced("recipes.parse_plate_cost", measure=lambda r: {"recipes": len(r)})
+def parse_plate_cost_workbook(data):
+    """
+    { recipe name: { ingredient: {qty, unit} } } from plate-cost workbook bytes.
+
+    Every sheet is streamed row by row (openpyxl read-only mode) and read as
+    recipe blocks: a title row — a lone text cell, or a "Recipe:" label and
+    its value — starts a recipe, and each following row with a name and a
+    quantity is one of its lines, the unit being the text beside the
+    quantity. A header row (Ingredient | Qty | Unit …) pins those columns
+    for the rest of the sheet. Summary lines ("RECIPE COST:") are kept, as in
+    recipes_imported.json; lines before any title belong to a recipe named
+    after the sheet, and titles without lines (section headings) are dropped.
+    Raises ValueError when the workbook holds no recipes.
+    """
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    recipes = {}
+    try:
+        for sheet in workbook.worksheets:
+            title, columns = sheet.title.strip(), None
+            for row in sheet.iter_rows(values_only=True):
+                parsed = _plate_cost_row(row, columns)
+                if parsed is None:
+                    continue
+                if parsed[0] == "header":
+                    columns = parsed[1]
+                elif parsed[0] == "title":
+                    title = " ".join(parsed[1].split())
+                else:
+                    _, ingredient, qty, unit = parsed
+                    ingredient = " ".join(ingredient.split())
+                    lines = recipes.setdefault(title, {})
+                    if ingredient in lines:
+                        lines[ingredient]["qty"] += qty
+                    else:
+                        lines[ingredient] = {"qty": qty, "unit": unit}
+    finally:
+        workbook.close()
+    recipes = {name: lines for name, lines in recipes.items()
+               if any(not is_recipe_meta_line(i) for i in lines)}
+    if not recipes:
+        raise ValueError("No recipe blocks found — expected a recipe name followed by "
+                         "ingredient, quantity and unit rows")
+    return recipes
+
+
+def import_plate_cost(data):
+    """(file hash, parsed recipes) — each distinct file is only parsed once"""
+    digest = hashlib.sha1(data).hexdigest()[:16]
+    return digest, get_shared_cache().memo(
+        f"{data_location()}/plate_cost/{digest}", lambda: parse_plate_cost_workbook(data))
+
+
+def diff_recipes(current, parsed):
+    """
+    How parsed recipes differ from the current set, names compared
+    case-insensitively: {added, changed, removed} recipe name lists (current
+    spelling for changed / removed), unchanged count and a lines DataFrame
+    of every ingredient line that differs.
+    """
+    current_names = {name.upper(): name for name in current}
+    parsed_names = {name.upper(): name for name in parsed}
+    added, changed, lines = [], [], []
+
+    def same(a, b):
+        return (abs(float(a.get("qty", 0) or 0) - float(b.get("qty", 0) or 0)) < 1e-9
+                and str(a.get("unit", "")).lower() == str(b.get("unit", "")).lower())
+
+    for key, name in parsed_names.items():
+        if key not in current_names:
+            added.append(name)
+            lines.extend({"Recipe": name, "Ingredient": i, "Change": "new recipe",
+                          "Was": "", "Now": f"{d['qty']:g} {d['unit']}"}
+                         for i, d in parsed[name].items())
+            continue
+        old, new = current[current_names[key]], parsed[name]
+        diffs = []
+        for ingredient in dict.fromkeys(list(old) + list(new)):
+            a, b = old.get(ingredient), new.get(ingredient)
+            if a is not None and b is not None and same(a, b):
+                continue
+            diffs.append({
+                "Recipe": current_names[key], "Ingredient": ingredient,
+                "Change": "added" if a is None else "removed" if b is None else "changed",
+                "Was": "" if a is None else f"{a.get('qty', 0):g} {a.get('unit', '')}",
+                "Now": "" if b is None else f"{b['qty']:g} {b['unit']}",
+            })
+        if diffs:
+            changed.append(current_names[key])
+            lines.extend(diffs)
+    removed = [name for key, name in current_names.items() if key not in parsed_names]
+    return {
+        "added": added, "changed": changed, "removed": removed,
+        "unchanged": len(parsed_names) - len(added) - len(changed),
+        "lines": pd.DataFrame(lines, columns=["Recipe", "Ingredient", "Change", "Was", "Now"]),
+    }
+
+
+def apply_recipe_import(recipes, parsed, diff, vendor_mapping, remove_missing=False):
+    """
+    New recipe set from an import diff, saved to the data directory. The
+    shared cache is seeded with its matrix — the current one with only the
+    added and changed rows recompiled — so nothing recompiles in full.
+    Returns the new recipes.
+    """
+    parsed_names = {name.upper(): name for name in parsed}
+    changed = {name: parsed[parsed_names[name.upper()]] for name in diff["changed"]}
+    changed.update({name: parsed[name] for name in diff["added"]})
+    removed = diff["removed"] if remove_missing else []
+    updated = {name: recipe for name, recipe in recipes.items() if name not in removed}
+    updated.update(changed)
+
+    matrix = get_recipe_matrix(recipes, vendor_mapping).patched(
+        changed, removed, vendor_mapping, get_vendor_resolver(vendor_mapping),
+        get_item_resolver(updated))
+    get_shared_cache().memo(recipe_matrix_key(updated, vendor_mapping), lambda: matrix)
+    save_recipes(updated)
+    return updated
+
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# MODIFIER ADJUSTMENTS (base recipe + Σ modifier deltas)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Leading word of a modifier → multiple of the item's own recipe quantity,
+# used when the delta table has no explicit entry ("No Cheese", "Extra Egg")
+MODIFIER_PREFIX_FACTORS = {
+    "no": -1.0, "hold": -1.0, "without": -1.0, "remove": -1.0,
+    "add": 1.0, "extra": 1.0, "double": 1.0,
+    "light": -0.5, "easy": -0.5,
+}
+
+
+@st.cache_data
+def load_modifier_deltas():
+    """
+    Modifier → ingredient deltas from modifier_deltas.json, in recipe units:
+    { "ADD AVOCADO": {"avocado": {"qty": 0.5, "unit": "each"}},
+      "BURRITO::ADD EGG": {...} }   (item-scoped entries win)
+    """
+    path = Path(__file__).parent / "modifier_deltas.json"
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def modifier_key(name):
+    """Comparable modifier name: lowercase words, prices and parentheses dropped"""
+    s = re.sub(r"\([^)]*\)|\$\s*\d+(\.\d+)?", " ", str(name).lower())
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", s).split())
+
+
+def compile_modifier_deltas(pairs, recipe_matrix, modifier_deltas):
+    """
+    Delta matrix for distinct (menu item, modifier) pairs.
+
+    Row p of the result is the per-use ingredient change for pairs[p], in
+    recipe_matrix ingredient columns. Explicit table entries (item-scoped
+    first) take precedence over the prefix rules.
+    Returns: (deltas[P, I], matched[P] bool)
+    """
+    table = {}
+    for key, ingredients in modifier_deltas.items():
+        scope, _, mod = key.rpartition("::")
+        table[(scope.strip().upper() or None, modifier_key(mod))] = ingredients
+
+    pairs = list(pairs)
+    deltas = np.zeros((len(pairs), len(recipe_matrix.ingredients)))
+    matched = np.zeros(len(pairs), dtype=bool)
+    if not pairs:
+        return deltas, matched
+
+    rows = recipe_matrix.item_rows([item for item, _ in pairs])
+    ing_tokens = [set(normalize_name(i).split()) for i in recipe_matrix.ingredients]
+
+    for p, ((item, modifier), row) in enumerate(zip(pairs, rows)):
+        recipe_name = recipe_matrix.items[row] if row >= 0 else None
+        key = modifier_key(modifier)
+        entry = table.get((recipe_name, key)) or table.get((None, key))
+        if entry is not None:
+            for ingredient, details in entry.items():
+                col = recipe_matrix.ingredient_index.get(ingredient)
+                if col is not None:
+                    deltas[p, col] += float(details.get("qty", 0) or 0)
+                    matched[p] = True
+            continue
+
+        words = key.split()
+        if row < 0 or len(words) < 2 or words[0] not in MODIFIER_PREFIX_FACTORS:
+            continue
+        target = set(normalize_name(" ".join(words[1:])).split())
+        if not target:
+            continue
+        base = recipe_matrix.matrix[row]
+        for col in np.flatnonzero(base):
+            if target <= ing_tokens[col]:
+                deltas[p, col] += MODIFIER_PREFIX_FACTORS[words[0]] * base[col]
+                matched[p] = True
+
+    return deltas, matched
+
+
+def modifier_usage(modifiers_df, recipe_matrix, modifier_deltas, dates=None):
+    """
+    Ingredient usage change from modifiers, computed over the flattened arrays.
+
+    Modifier rows are reduced to distinct (item, modifier) pairs, each pair is
+    compiled to a delta row once, and usage is the pair-count × delta product.
+    dates: optional DatetimeIndex — when given, returns a dates × ingredients
+           matrix using the frame's Business Date column; otherwise a vector.
+    Returns: (usage, unmatched) where unmatched lists modifiers with no effect
+    """
+    n_ing = len(recipe_matrix.ingredients)
+    if modifiers_df is None or modifiers_df.empty:
+        shape = (len(dates), n_ing) if dates is not None else n_ing
+        return np.zeros(shape), []
+
+    codes, uniques = pd.MultiIndex.from_frame(
+        modifiers_df[["Item", "Modifier"]].astype(str)).factorize()
+    deltas, matched = compile_modifier_deltas(uniques, recipe_matrix, modifier_deltas)
+    qty = pd.to_numeric(modifiers_df["Qty"], errors="coerce").fillna(0).to_numpy(float)
+    unmatched = sorted({m for (_, m), ok in zip(uniques, matched) if not ok})
+
+    if dates is None:
+        counts = np.bincount(codes, weights=qty, minlength=len(uniques))
+        return counts @ deltas, unmatched
+
+    day_idx = dates.get_indexer(pd.to_datetime(modifiers_df["Business Date"]).dt.normalize())
+    ok = day_idx >= 0
+    counts = np.zeros((len(dates), len(uniques)))
+    np.add.at(counts, (day_idx[ok], codes[ok]), qty[ok])
+    return counts @ deltas, unmatched
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# DEMAND PROFILE (intraday item × weekday × time-of-day histogram)
+# ─────────────────────────────────────────────────────────────────────────────
+
+RESTAURANT_TIMEZONE = os.environ.get("HIGHDIVE_TIMEZONE", "America/New_York")
+PROFILE_BIN_MINUTES = 15
+PROFILE_DAY_START_HOUR = 4          # business day runs 04:00 → 04:00 next morning
+DEFAULT_DELIVERY_TIME = "10:00"     # used when a schedule entry has no delivery_time
+
+# (label, start hour, end hour) on the business-day clock; 28 = 4am next day
+DAYPARTS = [("Breakfast", 4, 11), ("Lunch", 11, 16), ("Dinner", 16, 28)]
+
+PROFILE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS demand_profile_days (
+    business_date TEXT PRIMARY KEY,
+    bin_minutes   INTEGER NOT NULL,
+    items         TEXT NOT NULL,
+    item_idx      BLOB NOT NULL,
+    bins          BLOB NOT NULL,
+    qty           BLOB NOT NULL
+);
+"""
+
+
+def selection_time_bins(opened, bin_minutes=PROFILE_BIN_MINUTES, tz=RESTAURANT_TIMEZONE):
+    """Toast UTC timestamps → bin index on the business-day clock (-1 if missing)"""
+    ts = pd.to_datetime(pd.Series(opened), utc=True, errors="coerce", format="ISO8601")
+    local = ts.dt.tz_convert(tz)
+    minutes = (local.dt.hour * 60 + local.dt.minute - PROFILE_DAY_START_HOUR * 60) % 1440
+    return minutes.floordiv(bin_minutes).fillna(-1).astype(np.int32).to_numpy()
+
+
+class DemandProfile:
+    """
+    Streaming histogram of quantity sold per item × weekday × time bin.
+
+    Each business date is ingested as a sparse (item, bin, qty) record kept
+    in SQLite; the dense float32 histogram is rebuilt from those records on
+    startup and updated in place as days arrive. Re-ingesting a date
+    replaces its earlier contribution, so a refetch never double counts.
+    ingest may run on a fetch thread while a page reads, so readers work
+    from snapshot() rather than the live profile.
+    """
+
+    def __init__(self, db_path, bin_minutes=PROFILE_BIN_MINUTES):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        self.bin_minutes = bin_minutes
+        self.num_bins = 1440 // bin_minutes
+        self.items = []
+        self.item_index = {}
+        self.counts = np.zeros((0, 7, self.num_bins), dtype=np.float32)
+        self.days = np.zeros(7, dtype=np.int32)     # business dates seen per weekday
+        self.dates = set()
+        with self._lock:
+            self._conn.executescript(PROFILE_SCHEMA)
+            rows = self._conn.execute(
+                "SELECT business_date, items, item_idx, bins, qty FROM demand_profile_days "
+                "WHERE bin_minutes = ?", (bin_minutes,)).fetchall()
+            for business_date, items, item_idx, bins, qty in rows:
+                self._apply(business_date, *self._decode(items, item_idx, bins, qty), sign=1)
+
+    @staticmethod
+    def _decode(items, item_idx, bins, qty):
+        names = np.array(json.loads(items), dtype=object)
+        return (names[np.frombuffer(item_idx, dtype=np.int32)],
+                np.frombuffer(bins, dtype=np.int16).astype(np.int32),
+                np.frombuffer(qty, dtype=np.float32))
+
+    def _rows_for(self, names):
+        rows = np.empty(len(names), dtype=np.int64)
+        for i, name in enumerate(names):
+            row = self.item_index.get(name)
+            if row is None:
+                row = self.item_index[name] = len(self.items)
+                self.items.append(name)
+            rows[i] = row
+        if len(self.items) > len(self.counts):
+            grow = np.zeros((len(self.items) - len(self.counts), 7, self.num_bins),
+                            dtype=np.float32)
+            self.counts = np.concatenate([self.counts, grow])
+        return rows
+
+    def _apply(self, business_date, names, bins, qty, sign):
+        weekday = datetime.strptime(business_date, "%Y%m%d").weekday()
+        uniques, inverse = np.unique(names, return_inverse=True)
+        rows = self._rows_for(uniques)[inverse]
+        np.add.at(self.counts[:, weekday, :], (rows, bins), sign * qty)
+        self.days[weekday] += sign
+        (self.dates.add if sign > 0 else self.dates.discard)(business_date)
+
+    def ingest(self, selections):
+        """
+        Add selections (Business Date, Item, Qty sold, Opened) one business
+        date at a time. Returns the number of dates ingested.
+        """
+        if selections.empty or "Opened" not in selections.columns:
+            return 0
+        bins = selection_time_bins(selections["Opened"], self.bin_minutes)
+        frame = selections.assign(Bin=bins)
+        frame = frame[frame["Bin"] >= 0]
+        daily = frame.groupby(["Business Date", "Item", "Bin"], sort=False)["Qty sold"].sum()
+
+        with self._lock, self._conn:
+            for business_date, day in daily.groupby(level=0, sort=True):
+                business_date = str(business_date)
+                names = day.index.get_level_values(1)
+                item_codes, item_names = pd.factorize(names)
+                day_bins = day.index.get_level_values(2).to_numpy(np.int32)
+                qty = day.to_numpy(np.float32)
+
+                old = self._conn.execute(
+                    "SELECT items, item_idx, bins, qty FROM demand_profile_days "
+                    "WHERE business_date = ? AND bin_minutes = ?",
+                    (business_date, self.bin_minutes)).fetchone()
+                if old:
+                    self._apply(business_date, *self._decode(*old), sign=-1)
+
+                self._apply(business_date, np.asarray(names, dtype=object), day_bins, qty, sign=1)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO demand_profile_days VALUES (?, ?, ?, ?, ?, ?)",
+                    (business_date, self.bin_minutes, json.dumps(list(item_names)),
+                     item_codes.astype(np.int32).tobytes(),
+                     day_bins.astype(np.int16).tobytes(), qty.tobytes()))
+        return daily.index.get_level_values(0).nunique()
+
+    def snapshot(self):
+        """Read-only copy of the histogram, taken under the lock; it can't be ingested into"""
+        copy = object.__new__(type(self))
+        with self._lock:
+            copy.__dict__.update(self.__dict__, items=list(self.items), item_index=dict(self.item_index),
+                                 counts=self.counts.copy(), days=self.days.copy(),
+                                 dates=set(self.dates))
+        copy._conn = None
+        copy._lock = threading.Lock()
+        return copy
+
+    def ingredient_curves(self, recipe_matrix):
+        """
+        Share of each ingredient's daily usage per time bin, shape
+        (ingredients, 7, bins), each (ingredient, weekday) row summing to 1.
+        Ingredients with no history on a weekday follow the all-item curve.
+        """
+        curves = np.zeros((len(recipe_matrix.ingredients), 7, self.num_bins))
+        pooled = self.counts.sum(axis=0, dtype=np.float64)
+        pooled_total = pooled.sum(axis=1, keepdims=True)
+        pooled = np.divide(pooled, pooled_total, out=np.zeros_like(pooled), where=pooled_total > 0)
+        if self.items:
+            rows = recipe_matrix.item_rows(self.items)
+            known = rows >= 0
+            curves = np.einsum("pi,pdb->idb", recipe_matrix.matrix[rows[known]],
+                               self.counts[known].astype(np.float64))
+        totals = curves.sum(axis=2, keepdims=True)
+        return np.where(totals > 0, curves / np.where(totals > 0, totals, 1), pooled[None])
+
+    def hourly(self):
+        """Pooled quantity sold per weekday × hour of the business-day clock"""
+        per_hour = 60 // self.bin_minutes
+        return self.counts.sum(axis=0).reshape(7, -1, per_hour).sum(axis=2)
+
+
+@st.cache_resource
+def get_demand_profile():
+    return DemandProfile(DATA_DIR / "highdive.db")
+
+
+@traced("profile.ingest", measure=lambda days: {"rows": days})
+def ingest_toast_orders_to_profile(orders, flat=None):
+    """Stream a batch of raw Toast orders into the shared demand profile"""
+    selections, _ = flat or flatten_toast_orders(orders)
+    return get_demand_profile().ingest(selections)
+
+
+def _day_factor(day_name, day_adjustments):
+    return TYPICAL_WEIGHTS[day_name] * (1 + day_adjustments.get(day_name, 0) / 100)
+
+
+def daypart_prep(profile, recipe_matrix, ingredient_totals, prep_date, day_adjustments,
+                 dayparts=DAYPARTS):
+    """
+    Split one day's projected ingredient usage into dayparts.
+
+    ingredient_totals: weekly average usage, as from compute_weekly_ingredient_totals
+    Returns DataFrame: Ingredient, Unit, Vendor, one column per daypart, Day Total
+    """
+    day_name = DAY_ORDER[prep_date.weekday()]
+    factor = _day_factor(day_name, day_adjustments)
+    curves = profile.ingredient_curves(recipe_matrix)[:, prep_date.weekday(), :]
+    per_hour = 60 // profile.bin_minutes
+
+    rows = []
+    for ingredient, data in ingredient_totals.items():
+        col = recipe_matrix.ingredient_index.get(ingredient)
+        daily = data["qty_used"] * factor
+        if col is None or daily <= 0:
+            continue
+        row = {"Ingredient": ingredient, "Unit": data["unit"], "Vendor": data["vendor"]}
+        for label, start, end in dayparts:
+            lo = (start - PROFILE_DAY_START_HOUR) * per_hour
+            hi = (end - PROFILE_DAY_START_HOUR) * per_hour
+            row[label] = round(daily * curves[col, lo:hi].sum(), 1)
+        row["Day Total"] = round(daily, 1)
+        rows.append(row)
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows).sort_values("Day Total", ascending=False).reset_index(drop=True)
+
+
+def delivery_arrival(window):
+    """Datetime a window's delivery lands, from the schedule's delivery_time"""
+    hh, mm = (window["order"].get("delivery_time") or DEFAULT_DELIVERY_TIME).split(":")
+    return datetime.combine(window["delivery_date"], datetime.min.time()).replace(
+        hour=int(hh), minute=int(mm))
+
+
+def runout_check(profile, recipe_matrix, ingredient_totals, order_df, arrival, next_arrival,
+                 day_adjustments, closed_dates=()):
+    """
+    Will this delivery last until the vendor's next one lands?
+
+    Walks projected usage bin by bin from arrival to next_arrival, assuming
+    the shelf holds only what this order delivers. Returns DataFrame:
+    Ingredient, Unit, Ordered, Needed, Shortfall, Runs Out
+    """
+    curves = profile.ingredient_curves(recipe_matrix)
+    step = timedelta(minutes=profile.bin_minutes)
+    day_start = timedelta(hours=PROFILE_DAY_START_HOUR)
+
+    cols = [recipe_matrix.ingredient_index.get(i) for i in order_df["Ingredient"]]
+    known = np.array([c is not None for c in cols])
+    cols = np.array([c for c in cols if c is not None], dtype=np.int64)
+    weekly = np.array([ingredient_totals.get(i, {}).get("qty_used", 0)
+                       for i in order_df["Ingredient"][known]])
+
+    segments, stamps = [], []
+    business_date = (arrival - day_start).date()
+    while datetime.combine(business_date, datetime.min.time()) + day_start < next_arrival:
+        opens = datetime.combine(business_date, datetime.min.time()) + day_start
+        lo = max(0, int((arrival - opens) / step))
+        hi = min(profile.num_bins, int(np.ceil((next_arrival - opens) / step)))
+        if hi > lo and business_date not in closed_dates:
+            day_name = DAY_ORDER[business_date.weekday()]
+            segments.append(weekly[:, None] * _day_factor(day_name, day_adjustments)
+                            * curves[cols, business_date.weekday(), lo:hi])
+            stamps.extend(opens + step * (b + 1) for b in range(lo, hi))
+        business_date += timedelta(days=1)
+
+    ordered = order_df["ORDER QTY"].to_numpy(float)[known]
+    demand = np.concatenate(segments, axis=1) if segments else np.zeros((len(cols), 0))
+    cumulative = np.cumsum(demand, axis=1)
+    needed = cumulative[:, -1] if cumulative.shape[1] else np.zeros(len(cols))
+    short = cumulative > ordered[:, None]
+    first = short.argmax(axis=1) if short.shape[1] else np.zeros(len(cols), int)
+    first = np.where(short.any(axis=1), first, -1)
+
+    result = pd.DataFrame({
+        "Ingredient": order_df["Ingredient"][known].to_numpy(),
+        "Unit": order_df["Unit"][known].to_numpy(),
+        "Ordered": ordered,
+        "Needed": needed.round(1),
+        "Shortfall": np.clip(needed - ordered, 0, None).round(1),
+        "Runs Out": [f"{stamps[b]:%a %H:%M}" if b >= 0 else "" for b in first],
+    })
+    return result.sort_values("Shortfall", ascending=False).reset_index(drop=True)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# LIVE ORDER FEED (Toast order webhooks → per-day item counts)
+# ─────────────────────────────────────────────────────────────────────────────
+
+WEBHOOK_HOST = os.environ.get("HIGHDIVE_WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("HIGHDIVE_WEBHOOK_PORT", 0) or 0)   # 0 = receiver off
+WEBHOOK_SECRET = os.environ.get("HIGHDIVE_WEBHOOK_SECRET", "")
+WEBHOOK_PATH = "/webhooks/toast"
+
+LIVE_ORDER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS live_orders (
+    guid          TEXT    PRIMARY KEY,
+    business_date INTEGER NOT NULL,
+    modified      TEXT    NOT NULL DEFAULT '',
+    payload_hash  TEXT    NOT NULL,
+    voided        INTEGER NOT NULL DEFAULT 0,
+    received_at   TEXT    NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS live_order_items (
+    guid  TEXT NOT NULL,
+    item  TEXT NOT NULL,
+    qty   REAL NOT NULL,
+    sales REAL NOT NULL,
+    PRIMARY KEY (guid, item)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS live_day_items (
+    business_date INTEGER NOT NULL,
+    item          TEXT    NOT NULL,
+    qty           REAL    NOT NULL,
+    sales         REAL    NOT NULL,
+    PRIMARY KEY (business_date, item)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS live_order_modifiers (
+    guid     TEXT NOT NULL,
+    item     TEXT NOT NULL,
+    modifier TEXT NOT NULL,
+    qty      REAL NOT NULL,
+    PRIMARY KEY (guid, item, modifier)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS live_day_modifiers (
+    business_date INTEGER NOT NULL,
+    item          TEXT    NOT NULL,
+    modifier      TEXT    NOT NULL,
+    qty           REAL    NOT NULL,
+    PRIMARY KEY (business_date, item, modifier)
+) WITHOUT ROWID;
+"""
+
+
+def order_counts(order):
+    """
+    What an order currently contributes — nothing once voided:
+    ({ item: (qty, net sales) }, { (item, modifier): qty })
+    """
+    if order.get("voided") or order.get("deleted"):
+        return {}, {}
+    selections, modifiers = flatten_toast_orders([order])
+    if selections.empty:
+        return {}, {}
+    grouped = selections.groupby("Item", sort=False)[["Qty sold", "Net sales"]].sum()
+    mods = modifiers.groupby(["Item", "Modifier"], sort=False)["Qty"].sum()
+    return ({item: (float(q), float(s)) for item, q, s in
+             zip(grouped.index, grouped["Qty sold"], grouped["Net sales"])},
+            {key: float(q) for key, q in mods.items()})
+
+
+class LiveOrderStore:
+    """
+    Orders pushed by Toast webhooks, folded into per-day item counts as they arrive.
+
+    live_orders keeps one row per order GUID with a hash of the last payload
+    applied, and live_order_items / live_order_modifiers what that payload
+    contributed. A new version of an order applies only the difference to
+    live_day_items and live_day_modifiers, so
+    re-sent events are no-ops, updates and voids are idempotent and an
+    order moved to another business date leaves the old one. Events older
+    than the stored modifiedDate are ignored.
+
+    With a recipe matrix attached, theoretical ingredient usage per day is
+    kept in memory and moved by the same deltas.
+    """
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(LIVE_ORDER_SCHEMA)
+        self.version = 0                  # bumped on every change
+        self.stats = {"new": 0, "updated": 0, "voided": 0, "duplicate": 0, "stale": 0,
+                      "rejected": 0}
+        self.last_event = None
+        self.day_versions = {}            # business_date → version of its last change
+        self._matrix = None
+        self._usage = {}                  # business_date → ingredient usage vector
+
+    def ingest(self, order):
+        """Apply one order version; returns new / updated / voided / duplicate / stale"""
+        guid = order.get("guid")
+        try:
+            business_date = int(order.get("businessDate"))
+        except (TypeError, ValueError):
+            business_date = None
+        if not guid or business_date is None:
+            self.stats["rejected"] += 1
+            return "rejected"
+        payload_hash = hashlib.sha1(json.dumps(order, sort_keys=True).encode()).hexdigest()
+        modified = str(order.get("modifiedDate") or order.get("lastModifiedDate") or "")
+        counts, modifiers = order_counts(order)
+        voided = bool(order.get("voided") or order.get("deleted"))
+
+        with telemetry.span("live.ingest", items=len(counts)), self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT business_date, modified, payload_hash FROM live_orders WHERE guid = ?",
+                (guid,)).fetchone()
+            if row and row[2] == payload_hash:
+                result = "duplicate"
+            elif row and modified and row[1] and modified < row[1]:
+                result = "stale"
+            else:
+                if row:
+                    old = {item: (q, s) for item, q, s in self._conn.execute(
+                        "SELECT item, qty, sales FROM live_order_items WHERE guid = ?", (guid,))}
+                    old_mods = {(item, mod): q for item, mod, q in self._conn.execute(
+                        "SELECT item, modifier, qty FROM live_order_modifiers WHERE guid = ?",
+                        (guid,))}
+                    self._apply(row[0], old, old_mods, -1)
+                    self._conn.execute("DELETE FROM live_order_items WHERE guid = ?", (guid,))
+                    self._conn.execute("DELETE FROM live_order_modifiers WHERE guid = ?", (guid,))
+                self._apply(business_date, counts, modifiers, 1)
+                self._conn.executemany(
+                    "INSERT INTO live_order_items (guid, item, qty, sales) VALUES (?, ?, ?, ?)",
+                    [(guid, item, q, s) for item, (q, s) in counts.items()])
+                self._conn.executemany(
+                    "INSERT INTO live_order_modifiers (guid, item, modifier, qty) VALUES (?, ?, ?, ?)",
+                    [(guid, item, mod, q) for (item, mod), q in modifiers.items()])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO live_orders "
+                    "(guid, business_date, modified, payload_hash, voided, received_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (guid, business_date, modified, payload_hash, int(voided),
+                     datetime.now().isoformat(timespec="seconds")))
+                result = "voided" if voided else ("updated" if row else "new")
+                self.version += 1
+                for day in {business_date, row[0] if row else business_date}:
+                    self.day_versions[day] = self.version
+        self.stats[result] += 1
+        self.last_event = datetime.now()
+        telemetry.count("live_events", result=result)
+        return result
+
+    def _apply(self, business_date, counts, modifiers, sign):
+        """Add (sign=1) or remove (sign=-1) an order's contribution — caller holds the lock"""
+        self._conn.executemany(
+            "INSERT INTO live_day_modifiers (business_date, item, modifier, qty) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (business_date, item, modifier) DO UPDATE SET qty = qty + excluded.qty",
+            [(business_date, item, mod, sign * q) for (item, mod), q in modifiers.items()])
+        if not counts:
+            return
+        self._conn.executemany(
+            "INSERT INTO live_day_items (business_date, item, qty, sales) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (business_date, item) DO UPDATE SET "
+            "qty = qty + excluded.qty, sales = sales + excluded.sales",
+            [(business_date, item, sign * q, sign * s) for item, (q, s) in counts.items()])
+        if self._matrix is not None:
+            items = list(counts)
+            rows = self._matrix.item_rows(items)
+            hit = rows >= 0
+            if hit.any():
+                qty = np.array([counts[i][0] for i in items])[hit] * sign
+                usage = self._usage.setdefault(business_date,
+                                               np.zeros(len(self._matrix.ingredients)))
+                usage += qty @ self._matrix.matrix[rows[hit]]
+
+    def ingest_event(self, payload):
+        """
+        A webhook body: a Toast event envelope ({"details": {"order": {...}}}),
+        a bare order, or a list of either. Returns one result per order.
+        """
+        events = payload if isinstance(payload, list) else [payload]
+        results = []
+        for event in events:
+            if not isinstance(event, dict):
+                results.append("rejected")
+                continue
+            order = (event.get("details") or {}).get("order", event)
+            results.append(self.ingest(order))
+        return results
+
+    def _daily(self, table, columns, start, end):
+        """Non-zero rows of a live_day_* table between start and end, inclusive"""
+        sql = f"SELECT business_date, {', '.join(columns.values())} FROM {table} WHERE qty != 0"
+        params = []
+        if start is not None:
+            sql += " AND business_date >= ?"
+            params.append(int(f"{start:%Y%m%d}"))
+        if end is not None:
+            sql += " AND business_date <= ?"
+            params.append(int(f"{end:%Y%m%d}"))
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY business_date, item", params).fetchall()
+        df = pd.DataFrame(rows, columns=["Business Date", *columns])
+        df["Business Date"] = df["Business Date"].astype(str)
+        return _parse_business_dates(df)
+
+    def daily_sales(self, start=None, end=None):
+        """Per-day item counts shaped like aggregate_toast_orders_to_daily_sales"""
+        return self._daily("live_day_items", {"Item": "item", "Qty sold": "qty", "Net sales": "sales"},
+                           start, end)
+
+    def daily_modifiers(self, start=None, end=None):
+        """Per-day modifier counts shaped like aggregate_toast_modifiers(daily=True)"""
+        return self._daily("live_day_modifiers", {"Item": "item", "Modifier": "modifier", "Qty": "qty"},
+                           start, end)
+
+    def complete_dates(self, now=None):
+        """
+        Business dates (YYYYMMDD ints) that have closed and that the feed was
+        already receiving when they opened, so their counts are the whole day
+        """
+        now = now or datetime.now()
+        with self._lock:
+            first, = self._conn.execute("SELECT MIN(received_at) FROM live_orders").fetchone()
+            days = [d for d, in self._conn.execute("SELECT DISTINCT business_date FROM live_orders")]
+        if first is None:
+            return []
+        first = datetime.fromisoformat(first)
+        opens = {d: datetime.strptime(str(d), "%Y%m%d") + timedelta(hours=PROFILE_DAY_START_HOUR)
+                 for d in days}
+        return sorted(d for d, opened in opens.items()
+                      if first <= opened and opened + timedelta(days=1) <= now)
+
+    def order_count(self, business_date=None):
+        sql, params = "SELECT COUNT(*) FROM live_orders WHERE voided = 0", []
+        if business_date is not None:
+            sql += " AND business_date = ?"
+            params.append(int(f"{business_date:%Y%m%d}"))
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def attach_matrix(self, recipe_matrix):
+        """Track theoretical usage against recipe_matrix, rebuilt from the stored counts"""
+        if recipe_matrix is self._matrix:
+            return
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT business_date, item, qty FROM live_day_items WHERE qty != 0").fetchall()
+            self._matrix = recipe_matrix
+            self._usage = {}
+            if rows:
+                days, items, qty = zip(*rows)
+                item_rows = recipe_matrix.item_rows(list(items))
+                for day in set(days):
+                    pick = (np.array(days) == day) & (item_rows >= 0)
+                    self._usage[day] = (np.array(qty)[pick]
+                                        @ recipe_matrix.matrix[item_rows[pick]])
+
+    def theoretical_usage(self, business_date):
+        """Ingredient usage implied by the day's orders so far (attach_matrix first)"""
+        usage = self._usage.get(int(f"{business_date:%Y%m%d}"))
+        if self._matrix is None or usage is None:
+            return pd.DataFrame(columns=["Ingredient", "Used", "Unit"])
+        keep = np.flatnonzero(np.abs(usage) > 1e-9)
+        return (pd.DataFrame({"Ingredient": [self._matrix.ingredients[i] for i in keep],
+                              "Used": usage[keep].round(2),
+                              "Unit": [self._matrix.units[i] for i in keep]})
+                .sort_values("Used", ascending=False, ignore_index=True))
+
+
+@st.cache_resource
+def get_live_order_store():
+    return LiveOrderStore(DATA_DIR / "highdive.db")
+
+
+def verify_toast_signature(body, signature, secret):
+    """Toast signs webhook bodies: base64(HMAC-SHA256(secret, body))"""
+    expected = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(expected, signature or "")
+
+
+def make_webhook_server(store, host=WEBHOOK_HOST, port=WEBHOOK_PORT, secret=WEBHOOK_SECRET):
+    """
+    HTTP receiver for Toast order webhooks (not started):
+
+      POST /webhooks/toast           event body → {"results": [...]}
+      GET  /webhooks/toast/health    receiver stats
+      GET  /webhooks/toast/days?date=YYYYMMDD   that day's item counts
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, data):
+            body = json.dumps(data, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if urlparse(self.path).path.rstrip("/") != WEBHOOK_PATH:
+                return self._reply(404, {"error": "not found"})
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if secret and not verify_toast_signature(body, self.headers.get("Toast-Signature"),
+                                                     secret):
+                return self._reply(401, {"error": "bad signature"})
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                return self._reply(400, {"error": "body is not JSON"})
+            self._reply(200, {"results": store.ingest_event(payload)})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == f"{WEBHOOK_PATH}/health":
+                return self._reply(200, {"version": store.version, "stats": store.stats,
+                                         "last_event": store.last_event})
+            if url.path == f"{WEBHOOK_PATH}/days":
+                try:
+                    day = datetime.strptime(parse_qs(url.query)["date"][0], "%Y%m%d").date()
+                except (KeyError, ValueError):
+                    return self._reply(400, {"error": "date=YYYYMMDD is required"})
+                df = store.daily_sales(day, day)
+                return self._reply(200, {"date": f"{day:%Y%m%d}", "orders": store.order_count(day),
+                                         "items": dict(zip(df["Item"], df["Qty sold"]))})
+            self._reply(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+@st.cache_resource(show_spinner=False)
+def get_webhook_receiver():
+    """The process's webhook receiver, started once when HIGHDIVE_WEBHOOK_PORT is set"""
+    if not WEBHOOK_PORT:
+        return None
+    try:
+        server = make_webhook_server(get_live_order_store())
+    except OSError as e:
+        return {"error": str(e)}
+    threading.Thread(target=server.serve_forever, name="toast-webhooks", daemon=True).start()
+    return server
+
+
+def apply_live_orders(store):
+    """
+    Fill this session's daily sales and modifiers from the live feed. Live
+    counts fill business dates no bulk pull has loaded, and keep refreshing
+    the dates they filled; dates a bulk pull loads take over from the live
+    feed. Clear All Data resets live_version so the live rows come back.
+    """
+    if store.version == st.session_state.live_version:
+        return
+    st.session_state.live_version = store.version
+    live = store.daily_sales()
+    existing = _without_dates(st.session_state.daily_sales, st.session_state.live_dates)
+    modifiers = _without_dates(st.session_state.daily_modifiers, st.session_state.live_dates)
+    bulk_dates = set() if existing is None else set(existing["Business Date"].unique())
+    fill = live[~live["Business Date"].isin(bulk_dates)]
+    if not fill.empty:
+        existing = merge_daily_sales(existing, fill)
+        live_mods = store.daily_modifiers()
+        live_mods = live_mods[live_mods["Business Date"].isin(fill["Business Date"].unique())]
+        if not live_mods.empty:
+            modifiers = merge_daily_sales(modifiers, live_mods)
+    st.session_state.daily_sales = existing
+    st.session_state.daily_modifiers = modifiers
+    st.session_state.live_dates = set(fill["Business Date"].unique())
+
+    # Closed dates the feed saw whole join the merged datasets as one standing
+    # load, replaced only when one of those dates changes; bulk pulls outrank it
+    datasets = st.session_state.weekly_data
+    if not hasattr(datasets, "meta"):
+        return
+    complete = store.complete_dates()
+    loaded = tuple((d, store.day_versions.get(d, 0)) for d in complete)
+    if complete and (loaded != st.session_state.get("live_loaded")
+                     or LIVE_FEED_LABEL not in datasets.meta):
+        dates = pd.to_datetime([str(d) for d in complete], format="%Y%m%d")
+        datasets.add(LIVE_FEED_LABEL, live[live["Business Date"].isin(dates)], "live",
+                     dates=dates, refresh=True)
+        st.session_state.live_loaded = loaded
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# FORECAST BACKTESTING
+# ─────────────────────────────────────────────────────────────────────────────
+
+class DailyUsageHistory:
+    """
+    Realized ingredient usage on a continuous daily calendar.
+
+    usage[d, j] is the usage of ingredient j on start + d days; cumsum has a
+    leading zero row so any window total is cumsum[b] - cumsum[a], and
+    dow_cumsum chains every 7th day so same-weekday totals are just as cheap.
+    """
+
+    def __init__(self, daily_sales, recipe_matrix, daily_modifiers=None, modifier_deltas=None):
+        dates = pd.to_datetime(daily_sales["Business Date"]).dt.normalize()
+        self.start = dates.min()
+        self.num_days = int((dates.max() - self.start).days) + 1
+        self.recipe_matrix = recipe_matrix
+
+        day_idx = (dates - self.start).dt.days.to_numpy()
+        rows = recipe_matrix.item_rows(daily_sales["Item"])
+        hit = rows >= 0
+        qty = pd.to_numeric(daily_sales["Qty sold"], errors="coerce").fillna(0).to_numpy(float)
+
+        sales = np.zeros((self.num_days, len(recipe_matrix.items)))
+        np.add.at(sales, (day_idx[hit], rows[hit]), qty[hit])
+        self.usage = sales @ recipe_matrix.matrix
+        if daily_modifiers is not None and not daily_modifiers.empty:
+            calendar = pd.date_range(self.start, periods=self.num_days)
+            delta, _ = modifier_usage(daily_modifiers, recipe_matrix, modifier_deltas or {},
+                                      dates=calendar)
+            self.usage = np.clip(self.usage + delta, 0, None)
+
+        self.cumsum = np.vstack([np.zeros((1, self.usage.shape[1])),
+                                 np.cumsum(self.usage, axis=0)])
+
+        weeks = -(-self.num_days // 7)
+        padded = np.zeros((weeks * 7, self.usage.shape[1]))
+        padded[:self.num_days] = self.usage
+        self.dow_cumsum = np.cumsum(padded.reshape(weeks, 7, -1), axis=0).reshape(weeks * 7, -1)
+
+    def weekday(self, offsets):
+        return (np.asarray(offsets) + self.start.weekday()) % 7
+
+    def window_sum(self, start, end):
+        """Usage summed over day offsets [start, end) for arrays of windows"""
+        return self.cumsum[end] - self.cumsum[start]
+
+    def dow_sum(self, newest, count):
+        """Sum of usage on newest, newest-7, ... (count days) for arrays of offsets"""
+        newest = np.asarray(newest)
+        oldest = newest - 7 * count
+        total = self.dow_cumsum[newest]
+        older = oldest >= 0
+        total[older] -= self.dow_cumsum[oldest[older]]
+        return total
+
+
+def schedule_window_dates(history, order, lookback_weeks):
+    """
+    Every historical occurrence of one order window that has enough history.
+
+    Returns (order_offsets[W], covered_offsets[W, k]) as day offsets.
+    """
+    order_wd = DAY_ORDER.index(order["order_day"])
+    delivery_gap = (DAY_ORDER.index(order["delivery_day"]) - order_wd) % 7 or 7
+    delivery_wd = (order_wd + delivery_gap) % 7
+    cover_gaps = np.array([(DAY_ORDER.index(d) - delivery_wd) % 7 for d in order["covers"]])
+
+    first = lookback_weeks * 7
+    first += (order_wd - history.weekday(first)) % 7
+    order_offsets = np.arange(first, history.num_days, 7)
+    covered = order_offsets[:, None] + delivery_gap + cover_gaps[None, :]
+    complete = covered.max(axis=1) < history.num_days
+    return order_offsets[complete], covered[complete]
+
+
+def _backtest_window(history, vendor_key, order, lookback_weeks, waste_factor, method):
+    """Predicted vs actual usage for every week of one vendor order window"""
+    cols = history.recipe_matrix.vendor_columns(vendor_key)
+    order_offsets, covered = schedule_window_dates(history, order, lookback_weeks)
+    if len(cols) == 0 or len(order_offsets) == 0:
+        return None
+
+    actual = history.usage[covered][:, :, cols].sum(axis=1)
+
+    if method == "dow":
+        # Average of the same weekday over the last N weeks before the order date
+        steps_back = (covered - order_offsets[:, None]) // 7 + 1
+        newest = covered - 7 * steps_back
+        predicted = np.zeros_like(actual)
+        for j in range(covered.shape[1]):
+            predicted += history.dow_sum(newest[:, j], lookback_weeks)[:, cols] / lookback_weeks
+    else:
+        # The Generate Orders pipeline: trailing weekly average × day weights
+        weekly = history.window_sum(order_offsets - 7 * lookback_weeks, order_offsets)[:, cols]
+        weekly /= lookback_weeks
+        weights = np.array([TYPICAL_WEIGHTS[d] for d in DAY_ORDER])
+        predicted = weekly * weights[history.weekday(covered)].sum(axis=1)[:, None]
+
+    predicted *= waste_factor
+    return {
+        "vendor": vendor_key,
+        "window": order_window_label(order),
+        "cols": cols,
+        "order_dates": history.start + pd.to_timedelta(order_offsets, unit="D"),
+        "predicted": predicted,
+        "actual": actual,
+    }
+
+
+# A worker that hasn't reported for this long is presumed stuck (a lock it
+# inherited held by a parent thread) and its tasks run in-process instead
+FORK_POLL_SECONDS = 1.0
+FORK_STALL_SECONDS = 120.0
+
+
+def _fork_worker(fn, tasks, indexes, queue):
+    for i in indexes:
+        try:
+            queue.put((i, fn(tasks[i])))
+        except Exception as e:
+            queue.put((i, e))
+
+
+def _fork_map(fn, tasks, workers):
+    """
+    Map fn over tasks in forked worker processes.
+
+    Workers inherit the caller's memory (compiled matrix, cumulative sums) so
+    only task indexes and results cross process boundaries. Falls back to a
+    plain loop where fork is unavailable. fn must only touch that inherited
+    data: the server's other threads may hold locks the child can never take.
+    A worker that dies or stalls is terminated and whatever it hadn't
+    returned is computed in-process.
+    """
+    if workers <= 1 or len(tasks) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [fn(t) for t in tasks]
+
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    chunks = [list(range(i, len(tasks), workers)) for i in range(min(workers, len(tasks)))]
+    procs = [ctx.Process(target=_fork_worker, args=(fn, tasks, chunk, queue), daemon=True)
+             for chunk in chunks]
+    results, done = [None] * len(tasks), set()
+    try:
+        for p in procs:
+            p.start()
+        last = time.monotonic()
+        while len(done) < len(tasks):
+            try:
+                i, result = queue.get(timeout=FORK_POLL_SECONDS)
+            except Empty:
+                if (all(not p.is_alive() for p in procs)
+                        or time.monotonic() - last > FORK_STALL_SECONDS):
+                    telemetry.count("fork_map", len(tasks) - len(done), result="lost")
+                    break
+                continue
+            results[i] = result
+            done.add(i)
+            last = time.monotonic()
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+            p.join(timeout=5)
+        queue.close()
+    for i in set(range(len(tasks))) - done:
+        results[i] = fn(tasks[i])
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+@traced("backtest.run")
+def run_backtest(daily_sales, recipe_matrix, vendor_schedules, lookback_weeks=4,
+                 waste_factor=1.10, method="weights", unit_costs=None, workers=1,
+                 daily_modifiers=None, modifier_deltas=None):
+    """
+    Replay every vendor order window over the daily sales history.
+
+    As of each historical order day, the order is forecast from the preceding
+    lookback_weeks of usage and compared with the usage realized over the
+    days it covers.
+
+    method: "weights" — weekly average spread by TYPICAL_WEIGHTS (current orders)
+            "dow"     — average of the same weekday over the lookback weeks
+    unit_costs: optional { ingredient: cost per unit } for over/under cost
+    daily_modifiers / modifier_deltas: include modifier usage in realized usage
+    Returns: dict with "by_ingredient", "by_vendor" and "by_week" DataFrames
+    """
+    history = DailyUsageHistory(daily_sales, recipe_matrix, daily_modifiers, modifier_deltas)
+    tasks = [(v_key, o) for v_key, v_data in vendor_schedules.items()
+             for o in v_data.get("orders", [])]
+
+    results = _fork_map(
+        lambda t: _backtest_window(history, t[0], t[1], lookback_weeks, waste_factor, method),
+        tasks, workers
+    )
+
+    unit_costs = unit_costs or {}
+    ingredient_frames, week_frames = [], []
+    for r in results:
+        if r is None:
+            continue
+        names = [recipe_matrix.ingredients[c] for c in r["cols"]]
+        pred, act = r["predicted"], r["actual"]
+        over = np.clip(pred - act, 0, None)
+        under = np.clip(act - pred, 0, None)
+        ingredient_frames.append(pd.DataFrame({
+            "Vendor": r["vendor"],
+            "Window": r["window"],
+            "Ingredient": names,
+            "Unit": [recipe_matrix.units[c] for c in r["cols"]],
+            "Weeks": len(pred),
+            "Ordered": pred.sum(axis=0),
+            "Actual": act.sum(axis=0),
+            "Abs Error": np.abs(pred - act).sum(axis=0),
+            "Over Units": over.sum(axis=0),
+            "Under Units": under.sum(axis=0),
+            "Short Weeks": (under > 0).sum(axis=0),
+            "Unit Cost": [unit_costs.get(n, np.nan) for n in names],
+        }))
+        week_frames.append(pd.DataFrame({
+            "Vendor": r["vendor"],
+            "Window": r["window"],
+            "Order Date": r["order_dates"],
+            "Ordered": pred.sum(axis=1),
+            "Actual": act.sum(axis=1),
+        }))
+
+    if not ingredient_frames:
+        empty = pd.DataFrame()
+        return {"by_ingredient": empty, "by_vendor": empty, "by_week": empty}
+
+    by_ing = (pd.concat(ingredient_frames, ignore_index=True)
+              .groupby(["Vendor", "Ingredient", "Unit"], as_index=False)
+              .agg({"Weeks": "sum", "Ordered": "sum", "Actual": "sum", "Abs Error": "sum",
+                    "Over Units": "sum", "Under Units": "sum", "Short Weeks": "sum",
+                    "Unit Cost": "first"}))
+    by_ing["Bias %"] = ((by_ing["Ordered"] - by_ing["Actual"])
+                        / by_ing["Actual"].where(by_ing["Actual"] > 0) * 100)
+    by_ing["WAPE %"] = by_ing["Abs Error"] / by_ing["Actual"].where(by_ing["Actual"] > 0) * 100
+    by_ing["Over Cost"] = by_ing["Over Units"] * by_ing["Unit Cost"]
+    by_ing["Under Cost"] = by_ing["Under Units"] * by_ing["Unit Cost"]
+    by_ing = by_ing.sort_values(["Vendor", "Abs Error"], ascending=[True, False],
+                                ignore_index=True)
+
+    by_vendor = by_ing.groupby("Vendor", as_index=False).agg(
+        **{"Ingredients": ("Ingredient", "count"),
+           "Median WAPE %": ("WAPE %", "median"),
+           "Median Bias %": ("Bias %", "median"),
+           "Short Weeks": ("Short Weeks", "sum"),
+           "Over Cost": ("Over Cost", lambda c: c.sum(min_count=1)),
+           "Under Cost": ("Under Cost", lambda c: c.sum(min_count=1))}
+    )
+
+    return {
+        "by_ingredient": by_ing,
+        "by_vendor": by_vendor,
+        "by_week": pd.concat(week_frames, ignore_index=True),
+    }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# INVENTORY SIMULATION (deliveries, usage and shelf-life expiry per day)
+# ─────────────────────────────────────────────────────────────────────────────
+
+DEFAULT_DEMAND_CV = 0.25    # day-to-day demand variation when there is no daily history
+
+
+@st.cache_data
+def load_ingredient_properties():
+    """Per-ingredient metadata (shelf life, …) with per-vendor defaults"""
+    path = Path(__file__).parent / "ingredient_properties.json"
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)
+    return {"vendor_defaults": {}, "ingredients": {}}
+
+
+def ingredient_properties_for(ingredients, vendors, properties, key, default=None):
+    """One property per ingredient, falling back to the ingredient's vendor default"""
+    by_name = {k.lower(): v for k, v in properties.get("ingredients", {}).items()}
+    vendor_defaults = properties.get("vendor_defaults", {})
+    values = []
+    for ingredient, vendor in zip(ingredients, vendors):
+        value = by_name.get(ingredient.lower(), {}).get(key)
+        if value is None:
+            value = vendor_defaults.get(vendor, {}).get(key)
+        values.append(default if value is None else value)
+    return values
+
+
+def simulate_inventory(usage, deliveries, shelf_life, on_hand=None, report_from=0):
+    """
+    Step inventory through every day for all samples and ingredients at once.
+
+    usage:      (samples, ingredients, days) demand per day
+    deliveries: (ingredients, days) quantity arriving at the start of each day
+    shelf_life: (ingredients,) usable days after delivery, inf = never expires
+    Stock is tracked in age buckets and used oldest first; a lot expires at
+    the end of its last usable day (a part day counts as a whole one).
+
+    Returns dict of (ingredients, days) arrays: mean_level, p_short,
+    mean_short, mean_spoiled — plus p_any_short (ingredients,), the share of
+    samples that run short at least once from day report_from on
+    """
+    samples, num_ing, num_days = usage.shape
+    perishable = np.flatnonzero(shelf_life < num_days)
+    usable = np.ceil(shelf_life[perishable])
+    ages = int(usable.max()) if perishable.size else 1
+
+    # Perishable stock by age, oldest bucket first; everything else is one level
+    lots = np.zeros((samples, perishable.size, ages), dtype=np.float32)
+    level = np.zeros((samples, num_ing), dtype=np.float32)
+    if on_hand is not None:
+        level[:] = on_hand
+        lots[:, :, -1] = level[:, perishable]
+    keeps = (usable[:, None] - np.arange(ages, 0, -1)[None, :]) > 0
+
+    out = {k: np.zeros((num_ing, num_days)) for k in ("mean_level", "p_short",
+                                                       "mean_short", "mean_spoiled")}
+    any_short = np.zeros((samples, num_ing), dtype=bool)
+
+    for d in range(num_days):
+        demand = usage[:, :, d]
+        level += deliveries[:, d]
+        taken = np.minimum(level, demand)
+        spoiled = np.zeros_like(level)
+
+        if perishable.size:
+            lots[:, :, -1] += deliveries[perishable, d]
+            before = np.cumsum(lots, axis=2) - lots
+            lot_taken = np.clip(demand[:, perishable, None] - before, 0, lots)
+            lots -= lot_taken
+            taken[:, perishable] = lot_taken.sum(axis=2)
+
+            # Expire lots past their last usable day, then age everything a day
+            remaining = lots.sum(axis=2)
+            lots *= keeps
+            spoiled[:, perishable] = remaining - lots.sum(axis=2)
+            lots[:, :, 0] += lots[:, :, 1] if ages > 1 else 0
+            lots[:, :, 1:-1] = lots[:, :, 2:]
+            lots[:, :, -1] = 0
+
+        level -= taken + spoiled
+        short = demand - taken
+
+        stocked_out = short > 1e-6
+        if d >= report_from:
+            any_short |= stocked_out
+        out["mean_level"][:, d] = level.mean(axis=0)
+        out["p_short"][:, d] = stocked_out.mean(axis=0)
+        out["mean_short"][:, d] = short.mean(axis=0)
+        out["mean_spoiled"][:, d] = spoiled.mean(axis=0)
+
+    out["p_any_short"] = any_short.mean(axis=0)
+    return out
+
+
+def usage_ratio_pool(history):
+    """
+    Each historical day's usage as a ratio to its weekday's mean — the
+    empirical day-to-day variation that Monte Carlo demand is drawn from.
+
+    Returns { weekday: (days, ingredients) ratio array }
+    """
+    weekdays = history.weekday(np.arange(history.num_days))
+    active = history.usage.sum(axis=1) > 0
+    pool = {}
+    for wd in range(7):
+        days = history.usage[(weekdays == wd) & active]
+        if len(days) < 2:
+            continue
+        mean = days.mean(axis=0)
+        pool[wd] = np.where(mean > 0, days / np.where(mean > 0, mean, 1), 1.0).astype(np.float32)
+    return pool
+
+
+def sample_usage(expected, dates, samples, ratio_pool=None, seed=0):
+    """
+    Draw (samples, ingredients, days) demand around the expected usage.
+
+    Days are resampled whole from same-weekday history when ratio_pool has
+    that weekday, keeping ingredients that sell together correlated;
+    otherwise demand is gamma distributed with DEFAULT_DEMAND_CV.
+    """
+    rng = np.random.default_rng(seed)
+    num_ing, num_days = expected.shape
+    usage = np.empty((samples, num_ing, num_days), dtype=np.float32)
+    shape = 1 / DEFAULT_DEMAND_CV ** 2
+    for d, day in enumerate(dates):
+        pool = (ratio_pool or {}).get(day.weekday())
+        if pool is not None:
+            ratios = pool[rng.integers(len(pool), size=samples)]
+        else:
+            ratios = rng.gamma(shape, 1 / shape, size=(samples, num_ing))
+        usage[:, :, d] = ratios * expected[:, d]
+    return usage
+
+
+@traced("simulation.run")
+def run_inventory_simulation(ingredient_totals, recipe_matrix, vendor_schedules, exceptions,
+                             start, horizon_days, day_adjustments, waste_factor=1.10,
+                             properties=None, history=None, samples=1000, seed=0,
+                             warmup_days=7, shelf_life_aware=True):
+    """
+    Project every ingredient's stock day by day when each vendor order is
+    placed as Generate Orders would calculate it.
+
+    The run starts warmup_days early with empty shelves so the horizon opens
+    with realistic stock. samples=1 uses the expected demand only.
+    shelf_life_aware places perishables by ShelfLifePlan, as Generate Orders does.
+    Returns dict: dates, ingredients, units, vendors, shelf_life and the
+    (ingredients, days) arrays from simulate_inventory
+    """
+    sim_start = start - timedelta(days=warmup_days)
+    num_days = warmup_days + horizon_days
+    dates = [sim_start + timedelta(days=i) for i in range(num_days)]
+    calendar = get_delivery_calendar(vendor_schedules, exceptions,
+                                     sim_start - timedelta(days=14), num_days + 14)
+
+    ingredients = recipe_matrix.ingredients
+    vendors = [ingredient_totals.get(i, {}).get("vendor", v)
+               for i, v in zip(ingredients, recipe_matrix.vendors)]
+    weekly = np.array([ingredient_totals.get(i, {}).get("qty_used", 0) for i in ingredients])
+    vendor_index = {v: np.flatnonzero(np.array(vendors) == v) for v in set(vendors)}
+
+    def day_factor(d):
+        if not calendar.is_open(d):
+            return 0.0
+        return _day_factor(DAY_ORDER[d.weekday()], day_adjustments)
+
+    expected = weekly[:, None] * np.array([day_factor(d) for d in dates])[None, :]
+
+    shelf_life = np.array(ingredient_properties_for(
+        ingredients, vendors, properties or load_ingredient_properties(),
+        "shelf_life_days", np.inf), dtype=float)
+    plan = ShelfLifePlan(calendar, ingredients, vendors, shelf_life) if shelf_life_aware else None
+    planned = np.zeros(len(ingredients), dtype=bool)
+    if plan is not None:
+        plan_rows = [recipe_matrix.ingredient_index[i] for i in plan.ingredients]
+        planned[plan_rows] = True
+
+    deliveries = np.zeros((len(ingredients), num_days))
+    for w in calendar.windows:
+        offset = (w["delivery_date"] - sim_start).days
+        cols = vendor_index.get(w["vendor"])
+        if cols is None or not 0 <= offset < num_days:
+            continue
+        cols = cols[~planned[cols]]
+        window_factor = sum(frac * day_factor(d) for d, frac in calendar.usage_weights(w).items())
+        deliveries[cols, offset] += np.round(weekly[cols] * window_factor * waste_factor, 1)
+
+    if plan is not None:
+        qty, _ = plan.window_quantities(plan.adjusted, ingredient_totals, day_adjustments,
+                                        waste_factor)
+        offsets = plan.delivery - (sim_start - plan.start).days
+        inside = (offsets >= 0) & (offsets < num_days)
+        planned_deliveries = np.zeros((len(plan_rows), num_days))
+        np.add.at(planned_deliveries.T, offsets[inside], qty[inside])
+        deliveries[plan_rows] += planned_deliveries
+
+    if samples <= 1:
+        usage = expected[None].astype(np.float32)
+    else:
+        pool = usage_ratio_pool(history) if history is not None else None
+        usage = sample_usage(expected, dates, samples, pool, seed)
+
+    result = simulate_inventory(usage, deliveries, shelf_life, report_from=warmup_days)
+    keep = slice(warmup_days, None)
+    for key in ("mean_level", "p_short", "mean_short", "mean_spoiled"):
+        result[key] = result[key][:, keep]
+    result.update(dates=dates[warmup_days:], ingredients=ingredients, vendors=vendors,
+                  units=recipe_matrix.units, shelf_life=shelf_life,
+                  deliveries=deliveries[:, keep], expected=expected[:, keep])
+    return result
+
+
+def inventory_risk_table(result, risk_threshold=0.1):
+    """Per-ingredient stockout and spoilage summary of a simulation run"""
+    at_risk = result["p_short"] >= risk_threshold
+    first_risk = at_risk.argmax(axis=1) if at_risk.shape[1] else np.zeros(len(at_risk), int)
+    first_risk = np.where(at_risk.any(axis=1), first_risk, -1)
+    table = pd.DataFrame({
+        "Ingredient": result["ingredients"],
+        "Vendor": result["vendors"],
+        "Unit": result["units"],
+        "Shelf Life (days)": np.where(np.isfinite(result["shelf_life"]), result["shelf_life"], np.nan),
+        "Stockout Risk %": (result["p_any_short"] * 100).round(1),
+        "First Risk Day": [f"{result['dates'][i]:%a %b %d}" if i >= 0 else "" for i in first_risk],
+        "Expected Short": result["mean_short"].sum(axis=1).round(1),
+        "Expected Spoilage": result["mean_spoiled"].sum(axis=1).round(1),
+        "Delivered": result["deliveries"].sum(axis=1).round(1),
+    })
+    table = table[table["Delivered"] + result["expected"].sum(axis=1) > 0]
+    return table.sort_values(["Stockout Risk %", "Expected Spoilage"],
+                             ascending=False).reset_index(drop=True)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SHELF-LIFE AWARE ORDERING (perishable coverage across vendor windows)
+# ─────────────────────────────────────────────────────────────────────────────
+
+class ShelfLifePlan:
+    """
+    Perishable coverage for every window of a DeliveryCalendar at once.
+
+    A window's covered day stays with it while the delivery is still within
+    the ingredient's shelf life. Past that, the day moves to the vendor's
+    freshest delivery that has landed by then; if none is fresh enough the
+    day is left uncovered rather than ordered to spoil.
+
+    Arrays are (windows, perishables, days) coverage fractions from
+    calendar.start: base (as scheduled), adjusted and gap (uncovered).
+    """
+
+    def __init__(self, calendar, ingredients, vendors, shelf_life):
+        self.calendar = calendar
+        self.start = calendar.start
+        self.windows = calendar.windows
+        # Keyed by value, not identity: callers may hold windows from an
+        # equal calendar built after the cached one was evicted
+        self._window_index = {(w["vendor"], w["delivery_date"]): k
+                              for k, w in enumerate(self.windows)}
+
+        perishable = np.flatnonzero(np.isfinite(shelf_life))
+        self.ingredients = [ingredients[j] for j in perishable]
+        self.ingredient_index = {name: p for p, name in enumerate(self.ingredients)}
+        self.vendors = np.array([vendors[j] for j in perishable], dtype=object)
+        self.shelf_life = np.asarray(shelf_life, dtype=float)[perishable]
+
+        last = max((d for w in self.windows for d in w["coverage"]), default=calendar.end)
+        self.num_days = max((last - self.start).days + 1, 1)
+        days = np.arange(self.num_days)
+
+        base = np.zeros((len(self.windows), self.num_days))
+        for k, w in enumerate(self.windows):
+            for d, frac in calendar.usage_weights(w).items():
+                if 0 <= (d - self.start).days < self.num_days:
+                    base[k, (d - self.start).days] = frac
+        self.delivery = np.array([(w["delivery_date"] - self.start).days for w in self.windows],
+                                 dtype=np.int64)
+        window_vendor = np.array([w["vendor"] for w in self.windows], dtype=object)
+
+        age = days[None, :] - self.delivery[:, None]                             # (W, D)
+        fresh = (age[:, None, :] >= 0) & (age[:, None, :] < self.shelf_life[None, :, None])
+
+        # The vendor's most recent delivery on or before each day
+        freshest = np.full((len(self.windows), self.num_days), -1, dtype=np.int64)
+        for vendor in set(window_vendor):
+            ks = np.flatnonzero(window_vendor == vendor)
+            ks = ks[np.argsort(self.delivery[ks], kind="stable")]
+            pos = np.searchsorted(self.delivery[ks], days, side="right") - 1
+            freshest[ks] = np.where(pos >= 0, ks[np.clip(pos, 0, None)], -1)[None, :]
+
+        owns = window_vendor[:, None] == self.vendors[None, :]
+        self.base = base[:, None, :] * owns[:, :, None]
+        stale = self.base * ~fresh
+        self.adjusted = self.base * fresh
+        self.gap = np.zeros_like(self.base)
+
+        w_idx, p_idx, d_idx = np.nonzero(stale)
+        target = freshest[w_idx, d_idx]
+        movable = (target >= 0) & (target != w_idx)
+        movable[movable] = fresh[target[movable], p_idx[movable], d_idx[movable]]
+        np.add.at(self.adjusted, (target[movable], p_idx[movable], d_idx[movable]),
+                  stale[w_idx[movable], p_idx[movable], d_idx[movable]])
+        self.gap[w_idx[~movable], p_idx[~movable], d_idx[~movable]] = \
+            stale[w_idx[~movable], p_idx[~movable], d_idx[~movable]]
+
+    def window_coverage(self, window):
+        """{ ingredient: { date: fraction } } for perishables whose coverage changed"""
+        k = self._window_index.get((window["vendor"], window["delivery_date"]))
+        if k is None:
+            return {}
+        changed = np.flatnonzero(np.abs(self.adjusted[k] - self.base[k]).sum(axis=1) > 1e-9)
+        return {
+            self.ingredients[p]: {self.start + timedelta(days=int(d)): float(self.adjusted[k, p, d])
+                                  for d in np.flatnonzero(self.adjusted[k, p])}
+            for p in changed
+        }
+
+    def window_changes(self, window):
+        """DataFrame of a window's perishables: days dropped, taken over and uncovered"""
+        k = self._window_index.get((window["vendor"], window["delivery_date"]))
+        if k is None:
+            return pd.DataFrame()
+
+        def day_list(mask):
+            return ", ".join(f"{self.start + timedelta(days=int(d)):%a %m/%d}"
+                             for d in np.flatnonzero(mask))
+
+        rows = []
+        for p in np.flatnonzero(np.abs(self.adjusted[k] - self.base[k]).sum(axis=1)
+                                + self.gap[k].sum(axis=1) > 1e-9):
+            base, adjusted = self.base[k, p], self.adjusted[k, p]
+            rows.append({
+                "Ingredient": self.ingredients[p],
+                "Shelf Life (days)": int(self.shelf_life[p]),
+                "Handed to Later Delivery": day_list((base > 0) & (adjusted < base) & (self.gap[k, p] == 0)),
+                "Taken Over": day_list(adjusted > base),
+                "Uncovered": day_list(self.gap[k, p] > 0),
+            })
+        return pd.DataFrame(rows)
+
+    def window_quantities(self, coverage, ingredient_totals, day_adjustments, waste_factor):
+        """Order quantity per (window, perishable) for a coverage array"""
+        factor = np.array([_day_factor(DAY_ORDER[(self.start + timedelta(days=d)).weekday()],
+                                       day_adjustments) for d in range(self.num_days)])
+        weekly = np.array([ingredient_totals.get(i, {}).get("qty_used", 0)
+                           for i in self.ingredients])
+        return np.round(np.einsum("wpd,d->wp", coverage, factor) * weekly[None, :]
+                        * waste_factor, 1), weekly[:, None] * factor[None, :]
+
+    def spoilage_report(self, ingredient_totals, day_adjustments, waste_factor=1.10):
+        """
+        Expected spoilage per perishable, as scheduled vs shelf-life aware,
+        from a deterministic run of simulate_inventory over the calendar.
+        """
+        results = {}
+        for label, coverage in (("As Scheduled", self.base), ("Shelf-Life Aware", self.adjusted)):
+            qty, expected = self.window_quantities(coverage, ingredient_totals,
+                                                   day_adjustments, waste_factor)
+            deliveries = np.zeros((len(self.ingredients), self.num_days))
+            inside = (self.delivery >= 0) & (self.delivery < self.num_days)
+            np.add.at(deliveries.T, self.delivery[inside], qty[inside])
+            results[label] = simulate_inventory(expected[None].astype(np.float32), deliveries,
+                                                self.shelf_life)
+        _, expected = self.window_quantities(self.gap, ingredient_totals, day_adjustments, 1.0)
+        uncovered = (self.gap.sum(axis=0) * expected).sum(axis=1)
+
+        report = pd.DataFrame({
+            "Ingredient": self.ingredients,
+            "Vendor": self.vendors,
+            "Shelf Life (days)": self.shelf_life.astype(int),
+            "Spoilage As Scheduled": results["As Scheduled"]["mean_spoiled"].sum(axis=1).round(1),
+            "Spoilage Shelf-Life Aware": results["Shelf-Life Aware"]["mean_spoiled"].sum(axis=1).round(1),
+            "Uncovered Usage": uncovered.round(1),
+        })
+        active = report[["Spoilage As Scheduled", "Spoilage Shelf-Life Aware",
+                         "Uncovered Usage"]].sum(axis=1) > 0
+        return report[active].sort_values("Spoilage As Scheduled",
+                                          ascending=False).reset_index(drop=True)
+
+
+@st.cache_resource(max_entries=4)
+def get_shelf_life_plan(vendor_schedules, exceptions, start, horizon_days, recipes, vendor_mapping):
+    """Shared plan over get_delivery_calendar's windows — treat as read-only"""
+    calendar = get_delivery_calendar(vendor_schedules, exceptions, start, horizon_days)
+    matrix = get_recipe_matrix(recipes, vendor_mapping)
+    shelf_life = np.array(ingredient_properties_for(
+        matrix.ingredients, matrix.vendors, load_ingredient_properties(),
+        "shelf_life_days", np.inf), dtype=float)
+    return ShelfLifePlan(calendar, matrix.ingredients, matrix.vendors, shelf_life)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SCENARIOS (named what-ifs layered onto the forecast)
+# ─────────────────────────────────────────────────────────────────────────────
+
+SCENARIO_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenarios (
+    name       TEXT PRIMARY KEY,
+    spec       TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+SCENARIO_ITEMS_PER_COVER = 1.5
+
+# Starting points offered by the scenario editor — nothing is saved until edited.
+# Category keys match any Sales Category containing them, case-insensitively.
+SCENARIO_TEMPLATES = {
+    "Game day": {"description": "Home game — busy bar, more shareables",
+                 "days": ["Saturday", "Sunday"], "demand_pct": 25,
+                 "categories": {"bev": 1.4, "beer": 1.5, "liquor": 1.5}},
+    "Rainy weekend": {"description": "Patio closed, fewer walk-ins",
+                      "days": ["Friday", "Saturday", "Sunday"], "demand_pct": -20},
+    "Private event (80 covers)": {"description": "Buyout on top of normal service",
+                                  "days": ["Saturday"], "covers": 80,
+                                  "items_per_cover": SCENARIO_ITEMS_PER_COVER},
+}
+
+
+def normalize_scenario(spec):
+    """Every scenario key filled in; days default to all open days"""
+    return {
+        "name": str(spec.get("name", "")).strip(),
+        "description": str(spec.get("description", "")),
+        "days": [d for d in (spec.get("days") or OPEN_DAYS) if d in OPEN_DAYS],
+        "demand_pct": float(spec.get("demand_pct", 0) or 0),
+        "categories": {str(k): float(v) for k, v in (spec.get("categories") or {}).items()},
+        "items": {str(k): float(v) for k, v in (spec.get("items") or {}).items()},
+        "covers": float(spec.get("covers", 0) or 0),
+        "items_per_cover": float(spec.get("items_per_cover", SCENARIO_ITEMS_PER_COVER) or 0),
+    }
+
+
+class ScenarioStore:
+    """Saved scenarios by name"""
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(SCENARIO_SCHEMA)
+
+    def load(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT name, spec FROM scenarios ORDER BY name").fetchall()
+        return {name: normalize_scenario(json.loads(spec)) for name, spec in rows}
+
+    def save(self, spec):
+        spec = normalize_scenario(spec)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scenarios (name, spec, updated_at) VALUES (?, ?, ?)",
+                (spec["name"], json.dumps(spec), datetime.now().isoformat(timespec="seconds")))
+        return spec
+
+    def delete(self, name):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM scenarios WHERE name = ?", (name,))
+
+
+@st.cache_resource
+def get_scenario_store():
+    return ScenarioStore(DATA_DIR / "highdive.db")
+
+
+class ScenarioEngine:
+    """
+    Average weekly item demand compiled once so many scenarios evaluate together.
+
+    base[i, d] is item i's expected sales on weekday d (weekly average × day
+    weight × slider adjustment). A scenario is a multiplier plus an additive
+    term (extra covers) over that item × day grid. The change in demand for
+    every scenario goes through the recipe matrix in one batched matmul and is
+    added to the ingredient usage the orders already use — comparing five
+    scenarios costs about the same as one.
+    """
+
+    def __init__(self, history, weeks, recipe_matrix, ingredient_totals, day_adjustments):
+        self.items = history.items
+        self.item_index = {str(name).strip().upper(): i for i, name in enumerate(self.items)}
+        qty = history.item_totals()
+        sold = history.sales.sum(axis=1, dtype=np.float64)
+        self.price = np.divide(sold, qty, out=np.zeros_like(sold), where=qty > 0)
+        self.category = np.array([history.categories[c].lower() if c >= 0 else ""
+                                  for c in history.item_category], dtype=object)
+
+        self.day_factor = OrderBuilder.day_factors(day_adjustments)
+        self.open = np.array([day not in CLOSED_DAYS for day in DAY_ORDER])
+        self.base = (qty / max(weeks, 1e-9))[:, None] * self.day_factor
+
+        # Extra covers order the food mix
+        food = np.array(["food" in c for c in self.category]) & (qty > 0)
+        mix = np.where(food, qty, 0.0) if food.any() else qty.astype(float)
+        self.cover_mix = mix / mix.sum() if mix.sum() else mix
+
+        # Sales items with a recipe × the ingredients orders are built from
+        rows = recipe_matrix.item_rows(self.items)
+        self.recipe_items = np.flatnonzero(rows >= 0)
+        self.ingredients = list(ingredient_totals)
+        cols = np.array([recipe_matrix.ingredient_index.get(name, -1) for name in self.ingredients],
+                        dtype=np.int64)
+        self.recipes = recipe_matrix.matrix[rows[self.recipe_items]][:, np.maximum(cols, 0)] * (cols >= 0)
+        self.units = np.array([d["unit"] for d in ingredient_totals.values()], dtype=object)
+        self.vendors = np.array([d["vendor"] for d in ingredient_totals.values()], dtype=object)
+        self.baseline = (np.array([d["qty_used"] for d in ingredient_totals.values()], dtype=float)
+                         [:, None] * self.day_factor)
+
+    def _factors(self, spec):
+        """(multiplier, additive) item × day grids for one scenario"""
+        spec = normalize_scenario(spec)
+        applies = np.array([day in spec["days"] for day in DAY_ORDER]) & self.open
+        item_mult = np.full(len(self.items), 1 + spec["demand_pct"] / 100)
+        for key, mult in spec["categories"].items():
+            item_mult[np.array([key.lower() in c for c in self.category], dtype=bool)] *= mult
+        for name, mult in spec["items"].items():
+            i = self.item_index.get(name.strip().upper())
+            if i is not None:
+                item_mult[i] *= mult
+        multiplier = np.where(applies, item_mult[:, None], 1.0)
+        additive = np.outer(self.cover_mix, applies * spec["covers"] * spec["items_per_cover"])
+        return multiplier, additive
+
+    def demand(self, scenarios):
+        """
+        Items × DAY_ORDER demand per entry. An entry is a scenario spec or a
+        list of specs layered together (multipliers compound, covers add).
+        """
+        out = np.empty((len(scenarios),) + self.base.shape)
+        for s, entry in enumerate(scenarios):
+            multiplier, additive = np.ones_like(self.base), np.zeros_like(self.base)
+            for spec in (entry if isinstance(entry, (list, tuple)) else [entry]):
+                m, a = self._factors(spec)
+                multiplier *= m
+                additive += a
+            out[s] = self.base * multiplier + additive
+        return out
+
+    @traced("scenario.evaluate", measure=lambda r: {"rows": len(r[0])})
+    def evaluate(self, scenarios):
+        """
+        (usage, demand) — usage is entries × ingredients × DAY_ORDER in
+        ingredient_totals order, ready for OrderBuilder(usage=...)
+        """
+        demand = self.demand(scenarios)
+        delta = (demand - self.base)[:, self.recipe_items, :]
+        usage = self.baseline + np.matmul(delta.transpose(0, 2, 1), self.recipes).transpose(0, 2, 1)
+        return np.maximum(usage, 0.0), demand
+
+    def summary(self, names, demand):
+        """Items and revenue per week for each evaluated entry"""
+        items = demand.sum(axis=(1, 2))
+        revenue = np.einsum("sid,i->s", demand, self.price)
+        return pd.DataFrame({"Scenario": names, "Items / week": items.round(0),
+                             "Revenue / week": revenue.round(0),
+                             "vs baseline": (revenue / revenue[0] - 1) if revenue[0] else 0.0})
+
+    def compare(self, names, usage, windows, waste_factor=1.10):
+        """
+        Order quantities per ingredient and entry over vendor windows.
+        windows: (vendor, { date: fraction }) pairs, e.g. DeliveryCalendar.usage_weights
+        """
+        if not windows:
+            return pd.DataFrame(columns=["Vendor", "Ingredient", "Unit"] + list(names))
+        masks = np.array([OrderBuilder.coverage_mask(coverage_weights=weights)
+                          for _, weights in windows])
+        qty = usage @ masks.T * waste_factor                   # entries × ingredients × windows
+        window_vendor = np.array([vendor for vendor, _ in windows], dtype=object)
+        ordered = (qty * (self.vendors[:, None] == window_vendor)).sum(axis=2)
+        table = pd.DataFrame(ordered.T.round(1), columns=list(names))
+        table.insert(0, "Vendor", self.vendors)
+        table.insert(1, "Ingredient", self.ingredients)
+        table.insert(2, "Unit", self.units)
+        table = table[(table[list(names)] > 0).any(axis=1)]
+        return table.sort_values(["Vendor", names[0]], ascending=[True, False],
+                                 ignore_index=True)
+
+
+def scenario_usage(scenarios, ingredient_totals, history, weekly_data, recipes, vendor_mapping,
+                   day_adjustments):
+    """Usage matrix for scenarios layered together (None when there are none)"""
+    if not scenarios:
+        return None
+    engine = ScenarioEngine(history, weeks_loaded(weekly_data),
+                            get_recipe_matrix(recipes, vendor_mapping),
+                            ingredient_totals, day_adjustments)
+    return engine.evaluate([list(scenarios)])[0][0]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# VENDOR PRICE CATALOG (price sheets → cheapest eligible vendor per ingredient)
+# ─────────────────────────────────────────────────────────────────────────────
+
+PRICE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vendor_price_lines (
+    vendor      TEXT NOT NULL,
+    line        INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    ingredient  TEXT,
+    item_code   TEXT,
+    pack_size   REAL,               -- NULL when the sheet doesn't give one: not priced
+    unit        TEXT,
+    pack_price  REAL NOT NULL,
+    source      TEXT,
+    loaded_at   TEXT NOT NULL,
+    PRIMARY KEY (vendor, line)
+);
+CREATE TABLE IF NOT EXISTS vendor_prices (
+    ingredient TEXT NOT NULL,
+    vendor     TEXT NOT NULL,
+    unit_price REAL NOT NULL,
+    unit       TEXT NOT NULL DEFAULT '',  -- g, ml, each, a unit not in UNIT_MEASURES, or ''
+    line       INTEGER NOT NULL,
+    PRIMARY KEY (ingredient, vendor, unit)
+);
+CREATE INDEX IF NOT EXISTS vendor_prices_vendor ON vendor_prices (vendor);
+CREATE TABLE IF NOT EXISTS vendor_terms (
+    vendor        TEXT PRIMARY KEY,
+    order_minimum REAL NOT NULL DEFAULT 0,
+    delivery_fee  REAL NOT NULL DEFAULT 0,
+    free_delivery REAL
+);
+"""
+
+# Price sheet header (lowercase, letters and digits only) → catalog column
+PRICE_SHEET_COLUMNS = {
+    "vendor": "vendor", "supplier": "vendor", "distributor": "vendor",
+    "ingredient": "ingredient",
+    "description": "description", "itemdescription": "description", "item": "description",
+    "product": "description", "productdescription": "description", "itemname": "description",
+    "itemcode": "item_code", "item#": "item_code", "itemno": "item_code", "sku": "item_code",
+    "code": "item_code", "productcode": "item_code",
+    "pack": "pack_size", "packsize": "pack_size", "casepack": "pack_size",
+    "unitspercase": "pack_size", "qtypercase": "pack_size", "caseqty": "pack_size",
+    "unit": "unit", "uom": "unit", "units": "unit",
+    "price": "pack_price", "caseprice": "pack_price", "packprice": "pack_price",
+    "cost": "pack_price", "casecost": "pack_price",
+}
+
+# Units with everything but letters stripped (as STORAGE_UNIT_LITERS) →
+# (dimension, size in the dimension's base unit: grams, milliliters, count).
+# "oz" is weight; fluid ounces need "fl oz".
+UNIT_MEASURES = {
+    "g": ("mass", 1.0), "gram": ("mass", 1.0), "grams": ("mass", 1.0), "kg": ("mass", 1000.0),
+    "oz": ("mass", 28.3495), "ozwt": ("mass", 28.3495), "lb": ("mass", 453.592),
+    "lbs": ("mass", 453.592), "pound": ("mass", 453.592), "pounds": ("mass", 453.592),
+    "ml": ("volume", 1.0), "l": ("volume", 1000.0), "liter": ("volume", 1000.0),
+    "litre": ("volume", 1000.0), "floz": ("volume", 29.5735), "ozfl": ("volume", 29.5735),
+    "tsp": ("volume", 4.92892), "tspn": ("volume", 4.92892), "teaspoon": ("volume", 4.92892),
+    "tbsp": ("volume", 14.7868), "cup": ("volume", 236.588), "pt": ("volume", 473.176),
+    "pint": ("volume", 473.176), "qt": ("volume", 946.353), "quart": ("volume", 946.353),
+    "gal": ("volume", 3785.41), "gallon": ("volume", 3785.41),
+    "each": ("count", 1.0), "ea": ("count", 1.0), "ct": ("count", 1.0), "count": ("count", 1.0),
+    "pc": ("count", 1.0), "pcs": ("count", 1.0), "piece": ("count", 1.0), "dz": ("count", 12.0),
+    "dozen": ("count", 12.0),
+}
+
+
+def _unit_key(unit):
+    return "" if unit is None or pd.isna(unit) else re.sub(r"[^a-z]", "", str(unit).lower())
+
+
+def unit_factor(from_unit, to_unit):
+    """
+    How many to_unit make one from_unit; None when they can't be converted.
+    A blank from_unit is taken to already be to_unit; units not in
+    UNIT_MEASURES only match themselves.
+    """
+    a, b = _unit_key(from_unit), _unit_key(to_unit)
+    if not a or a == b:
+        return 1.0
+    if a in UNIT_MEASURES and b in UNIT_MEASURES and UNIT_MEASURES[a][0] == UNIT_MEASURES[b][0]:
+        return UNIT_MEASURES[a][1] / UNIT_MEASURES[b][1]
+    return None
+
+
+def parse_price_sheet(uploaded_file):
+    """
+    A vendor price sheet (CSV or Excel, first sheet) → catalog lines:
+    description, ingredient, item_code, pack_size, unit, pack_price (+ vendor
+    when the sheet has a vendor column). pack_size is the number of units
+    (the unit column, or recipe units when blank) per pack; lines without a
+    usable pack size are kept but not priced.
+    Raises ValueError when there is no description or price column.
+    """
+    name = getattr(uploaded_file, "name", str(uploaded_file))
+    with telemetry.span("file.price_sheet", bytes=getattr(uploaded_file, "size", 0)) as span:
+        if name.lower().endswith(".csv"):
+            raw = pd.read_csv(uploaded_file, dtype=object)
+        else:
+            raw = pd.read_excel(uploaded_file, dtype=object)
+        columns = {}
+        for col in raw.columns:
+            key = re.sub(r"[^a-z0-9#]", "", str(col).lower())
+            if key in PRICE_SHEET_COLUMNS and PRICE_SHEET_COLUMNS[key] not in columns.values():
+                columns[col] = PRICE_SHEET_COLUMNS[key]
+        sheet = raw[list(columns)].rename(columns=columns)
+        if "description" not in sheet and "ingredient" in sheet:
+            sheet["description"] = sheet["ingredient"]
+        if "description" not in sheet or "pack_price" not in sheet:
+            raise ValueError(f"{name}: needs an item/description column and a price column "
+                             f"(found {', '.join(map(str, raw.columns))})")
+        lines = pd.DataFrame({
+            "description": sheet["description"].astype(str).str.strip(),
+            "ingredient": sheet["ingredient"].astype(object) if "ingredient" in sheet else None,
+            "item_code": sheet["item_code"].astype(object) if "item_code" in sheet else None,
+            "pack_size": (pd.to_numeric(sheet["pack_size"], errors="coerce")
+                          if "pack_size" in sheet else np.nan),
+            "unit": sheet["unit"].astype(object) if "unit" in sheet else None,
+            "pack_price": pd.to_numeric(sheet["pack_price"].astype(str).str.replace(
+                r"[$,\s]", "", regex=True), errors="coerce"),
+        })
+        if "vendor" in sheet:
+            lines.insert(0, "vendor", sheet["vendor"].astype(str).str.strip().str.upper())
+        lines["pack_size"] = lines["pack_size"].where(lines["pack_size"] > 0)
+        lines = lines[lines["description"].ne("") & lines["description"].ne("nan")
+                      & lines["pack_price"].gt(0)].reset_index(drop=True)
+        span.set(rows=len(lines))
+    return lines
+
+
+class VendorCatalog:
+    """
+    Vendor price sheets held in SQLite, indexed by ingredient.
+
+    vendor_price_lines keeps every line of the latest sheet per vendor as
+    uploaded; vendor_prices is the index compiled from it — each line's
+    description resolved to a vendor mapping key, cheapest line per
+    (ingredient, vendor, unit). Prices in known units are indexed per base
+    unit (g, ml, each) so lines in lb and oz compare; price_matrix converts
+    them to each ingredient's recipe unit. Re-resolving (after adding aliases) only rebuilds
+    the index. version changes whenever prices or terms do, so results
+    computed from the catalog can be cached against it.
+    """
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            # Older databases stored missing pack sizes as 1 (pack_size NOT NULL)
+            # and kept one price per (ingredient, vendor) whatever its unit
+            columns = {col[1]: col for col in
+                       self._conn.execute("PRAGMA table_info(vendor_price_lines)")}
+            if columns.get("pack_size", (0,) * 6)[3]:
+                self._conn.executescript(
+                    "ALTER TABLE vendor_price_lines RENAME TO vendor_price_lines_old;"
+                    + PRICE_SCHEMA
+                    + "INSERT INTO vendor_price_lines SELECT * FROM vendor_price_lines_old;"
+                      "DROP TABLE vendor_price_lines_old;")
+            columns = {col[1]: col for col in
+                       self._conn.execute("PRAGMA table_info(vendor_prices)")}
+            if columns and not columns["unit"][5]:
+                self._conn.executescript(
+                    "ALTER TABLE vendor_prices RENAME TO vendor_prices_old;"
+                    "DROP INDEX IF EXISTS vendor_prices_vendor;"
+                    + PRICE_SCHEMA
+                    + "INSERT INTO vendor_prices SELECT ingredient, vendor, unit_price, "
+                      "COALESCE(unit, ''), line FROM vendor_prices_old;"
+                      "DROP TABLE vendor_prices_old;")
+            self._conn.executescript(PRICE_SCHEMA)
+        self._refresh_version()
+
+    def _refresh_version(self):
+        with self._lock:
+            lines = self._conn.execute(
+                "SELECT vendor, COUNT(*), MAX(loaded_at) FROM vendor_price_lines "
+                "GROUP BY vendor ORDER BY vendor").fetchall()
+            index = self._conn.execute(
+                "SELECT COUNT(*), TOTAL(unit_price) FROM vendor_prices").fetchone()
+            terms = self._conn.execute("SELECT * FROM vendor_terms ORDER BY vendor").fetchall()
+        self.version = _content_version([lines, index, terms])
+
+    def ingest(self, vendor, lines, source, resolver):
+        """
+        Replace a vendor's price lines with a parsed sheet and re-index them.
+        Returns (lines stored, lines matched to an ingredient).
+        """
+        vendor = vendor.strip().upper()
+        loaded_at = datetime.now().isoformat(timespec="seconds")
+        rows = [(vendor, i, r.description, None if pd.isna(r.ingredient) else str(r.ingredient),
+                 None if pd.isna(r.item_code) else str(r.item_code),
+                 None if pd.isna(r.pack_size) else float(r.pack_size),
+                 None if pd.isna(r.unit) else str(r.unit), float(r.pack_price), source, loaded_at)
+                for i, r in enumerate(lines.itertuples(index=False))]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM vendor_price_lines WHERE vendor = ?", (vendor,))
+            self._conn.executemany(
+                "INSERT INTO vendor_price_lines (vendor, line, description, ingredient, item_code, "
+                "pack_size, unit, pack_price, source, loaded_at) VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+        matched = self.reindex(resolver, vendor)
+        telemetry.count("price_lines", len(rows), vendor=vendor)
+        return len(rows), matched
+
+    def lines(self, vendor=None):
+        query = ("SELECT vendor, line, description, ingredient, item_code, pack_size, unit, "
+                 "pack_price, source, loaded_at FROM vendor_price_lines")
+        args = ()
+        if vendor is not None:
+            query += " WHERE vendor = ?"
+            args = (vendor,)
+        with self._lock:
+            return pd.read_sql_query(query + " ORDER BY vendor, line", self._conn, params=args)
+
+    def reindex(self, resolver, vendor=None):
+        """Rebuild the ingredient index from stored lines; returns lines matched"""
+        lines = self.lines(vendor)
+        names = lines["ingredient"].where(lines["ingredient"].notna(), lines["description"])
+        lines["key"] = resolver.resolve_many(names).to_numpy()
+        measure = [UNIT_MEASURES.get(_unit_key(u)) for u in lines["unit"]]
+        base = {"mass": "g", "volume": "ml", "count": "each"}
+        lines["unit_price"] = lines["pack_price"] / lines["pack_size"] / [m[1] if m else 1.0
+                                                                         for m in measure]
+        lines["unit"] = [base[m[0]] if m else _unit_key(u) for m, u in zip(measure, lines["unit"])]
+        matched = lines[lines["key"].notna()]
+        best = (matched[matched["unit_price"].notna()].sort_values("unit_price")
+                .drop_duplicates(["key", "vendor", "unit"]))
+        with self._lock, self._conn:
+            if vendor is None:
+                self._conn.execute("DELETE FROM vendor_prices")
+            else:
+                self._conn.execute("DELETE FROM vendor_prices WHERE vendor = ?", (vendor,))
+            self._conn.executemany(
+                "INSERT INTO vendor_prices (ingredient, vendor, unit_price, unit, line) "
+                "VALUES (?, ?, ?, ?, ?)",
+                best[["key", "vendor", "unit_price", "unit", "line"]].itertuples(index=False))
+        self._refresh_version()
+        return len(matched)
+
+    def prices(self):
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT ingredient, vendor, unit_price, unit FROM vendor_prices", self._conn)
+
+    def price_matrix(self, keys, units):
+        """
+        (vendors, ingredients × vendors unit prices) for mapping keys in the
+        given order, per unit in units (each ingredient's recipe unit) — NaN
+        where a vendor has no price, the key is None or the sheet's unit
+        can't be converted to the recipe unit
+        """
+        prices = self.prices()
+        vendors = sorted(prices["vendor"].unique())
+        matrix = np.full((len(keys), len(vendors)), np.nan)
+        if len(prices):
+            # Every (ingredient row, price) pair — keys shared by several
+            # ingredients price each of them in its own unit
+            wanted = pd.DataFrame({"ingredient": pd.Series(keys, dtype=object),
+                                   "row": np.arange(len(keys)),
+                                   "recipe_unit": pd.Series(list(units), dtype=object)})
+            pairs = wanted.dropna(subset=["ingredient"]).merge(prices, on="ingredient")
+            factor = np.array([unit_factor(u, r) or np.nan
+                               for u, r in zip(pairs["unit"], pairs["recipe_unit"])], dtype=float)
+            pairs["price"] = pairs["unit_price"].to_numpy() / factor
+            best = pairs.dropna(subset=["price"]).groupby(["row", "vendor"])["price"].min()
+            cols = {v: j for j, v in enumerate(vendors)}
+            matrix[best.index.get_level_values(0).to_numpy(int),
+                   [cols[v] for v in best.index.get_level_values(1)]] = best.to_numpy()
+        return vendors, matrix
+
+    def unit_costs(self, ingredients, resolver, units):
+        """{ ingredient: lowest price per recipe unit any vendor offers } for priced ingredients"""
+        vendors, matrix = self.price_matrix(resolver.resolve_many(list(ingredients)).to_numpy(object),
+                                            units)
+        if not vendors:
+            return {}
+        priced = ~np.isnan(matrix).all(axis=1)
+        lowest = np.nanmin(np.where(priced[:, None], matrix, 0.0), axis=1)
+        return {name: float(c) for name, c, p in zip(ingredients, lowest, priced) if p}
+
+    def terms(self):
+        """{ vendor: {order_minimum, delivery_fee, free_delivery} }"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT vendor, order_minimum, delivery_fee, free_delivery FROM vendor_terms"
+            ).fetchall()
+        return {v: {"order_minimum": m, "delivery_fee": f, "free_delivery": free}
+                for v, m, f, free in rows}
+
+    def set_terms(self, vendor, order_minimum=0.0, delivery_fee=0.0, free_delivery=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vendor_terms (vendor, order_minimum, delivery_fee, "
+                "free_delivery) VALUES (?, ?, ?, ?)",
+                (vendor.strip().upper(), float(order_minimum or 0), float(delivery_fee or 0),
+                 None if free_delivery is None or pd.isna(free_delivery) else float(free_delivery)))
+        self._refresh_version()
+
+    def summary(self):
+        lines = self.lines()
+        if lines.empty:
+            return pd.DataFrame(columns=["Vendor", "Lines", "Ingredients priced", "Loaded"])
+        priced = self.prices().groupby("vendor")["ingredient"].nunique()
+        by_vendor = lines.groupby("vendor").agg(Lines=("line", "size"), Loaded=("loaded_at", "max"))
+        by_vendor["Ingredients priced"] = priced.reindex(by_vendor.index).fillna(0).astype(int)
+        return (by_vendor.reset_index().rename(columns={"vendor": "Vendor"})
+                [["Vendor", "Lines", "Ingredients priced", "Loaded"]])
+
+
+@st.cache_resource
+def get_vendor_catalog():
+    return VendorCatalog(DATA_DIR / "highdive.db")
+
+
+def vendor_delivery_gaps(vendor_schedules):
+    """{ vendor: longest stretch in days between two of its weekly deliveries }"""
+    gaps = {}
+    for vendor, data in vendor_schedules.items():
+        days = sorted({DAY_ORDER.index(o["delivery_day"]) for o in data.get("orders", [])
+                       if o.get("delivery_day") in DAY_ORDER})
+        if days:
+            gaps[vendor] = max((b - a) % 7 or 7 for a, b in zip(days, days[1:] + days[:1]))
+    return gaps
+
+
+@traced("vendors.assign", measure=lambda r: {"rows": len(r["table"])})
+def assign_cheapest_vendors(ingredient_totals, catalog, vendor_mapping, vendor_schedules,
+                            properties=None):
+    """
+    Cheapest eligible vendor for every ingredient, solved as one assignment.
+
+    cost[i, v] is ingredient i's weekly usage × vendor v's unit price. A
+    vendor is eligible for an ingredient when it prices it, has delivery
+    windows, and (for perishables) never goes longer between deliveries
+    than the ingredient keeps. Every ingredient takes its cheapest open
+    vendor (an argmin over the whole matrix); vendors whose spend per
+    delivery can't reach their order minimum are closed and their
+    ingredients re-assigned, then vendors are closed while that lowers
+    goods + delivery fees. Ingredients nobody prices keep their mapped vendor.
+
+    Returns {"vendors": {ingredient: vendor}, "table": DataFrame, "weekly_cost",
+             "weekly_savings", "fees": {vendor: weekly fee}}
+    """
+    names = list(ingredient_totals)
+    mapped = np.array([d["vendor"] for d in ingredient_totals.values()], dtype=object)
+    weekly = np.array([d["qty_used"] for d in ingredient_totals.values()], dtype=float)
+    keys = get_vendor_resolver(vendor_mapping).resolve_many(names).to_numpy(object)
+    vendors, prices = catalog.price_matrix(keys, [d["unit"] for d in ingredient_totals.values()])
+    terms = catalog.terms()
+    properties = properties if properties is not None else load_ingredient_properties()
+
+    # Eligibility: priced, delivered, and delivered often enough to stay fresh
+    gaps = vendor_delivery_gaps(vendor_schedules)
+    deliveries = np.array([len(vendor_schedules.get(v, {}).get("orders", [])) for v in vendors])
+    eligible = ~np.isnan(prices) & (deliveries > 0)
+    for j, v in enumerate(vendors):
+        shelf = np.array(ingredient_properties_for(names, [v] * len(names), properties,
+                                                   "shelf_life_days", np.inf), dtype=float)
+        eligible[:, j] &= shelf >= gaps.get(v, np.inf)
+    cost = np.where(eligible, prices * weekly[:, None], np.inf)
+
+    minimum = np.array([terms.get(v, {}).get("order_minimum", 0) or 0 for v in vendors], dtype=float)
+    fee = np.array([terms.get(v, {}).get("delivery_fee", 0) or 0 for v in vendors], dtype=float)
+    free = np.array([terms.get(v, {}).get("free_delivery") or np.inf for v in vendors], dtype=float)
+    per_week = np.maximum(deliveries, 1)
+
+    def solve(is_open):
+        masked = np.where(is_open, cost, np.inf)
+        choice = masked.argmin(axis=1) if len(vendors) else np.zeros(len(names), dtype=int)
+        best = masked[np.arange(len(names)), choice] if len(vendors) else np.full(len(names), np.inf)
+        priced = np.isfinite(best)
+        spend = np.bincount(choice[priced], best[priced], minlength=len(vendors))
+        per_delivery = spend / per_week
+        fees = np.where((spend > 0) & (per_delivery < free), fee * per_week, 0.0)
+        below = (spend > 0) & (per_delivery < minimum)
+        return choice, priced, spend, fees, below, spend.sum() + fees.sum()
+
+    is_open = np.ones(len(vendors), dtype=bool)
+    choice, priced, spend, fees, below, total = solve(is_open)
+    any_priced = priced.copy()
+    # Close vendors that can't reach their minimum, smallest first
+    while below.any():
+        j = np.flatnonzero(below)[spend[below].argmin()]
+        is_open[j] = False
+        choice, priced, spend, fees, below, total = solve(is_open)
+    # Close vendors while that lowers goods + fees and prices every ingredient it can
+    improved = True
+    while improved:
+        improved = False
+        for j in np.flatnonzero(is_open & (spend > 0)):
+            trial = is_open.copy()
+            trial[j] = False
+            result = solve(trial)
+            if not result[4].any() and result[5] < total - 1e-9 and result[1].sum() == priced.sum():
+                is_open = trial
+                choice, priced, spend, fees, below, total = result
+                improved = True
+                break
+
+    chosen = mapped.copy()
+    vendor_arr = np.array(vendors, dtype=object)
+    chosen[priced] = vendor_arr[choice[priced]] if len(vendors) else chosen[priced]
+    col_of = {v: j for j, v in enumerate(vendors)}
+    mapped_price = np.array([prices[i, col_of[v]] if v in col_of else np.nan
+                             for i, v in enumerate(mapped)])
+    chosen_price = np.where(priced, prices[np.arange(len(names)), choice] if len(vendors)
+                            else np.nan, mapped_price)
+    table = pd.DataFrame({
+        "Ingredient": names,
+        "Unit": [d["unit"] for d in ingredient_totals.values()],
+        "Weekly Qty": weekly.round(2),
+        "Mapped Vendor": mapped,
+        "Mapped Price": mapped_price,
+        "Vendor": chosen,
+        "Unit Price": chosen_price,
+        "Weekly Cost": (weekly * chosen_price).round(2),
+        "Weekly Savings": (weekly * (mapped_price - chosen_price)).round(2),
+        "Status": np.where(priced, "cheapest eligible",
+                           np.where(any_priced, "no open vendor", "no prices")),
+    })
+    return {
+        "vendors": dict(zip(names, chosen)),
+        "table": table,
+        "weekly_cost": float(total),
+        "weekly_savings": float(np.nansum(table["Weekly Savings"])),
+        "fees": {v: float(f) for v, f in zip(vendors, fees) if f},
+    }
+
+
+def cheapest_vendor_assignment(ingredient_totals, vendor_mapping, vendor_schedules):
+    """assign_cheapest_vendors, cached until prices, terms or usage change"""
+    catalog = get_vendor_catalog()
+    key = "/".join([data_location(), "vendor_assignment", _content_version(
+        [catalog.version, ingredient_totals, vendor_schedules,
+         get_vendor_resolver(vendor_mapping).aliases, load_ingredient_properties()])])
+    return get_shared_cache().memo(key, lambda: assign_cheapest_vendors(
+        ingredient_totals, catalog, vendor_mapping, vendor_schedules))
+
+
+def with_vendors(ingredient_totals, vendors):
+    """ingredient_totals with each ingredient's vendor replaced from { ingredient: vendor }"""
+    return {name: dict(data, vendor=vendors.get(name, data["vendor"]))
+            for name, data in ingredient_totals.items()}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# ORDER MINIMUMS (shifting quantity between a vendor's adjacent windows)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def balance_vendor_windows(qty, prices, shelf_life, delivery, coverage_end, minimum,
+                           locked=None, headroom=None):
+    """
+    Lift a vendor's below-minimum orders by moving quantity between its
+    adjacent windows. Quantity only ever moves to an earlier delivery, so
+    nothing arrives late:
+
+      pull  — part of window k+1's order comes in on k instead; lines that
+              keep longest go first, and only lines still fresh at the end
+              of k+1's coverage can move
+      merge — when pulling can't reach the minimum, window k's whole order
+              joins k-1 (if every line keeps that long) and k is skipped
+
+    qty: windows × ingredients, windows in delivery order
+    prices: unit price per ingredient (NaN = unpriced, worth $0 here)
+    delivery, coverage_end: day offsets of each delivery and its last covered day
+    locked: windows already placed — they neither take nor give quantity now.
+        What they took when they were placed is replayed (balancing as if
+        nothing were locked) and stays out of the later windows it came from,
+        so stock pulled forward isn't bought twice
+    headroom: optional windows × ingredients extra units each delivery can hold
+    Returns (qty, moves [(from k, to k, ingredient column, units)], status per window)
+    """
+    qty = np.array(qty, dtype=float)
+    num_windows, n = qty.shape
+    price = np.nan_to_num(np.asarray(prices, dtype=float))
+    shelf = np.asarray(shelf_life, dtype=float)
+    locked = np.zeros(num_windows, dtype=bool) if locked is None else np.asarray(locked, dtype=bool)
+    room = np.full((num_windows, n), np.inf) if headroom is None else np.array(headroom, dtype=float)
+    status = ["ok"] * num_windows
+    moves = []
+
+    if locked.any():
+        placed, placed_moves, _ = balance_vendor_windows(qty, prices, shelf_life, delivery,
+                                                         coverage_end, minimum, None, headroom)
+        for src, dst, j, units in placed_moves:
+            if locked[dst] and not locked[src]:
+                qty[src, j] = max(qty[src, j] - units, 0.0)
+                moves.append((src, dst, j, units))
+        qty[locked] = placed[locked]
+
+    for k in range(num_windows):
+        value = float(qty[k] @ price)
+        if value <= 0 or value >= minimum:
+            continue
+        if locked[k]:
+            status[k] = "below minimum (already placed)"
+            continue
+        need = minimum - value
+
+        if k + 1 < num_windows and not locked[k + 1]:
+            keeps = shelf > coverage_end[k + 1] - delivery[k]
+            lines = np.flatnonzero(keeps & (qty[k + 1] > 0) & (price > 0) & (room[k] > 0))
+            lines = lines[np.argsort(-shelf[lines], kind="stable")]
+            units = np.minimum(qty[k + 1, lines], room[k, lines])
+            worth = units * price[lines]
+            if worth.sum() >= need:
+                before = np.concatenate([[0.0], np.cumsum(worth)[:-1]])
+                take = np.clip((need - before) / price[lines], 0, units)
+                moved = take > 0
+                qty[k, lines] += take
+                qty[k + 1, lines] -= take
+                room[k, lines] -= take
+                moves.extend((k + 1, k, int(j), float(u))
+                             for j, u in zip(lines[moved], take[moved]))
+                status[k] = "raised to minimum"
+                continue
+
+        if k > 0 and not locked[k - 1]:
+            lines = np.flatnonzero(qty[k] > 0)
+            if ((shelf[lines] > coverage_end[k] - delivery[k - 1]).all()
+                    and (room[k - 1, lines] >= qty[k, lines]).all()):
+                qty[k - 1, lines] += qty[k, lines]
+                room[k - 1, lines] -= qty[k, lines]
+                moves.extend((k, k - 1, int(j), float(qty[k, j])) for j in lines)
+                qty[k, lines] = 0
+                status[k] = "merged into previous order"
+                if status[k - 1] == "ok":
+                    status[k - 1] = "absorbed next order"
+                continue
+        status[k] = "below minimum"
+    return qty, moves, status
+
+
+@traced("order.balance", measure=lambda r: {"rows": len(r[1])})
+def balance_order_minimums(builder, calendar, windows, catalog, vendor_mapping,
+                           shelf_life_plan=None, properties=None, headroom=None, today=None):
+    """
+    Orders for calendar windows, each vendor's balanced to its order minimum.
+
+    windows: DeliveryCalendar windows, any vendors — each vendor's are
+        balanced among themselves in delivery order
+    headroom: optional callable (vendor, vendor windows, ingredient names) →
+        windows × ingredients units each delivery can still hold
+    today: windows ordered before this date count as placed (locked)
+    Returns (orders, moves): orders[k] = {"order_df", "rows", "qty", "value",
+        "minimum", "status"} for windows[k] (qty per builder row in rows);
+        moves is a DataFrame of the quantities shifted
+    """
+    properties = properties if properties is not None else load_ingredient_properties()
+    terms = catalog.terms()
+    resolver = get_vendor_resolver(vendor_mapping)
+    orders = [None] * len(windows)
+    move_rows = []
+
+    by_vendor = {}
+    for k, w in enumerate(windows):
+        by_vendor.setdefault(w["vendor"], []).append(k)
+    for vendor, ks in by_vendor.items():
+        ks = sorted(ks, key=lambda k: (windows[k]["delivery_date"], windows[k]["order_date"]))
+        vendor_windows = [windows[k] for k in ks]
+        rows = builder.vendor_rows(vendor)
+        names = list(builder.ingredients[rows])
+        weights = [calendar.usage_weights(w) for w in vendor_windows]
+        qty = np.array([builder.window_quantities(
+            rows, w["order"]["covers"], weights[i],
+            shelf_life_plan.window_coverage(w) if shelf_life_plan else None)
+            for i, w in enumerate(vendor_windows)]).reshape(len(ks), len(rows))
+
+        vendors, matrix = catalog.price_matrix(resolver.resolve_many(names).to_numpy(object),
+                                               builder.units[rows])
+        prices = (matrix[:, vendors.index(vendor)] if vendor in vendors
+                  else np.full(len(rows), np.nan))
+        minimum = (terms.get(vendor) or {}).get("order_minimum") or 0
+        if minimum > 0 and len(rows):
+            origin = min(w["delivery_date"] for w in vendor_windows)
+            delivery = np.array([(w["delivery_date"] - origin).days for w in vendor_windows])
+            coverage_end = np.array([(max(wt, default=w["delivery_date"]) - origin).days
+                                     for w, wt in zip(vendor_windows, weights)])
+            shelf = np.array(ingredient_properties_for(names, [vendor] * len(names), properties,
+                                                       "shelf_life_days", np.inf), dtype=float)
+            locked = (np.array([w["order_date"] < today for w in vendor_windows])
+                      if today is not None else None)
+            room = headroom(vendor, vendor_windows, names) if headroom else None
+            qty, moves, status = balance_vendor_windows(qty, prices, shelf, delivery, coverage_end,
+                                                        minimum, locked, room)
+            for src, dst, j, units in moves:
+                move_rows.append({
+                    "Vendor": vendor,
+                    "From": f"{vendor_windows[src]['order_date']:%a %m/%d}",
+                    "To": f"{vendor_windows[dst]['order_date']:%a %m/%d}",
+                    "Ingredient": names[j], "Unit": builder.units[rows[j]],
+                    "Qty": round(units, 1),
+                })
+        else:
+            status = ["ok"] * len(ks)
+        for i, k in enumerate(ks):
+            orders[k] = {
+                "order_df": builder.frame(rows, qty[i]) if len(rows) else pd.DataFrame(),
+                "rows": rows,
+                "qty": qty[i],
+                "value": float(qty[i] @ np.nan_to_num(prices)),
+                "minimum": minimum,
+                "status": status[i],
+            }
+    return orders, pd.DataFrame(move_rows, columns=["Vendor", "From", "To", "Ingredient",
+                                                    "Unit", "Qty"])
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# STORAGE CAPACITY (walk-in, freezer and dry storage space per location)
+# ─────────────────────────────────────────────────────────────────────────────
+
+STORAGE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS storage_areas (
+    location        TEXT NOT NULL,
+    area            TEXT NOT NULL,
+    name            TEXT NOT NULL,
+    capacity_liters REAL NOT NULL,
+    PRIMARY KEY (location, area)
+);
+"""
+
+# Areas offered in Settings until a location saves its own. They carry no
+# capacity: storage is only projected and enforced once a location sets one
+STORAGE_AREA_TEMPLATE = {
+    "walk_in": "Walk-in cooler",
+    "freezer": "Freezer",
+    "dry":     "Dry storage",
+}
+DEFAULT_STORAGE_CLASS = "dry"
+
+# Rough shelf volume (liters) of one recipe unit, packaging included, by unit
+# with everything but letters stripped ("oz - wt" → "ozwt"). An ingredient's
+# "unit_liters" in ingredient_properties.json overrides it.
+STORAGE_UNIT_LITERS = {
+    "oz": 0.035, "ozwt": 0.035, "floz": 0.035, "ozfl": 0.035, "lb": 0.55,
+    "g": 0.0012, "gram": 0.0012, "grams": 0.0012, "kg": 1.2,
+    "tsp": 0.006, "tspn": 0.006, "teaspoon": 0.006, "tbsp": 0.018, "cup": 0.28,
+    "qt": 1.1, "quart": 1.1, "gal": 4.4, "gallon": 4.4, "l": 1.1, "ml": 0.0011,
+    "each": 0.25, "ea": 0.25, "pc": 0.25, "slice": 0.04, "sheet": 0.01, "leaf": 0.005,
+    "spritz": 0.001, "pinch": 0.0005,
+}
+DEFAULT_UNIT_LITERS = 0.1
+
+
+class StorageAreaStore:
+    """Storage areas and their capacity per location, in SQLite"""
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(STORAGE_SCHEMA)
+
+    def areas(self, location=None):
+        """{ area: {name, capacity_liters} } the location has configured — {} when none"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT area, name, capacity_liters FROM storage_areas "
+                "WHERE location = ? AND capacity_liters > 0 "
+                "ORDER BY area", (location or data_location(),)).fetchall()
+        return {a: {"name": name, "capacity_liters": cap} for a, name, cap in rows}
+
+    def set_area(self, area, name, capacity_liters, location=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO storage_areas (location, area, name, capacity_liters) "
+                "VALUES (?, ?, ?, ?)",
+                (location or data_location(), area.strip().lower().replace(" ", "_"),
+                 name.strip() or area, float(capacity_liters or 0)))
+
+
+@st.cache_resource
+def get_storage_areas():
+    return StorageAreaStore(DATA_DIR / "highdive.db")
+
+
+def ingredient_storage(ingredients, vendors, units, properties):
+    """(storage class, liters per unit) for each ingredient"""
+    classes = ingredient_properties_for(ingredients, vendors, properties, "storage",
+                                        DEFAULT_STORAGE_CLASS)
+    liters = ingredient_properties_for(ingredients, vendors, properties, "unit_liters")
+    liters = [l if l is not None else
+              STORAGE_UNIT_LITERS.get(re.sub(r"[^a-z]", "", str(u).lower()), DEFAULT_UNIT_LITERS)
+              for l, u in zip(liters, units)]
+    return classes, np.array(liters, dtype=float)
+
+
+class StoragePlan:
+    """
+    Projected shelf space used by every vendor's deliveries, day by day.
+
+    One pass steps all ingredients through the calendar at once: stock
+    arrives with its vendor's deliveries and is drawn down by each day's
+    usage. An area's use on a day is the liters on its shelves right after
+    that day's deliveries land, before service draws them down — the daily
+    peak. With fit=True the same pass also trims overflowing deliveries:
+    stock that would still be on the shelf when the vendor next delivers
+    moves to that delivery instead, largest volumes first, so nothing runs
+    short.
+
+    qty: windows × builder rows order quantities for windows (all vendors)
+    locked: windows already placed — their quantities never change
+    report_from: first day reported (earlier days only build up stock)
+    """
+
+    def __init__(self, builder, calendar, windows, qty, areas, properties=None,
+                 locked=None, report_from=None, fit=False):
+        properties = properties if properties is not None else load_ingredient_properties()
+        self.builder, self.windows = builder, windows
+        self.areas = {a: d for a, d in areas.items() if d.get("capacity_liters", 0) > 0}
+        self.days = [calendar.start + timedelta(days=i)
+                     for i in range((calendar.end - calendar.start).days)]
+        self.report_from = max(0, (report_from - calendar.start).days) if report_from else 0
+        vendors = np.array(list(builder.vendor_codes), dtype=object)[builder.vendor_idx]
+        classes, self.liters = ingredient_storage(builder.ingredients, vendors,
+                                                  builder.units, properties)
+        area_keys = list(self.areas)
+        self.area_idx = np.array([area_keys.index(c) if c in self.areas else -1 for c in classes])
+        self.capacity = np.array([self.areas[a]["capacity_liters"] for a in area_keys])
+
+        open_days = np.array([calendar.is_open(d) for d in self.days])
+        weekday = np.array([d.weekday() for d in self.days])
+        self.consumption = builder.usage[:, weekday] * open_days * builder.waste_factor
+
+        self.qty = np.array(qty, dtype=float).reshape(len(windows), len(builder.ingredients))
+        self.locked = (np.zeros(len(windows), dtype=bool) if locked is None
+                       else np.asarray(locked, dtype=bool))
+        self.day_of = np.array([(w["delivery_date"] - calendar.start).days for w in windows])
+        # Each window's next delivery from the same vendor, -1 for the last
+        self.next_window = np.full(len(windows), -1)
+        by_vendor = {}
+        for k in sorted(range(len(windows)), key=lambda k: self.day_of[k]):
+            previous = by_vendor.get(windows[k]["vendor"])
+            if previous is not None:
+                self.next_window[previous] = k
+            by_vendor[windows[k]["vendor"]] = k
+        self.moves = []
+        self.used, self.peak_stock = self._run(fit)
+
+    def _area_liters(self, stock):
+        """Liters per area for an ingredients (× days) stock array"""
+        volume = stock * (self.liters if stock.ndim == 1 else self.liters[:, None])
+        hit = self.area_idx >= 0
+        out = np.zeros((len(self.capacity),) + stock.shape[1:])
+        np.add.at(out, self.area_idx[hit], volume[hit])
+        return out
+
+    def _run(self, fit):
+        n, num_days = self.consumption.shape
+        in_range = (self.day_of >= 0) & (self.day_of < num_days)
+        deliveries = np.zeros((num_days, n))
+        np.add.at(deliveries, self.day_of[in_range], self.qty[in_range])
+        remaining = np.cumsum(self.consumption[:, ::-1], axis=1)[:, ::-1]  # usage from day t on
+        level = np.zeros(n)
+        peak_stock = np.zeros((n, num_days))
+        for t in range(num_days):
+            stock = level + deliveries[t]
+            if fit and t >= self.report_from:
+                over = self._area_liters(stock) - self.capacity
+                if (over > 1e-9).any():
+                    stock = self._defer(t, stock, over, deliveries, remaining)
+            peak_stock[:, t] = stock
+            level = np.maximum(stock - self.consumption[:, t], 0.0)
+        return self._area_liters(peak_stock), peak_stock
+
+    def _defer(self, t, stock, over, deliveries, remaining):
+        """Move overflow on day t to each vendor's next delivery; returns the new stock"""
+        for k in np.flatnonzero((self.day_of == t) & ~self.locked):
+            later = self.next_window[k]
+            if later < 0 or self.locked[later]:
+                continue
+            gap_end = self.day_of[later]
+            # Stock of each line still on hand when the next delivery arrives
+            left = stock - (remaining[:, t] - (remaining[:, gap_end] if gap_end < len(self.days)
+                                               else 0.0))
+            spare = np.minimum(left, self.qty[k])
+            spare[spare < 0.05] = 0.0  # below order rounding — not worth a line
+            for a in np.flatnonzero(over > 1e-9):
+                lines = np.flatnonzero((self.area_idx == a) & (spare > 0))
+                lines = lines[np.argsort(-(spare[lines] * self.liters[lines]), kind="stable")]
+                for j in lines:
+                    if over[a] <= 1e-9:
+                        break
+                    units = min(spare[j], over[a] / self.liters[j])
+                    self.qty[k, j] -= units
+                    self.qty[later, j] += units
+                    deliveries[t, j] -= units
+                    if gap_end < len(self.days):
+                        deliveries[gap_end, j] += units
+                    stock[j] -= units
+                    spare[j] -= units
+                    over[a] -= units * self.liters[j]
+                    self.moves.append((k, later, j, units))
+        return stock
+
+    @property
+    def utilization(self):
+        """Area × day share of capacity used at the daily peak, from report_from"""
+        return pd.DataFrame(self.used[:, self.report_from:] / self.capacity[:, None],
+                            index=[d["name"] for d in self.areas.values()],
+                            columns=[f"{d:%a %m/%d}" for d in self.days[self.report_from:]])
+
+    def headroom(self, vendor, vendor_windows, names):
+        """
+        windows × ingredients units each delivery could add before its area
+        is full — the headroom hook of balance_order_minimums
+        """
+        rows = np.array([self.builder.row_of[name] for name in names], dtype=int)
+        free = np.clip(self.capacity[:, None] - self.used, 0.0, None)
+        out = np.full((len(vendor_windows), len(rows)), np.inf)
+        area = self.area_idx[rows]
+        stored = area >= 0
+        starts = [(w["delivery_date"] - self.days[0]).days for w in vendor_windows]
+        for i, t in enumerate(starts):
+            # Pulled-forward stock sits on the shelf until the next delivery lands
+            end = starts[i + 1] if i + 1 < len(starts) else t + 1
+            if 0 <= t < len(self.days):
+                out[i, stored] = (free[area[stored], t:max(end, t + 1)].min(axis=1)
+                                  / self.liters[rows[stored]])
+        return out
+
+    def bottlenecks(self, top=3):
+        """Each area's peak day, use against capacity and the lines taking the most space"""
+        rows = []
+        for a, (key, area) in enumerate(self.areas.items()):
+            used = self.used[a, self.report_from:]
+            if not len(used):
+                continue
+            t = self.report_from + int(np.argmax(used))
+            in_area = np.flatnonzero(self.area_idx == a)
+            volume = self.peak_stock[in_area, t] * self.liters[in_area]
+            largest = in_area[np.argsort(-volume)[:top]]
+            rows.append({
+                "Area": area["name"],
+                "Peak Day": f"{self.days[t]:%a %m/%d}",
+                "Peak (L)": round(float(used.max()), 1),
+                "Capacity (L)": round(float(self.capacity[a]), 1),
+                "Peak %": round(100 * float(used.max()) / self.capacity[a], 1),
+                "Days Over": int((used > self.capacity[a] + 1e-6).sum()),
+                "Largest Lines": ", ".join(
+                    f"{self.builder.ingredients[j]} ({self.peak_stock[j, t] * self.liters[j]:.0f} L)"
+                    for j in largest if self.peak_stock[j, t] > 0),
+            })
+        return pd.DataFrame(rows).sort_values("Peak %", ascending=False, ignore_index=True) \
+            if rows else pd.DataFrame(rows)
+
+    def moves_frame(self):
+        """Deferred quantities as rows — vendor, from, to, ingredient, unit, qty, liters"""
+        return pd.DataFrame([{
+            "Vendor": self.windows[k]["vendor"],
+            "From": f"{self.windows[k]['order_date']:%a %m/%d}",
+            "To": f"{self.windows[later]['order_date']:%a %m/%d}",
+            "Ingredient": self.builder.ingredients[j], "Unit": self.builder.units[j],
+            "Qty": round(units, 1), "Liters": round(units * self.liters[j], 1),
+        } for k, later, j, units in self.moves],
+            columns=["Vendor", "From", "To", "Ingredient", "Unit", "Qty", "Liters"])
+
+
+@traced("order.plan", measure=lambda r: {"windows": len(r["orders"])})
+def plan_orders(builder, calendar, windows, shelf_life_plan=None, catalog=None,
+                vendor_mapping=None, storage_areas=None, fit_storage=False, today=None,
+                properties=None):
+    """
+    Order quantities for windows of every vendor, planned together.
+
+    catalog: balance each vendor's windows to its order minimum
+    storage_areas: project daily storage peaks (StoragePlan); fit_storage also
+        trims overflowing deliveries and keeps minimum balancing within the
+        space left
+    today: windows ordered before this date are placed and left as they are
+    Returns {"orders": {(vendor, order date, delivery date): order_df},
+             "balance": {same key: balance_order_minimums result},
+             "moves": DataFrame of shifted quantities, "storage": StoragePlan or None}
+    """
+    properties = properties if properties is not None else load_ingredient_properties()
+    locked = np.array([today is not None and w["order_date"] < today for w in windows], dtype=bool)
+    qty = np.zeros((len(windows), len(builder.ingredients)))
+    for k, w in enumerate(windows):
+        rows = builder.vendor_rows(w["vendor"])
+        qty[k, rows] = builder.window_quantities(
+            rows, w["order"]["covers"], calendar.usage_weights(w),
+            shelf_life_plan.window_coverage(w) if shelf_life_plan else None)
+
+    keys = [(w["vendor"], w["order_date"], w["delivery_date"]) for w in windows]
+    balance, moves = {}, []
+    if catalog is not None:
+        headroom = (StoragePlan(builder, calendar, windows, qty, storage_areas, properties,
+                                locked, today).headroom
+                    if storage_areas and fit_storage else None)
+        results, balance_moves = balance_order_minimums(
+            builder, calendar, windows, catalog, vendor_mapping, shelf_life_plan, properties,
+            headroom, today)
+        for k, r in enumerate(results):
+            qty[k] = 0.0
+            qty[k, r["rows"]] = r["qty"]
+        balance = dict(zip(keys, results))
+        moves.append(balance_moves.assign(Reason="order minimum"))
+
+    storage = None
+    if storage_areas:
+        storage = StoragePlan(builder, calendar, windows, qty, storage_areas, properties,
+                              locked, today, fit=fit_storage)
+        qty = storage.qty
+        moves.append(storage.moves_frame().drop(columns="Liters").assign(Reason="storage space"))
+
+    orders = {}
+    for k, (key, w) in enumerate(zip(keys, windows)):
+        rows = builder.vendor_rows(w["vendor"])
+        orders[key] = builder.frame(rows, qty[k, rows]) if len(rows) else pd.DataFrame()
+    moves = [m for m in moves if not m.empty]
+    return {"orders": orders, "balance": balance, "storage": storage,
+            "moves": (pd.concat(moves, ignore_index=True) if moves else
+                      pd.DataFrame(columns=["Vendor", "From", "To", "Ingredient", "Unit", "Qty",
+                                            "Reason"]))}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# PDF ORDER SHEETS (reportlab)
+# ─────────────────────────────────────────────────────────────────────────────
+
+@functools.lru_cache(maxsize=1)
+def _pdf_toolkit():
+    """
+    Import reportlab once and build the shared styles, table styles and page
+    decorations. Every PDF reuses these, so a batch only pays for layout.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import (BaseDocTemplate, Frame, PageTemplate, Paragraph,
+                                    Table, TableStyle, Spacer, PageBreak, KeepTogether)
+
+    base = getSampleStyleSheet()
+    styles = {
+        "title": ParagraphStyle("HDTitle", parent=base["Title"], fontName="Helvetica-Bold",
+                                fontSize=18, leading=22, alignment=0, spaceAfter=2),
+        "meta": ParagraphStyle("HDMeta", parent=base["Normal"], fontName="Helvetica",
+                               fontSize=9.5, leading=13, textColor=colors.HexColor("#475569")),
+        "cell": ParagraphStyle("HDCell", parent=base["Normal"], fontName="Helvetica",
+                               fontSize=9.5, leading=11),
+    }
+
+    def table_style(accent):
+        return TableStyle([
+            ("FONT", (0, 0), (-1, 0), "Helvetica-Bold", 9.5),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor(accent)),
+            ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+            ("FONT", (0, 1), (-1, -1), "Helvetica", 9.5),
+            ("ALIGN", (1, 0), (-1, -1), "CENTER"),
+            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f1f5f9")]),
+            ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.HexColor("#cbd5e1")),
+            ("GRID", (-1, 1), (-1, -1), 0.5, colors.HexColor("#64748b")),
+            ("TOPPADDING", (0, 0), (-1, -1), 4),
+            ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
+        ])
+
+    def decorate(canvas, doc):
+        canvas.saveState()
+        canvas.setFont("Helvetica", 8)
+        canvas.setFillColor(colors.HexColor("#94a3b8"))
+        canvas.drawString(0.6 * inch, 0.45 * inch,
+                          f"High Dive Order Management · generated {doc.generated}")
+        canvas.drawRightString(letter[0] - 0.6 * inch, 0.45 * inch, f"Page {doc.page}")
+        canvas.restoreState()
+
+    def new_doc(buffer, title):
+        doc = BaseDocTemplate(buffer, pagesize=letter, title=title, author="High Dive",
+                              leftMargin=0.6 * inch, rightMargin=0.6 * inch,
+                              topMargin=0.6 * inch, bottomMargin=0.75 * inch)
+        frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id="body")
+        doc.addPageTemplates([PageTemplate(id="sheet", frames=[frame], onPage=decorate)])
+        doc.generated = datetime.now().strftime("%Y-%m-%d %H:%M")
+        return doc
+
+    return {
+        "styles": styles, "table_style": functools.lru_cache(maxsize=32)(table_style),
+        "new_doc": new_doc, "width": letter[0] - 1.2 * inch, "inch": inch,
+        "Paragraph": Paragraph, "Table": Table, "Spacer": Spacer,
+        "PageBreak": PageBreak, "KeepTogether": KeepTogether,
+    }
+
+
+def _order_sheet_flowables(order, count_sheet=False):
+    """Flowables for one vendor order (or the matching inventory count sheet)"""
+    from xml.sax.saxutils import escape   # Paragraph text is markup — "A <b" must stay text
+    tk = _pdf_toolkit()
+    P, styles, inch = tk["Paragraph"], tk["styles"], tk["inch"]
+    accent = order.get("color", "#0f3460")
+    df = order["order_df"]
+
+    kind = "COUNT SHEET" if count_sheet else "ORDER"
+    header = [
+        P(f'<font color="{accent}">{escape(str(order["vendor"]))}</font> {kind}', styles["title"]),
+        P(f'{escape(str(order.get("full_name", "")))} &nbsp;·&nbsp; '
+          f'Order {order["order_date"]:%a %b %d} '
+          f'→ Delivery {order["delivery_date"]:%a %b %d} &nbsp;·&nbsp; '
+          f'Covers {escape(", ".join(order["coverage_days"]))}', styles["meta"]),
+        tk["Spacer"](1, 0.15 * inch),
+    ]
+
+    if count_sheet:
+        data = [["Ingredient", "Unit", "Par", "On Hand", "To Order"]]
+        data += [[P(escape(str(ing)), styles["cell"]), unit, f"{qty:,.1f}", "", ""]
+                 for ing, qty, unit in zip(df["Ingredient"], df["ORDER QTY"], df["Unit"])]
+        widths = [0.46, 0.12, 0.12, 0.15, 0.15]
+    else:
+        data = [["Ingredient", "Qty", "Unit", "Rec'd"]]
+        data += [[P(escape(str(ing)), styles["cell"]), f"{qty:,.1f}", unit, ""]
+                 for ing, qty, unit in zip(df["Ingredient"], df["ORDER QTY"], df["Unit"])]
+        widths = [0.6, 0.15, 0.15, 0.1]
+
+    table = tk["Table"](data, colWidths=[w * tk["width"] for w in widths], repeatRows=1)
+    table.setStyle(tk["table_style"](accent))
+    return header + [table]
+
+
+@traced("export.pdf", measure=lambda out: {"bytes": len(out) if isinstance(out, bytes)
+                                            else sum(map(len, out.values()))})
+def render_order_sheets_pdf(orders, single_file=True, count_sheets=False):
+    """
+    Render print-ready order sheets for a batch of vendor orders.
+
+    orders: list of dicts with vendor, full_name, color, order_date,
+            delivery_date, coverage_days and order_df (Ingredient, ORDER QTY, Unit)
+    count_sheets: also add an inventory count sheet after each order
+    Returns: PDF bytes when single_file, else { filename: PDF bytes }
+    """
+    tk = _pdf_toolkit()
+
+    def sheets(order):
+        flow = _order_sheet_flowables(order)
+        if count_sheets:
+            flow += [tk["PageBreak"]()] + _order_sheet_flowables(order, count_sheet=True)
+        return flow
+
+    if single_file:
+        story = []
+        for i, order in enumerate(orders):
+            if i:
+                story.append(tk["PageBreak"]())
+            story += sheets(order)
+        buffer = io.BytesIO()
+        doc = tk["new_doc"](buffer, "High Dive Orders")
+        doc.build(story or [tk["Spacer"](1, 1)])
+        return buffer.getvalue()
+
+    files = {}
+    for order in orders:
+        buffer = io.BytesIO()
+        doc = tk["new_doc"](buffer, f"{order['vendor']} Order")
+        doc.build(sheets(order))
+        name = (f"{order['vendor'].replace(' ', '_')}_Order_"
+                f"{order['delivery_date']:%Y%m%d}.pdf")
+        files[name] = buffer.getvalue()
+    return files
+
+
+@traced("order.batch", measure=lambda orders: {"rows": len(orders)})
+def build_orders_due(calendar, order_date, ingredient_totals, vendor_schedules,
+                     day_adjustments, waste_factor=1.10, shelf_life_plan=None, usage=None,
+                     planned=None):
+    """
+    Every vendor order placed on order_date, ready for render_order_sheets_pdf.
+    shelf_life_plan: optional ShelfLifePlan built over the same calendar
+    usage: optional scenario usage matrix (see OrderBuilder)
+    planned: optional { (vendor, order date, delivery date): order_df } from
+        plan_orders, used in place of the built order
+    """
+    orders = []
+    builder = OrderBuilder(ingredient_totals, day_adjustments, waste_factor, usage)
+    for w in calendar.due_on(order_date):
+        v_key, v_data = w["vendor"], vendor_schedules.get(w["vendor"], {})
+        window_key = (v_key, w["order_date"], w["delivery_date"])
+        if planned and window_key in planned:
+            order_df = planned[window_key]
+        else:
+            order_df = builder.build(v_key, w["order"]["covers"],
+                                     coverage_weights=calendar.usage_weights(w),
+                                     ingredient_coverage=(shelf_life_plan.window_coverage(w)
+                                                          if shelf_life_plan else None))
+        if order_df.empty:
+            continue
+        orders.append({
+            "vendor": v_key,
+            "full_name": v_data.get("full_name", v_key),
+            "color": v_data.get("color", "#0f3460"),
+            "window": w["window"],
+            "order_date": w["order_date"],
+            "delivery_date": w["delivery_date"],
+            "coverage_days": [f"{d:%a %m/%d}" for d in calendar.usage_weights(w)],
+            "order_df": order_df,
+        })
+    return orders
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_order_sheets_pdf(cache_key, _orders, single_file=True, count_sheets=False):
+    """render_order_sheets_pdf memoised by an inputs fingerprint"""
+    telemetry.mark_miss()
+    return render_order_sheets_pdf(_orders, single_file, count_sheets)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# ORDER EXPORTS (Excel / CSV / JSON)
+# ─────────────────────────────────────────────────────────────────────────────
+
+EXPORT_FORMATS = {
+    "xlsx": ("Excel workbook", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv":  ("CSV", "text/csv"),
+    "json": ("JSON", "application/json"),
+}
+
+
+def _export_sheet_name(order, taken):
+    """Excel-safe, unique sheet name (max 31 chars, no []:*?/\\)"""
+    base = f"{order['vendor']} {order['delivery_date']:%a %m-%d}"
+    base = "".join("-" if c in '[]:*?/\\' else c for c in base)[:31]
+    name, n = base, 2
+    while name in taken:
+        suffix = f" ({n})"
+        name, n = base[:31 - len(suffix)] + suffix, n + 1
+    taken.add(name)
+    return name
+
+
+def _order_export_columns(order_df):
+    cols = (["Ingredient"] + [DAY_SHORT[d] for d in DAY_ORDER] + ["ORDER QTY", "Unit"])
+    return [c for c in cols if c in order_df.columns]
+
+
+@traced("export.file", measure=lambda out: {"bytes": len(out)})
+def export_orders(orders, fmt="xlsx", waste_pct=None):
+    """
+    Serialise one or more vendor orders.
+
+    xlsx — one sheet per order plus a Summary sheet, written with openpyxl's
+           write-only (streaming) workbook so rows go straight to the zip stream
+    csv  — one long table: Vendor, Order Date, Delivery Date, Ingredient, ...
+    json — list of orders with their lines
+    Returns: bytes
+    """
+    if fmt == "xlsx":
+        wb = Workbook(write_only=True)
+        header_font = Font(bold=True, color="FFFFFF")
+        header_fill = PatternFill("solid", fgColor="0F3460")
+
+        def header_row(ws, names):
+            cells = []
+            for name in names:
+                cell = WriteOnlyCell(ws, value=name)
+                cell.font, cell.fill = header_font, header_fill
+                cells.append(cell)
+            ws.append(cells)
+
+        summary_rows = []
+        taken = set()
+        for order in orders:
+            df = order["order_df"]
+            cols = _order_export_columns(df)
+            ws = wb.create_sheet(_export_sheet_name(order, taken))
+            ws.column_dimensions["A"].width = 36
+            header_row(ws, cols)
+            for row in df[cols].itertuples(index=False, name=None):
+                ws.append(row)
+            summary_rows.append([
+                ws.title, order.get("full_name", order["vendor"]),
+                order["order_date"].isoformat(), order["delivery_date"].isoformat(),
+                ", ".join(order["coverage_days"]),
+                f"{waste_pct}%" if waste_pct is not None else "", len(df),
+            ])
+
+        ws = wb.create_sheet("Summary")
+        ws.column_dimensions["B"].width = 24
+        header_row(ws, ["Sheet", "Vendor", "Order Date", "Delivery Date", "Coverage Days",
+                        "Waste Buffer", "Items"])
+        for row in summary_rows:
+            ws.append(row)
+
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        return buffer.getvalue()
+
+    frames = []
+    for order in orders:
+        df = order["order_df"][_order_export_columns(order["order_df"])]
+        frames.append(df.assign(**{
+            "Vendor": order["vendor"],
+            "Order Date": order["order_date"].isoformat(),
+            "Delivery Date": order["delivery_date"].isoformat(),
+            "Covers": ", ".join(order["coverage_days"]),
+        }))
+
+    if fmt == "csv":
+        lead = ["Vendor", "Order Date", "Delivery Date", "Covers"]
+        if not frames:
+            return ",".join(lead).encode()
+        long_df = pd.concat(frames, ignore_index=True)
+        long_df = long_df[lead + [c for c in long_df.columns if c not in lead]]
+        return long_df.to_csv(index=False).encode()
+
+    if fmt == "json":
+        payload = [{
+            "vendor": order["vendor"],
+            "order_date": order["order_date"].isoformat(),
+            "delivery_date": order["delivery_date"].isoformat(),
+            "covers": order["coverage_days"],
+            "waste_pct": waste_pct,
+            "lines": [
+                {"ingredient": ing, "qty": float(qty), "unit": unit}
+                for ing, qty, unit in zip(order["order_df"]["Ingredient"],
+                                          order["order_df"]["ORDER QTY"],
+                                          order["order_df"]["Unit"])
+            ],
+        } for order in orders]
+        return json.dumps(payload, indent=2).encode()
+
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_order_export(cache_key, _orders, fmt="xlsx", waste_pct=None):
+    """export_orders memoised by an inputs fingerprint"""
+    telemetry.mark_miss()
+    return export_orders(_orders, fmt, waste_pct)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# COMPACT SALES HISTORY (item × period arrays)
+# ─────────────────────────────────────────────────────────────────────────────
+
+class SalesHistory:
+    """
+    Item sales as contiguous item × period arrays.
+
+    items is the categorical dictionary — each distinct item name is stored
+    once and rows are addressed by position. qty and sales are float32
+    (items, periods) with one period per weekly upload (from_frames) or per
+    business date (from_daily); labels and starts name and date the periods.
+    item_category holds int16 codes into categories (-1 when unknown).
+    Every other column of the source frames is dropped.
+    """
+
+    def __init__(self, items, categories, item_category, labels, starts, qty, sales):
+        self.items = items
+        self.item_index = {name: i for i, name in enumerate(items)}
+        self.categories = categories
+        self.item_category = item_category
+        self.labels = labels
+        self.starts = starts
+        self.qty = qty
+        self.sales = sales
+
+    @classmethod
+    def _build(cls, parts, labels, starts):
+        """parts: (period, Item series, qty, sales, category series or None) per frame"""
+        item_index, cat_index, item_cat = {}, {}, {}
+        rows, periods, qtys, sales_vals = [], [], [], []
+        for period, names, qty, sales, cats in parts:
+            codes, uniques = pd.factorize(names)
+            lookup = np.array([item_index.setdefault(u, len(item_index)) for u in uniques],
+                              dtype=np.int32)
+            hit = codes >= 0
+            row = lookup[codes[hit]]
+            rows.append(row)
+            periods.append(np.broadcast_to(np.asarray(period, dtype=np.int32), row.shape)
+                           if np.ndim(period) == 0 else np.asarray(period)[hit])
+            qtys.append(np.nan_to_num(qty[hit]))
+            sales_vals.append(np.nan_to_num(sales[hit]))
+            if cats is not None:
+                for r, c in zip(row, cats[hit]):
+                    if r not in item_cat and isinstance(c, str):
+                        item_cat[r] = cat_index.setdefault(c, len(cat_index))
+
+        shape = (len(item_index), len(labels))
+        qty_m = np.zeros(shape, dtype=np.float32)
+        sales_m = np.zeros(shape, dtype=np.float32)
+        if rows:
+            idx = (np.concatenate(rows), np.concatenate(periods))
+            np.add.at(qty_m, idx, np.concatenate(qtys).astype(np.float32))
+            np.add.at(sales_m, idx, np.concatenate(sales_vals).astype(np.float32))
+        item_category = np.full(len(item_index), -1, dtype=np.int16)
+        for r, c in item_cat.items():
+            item_category[r] = c
+        return cls(list(item_index), list(cat_index), item_category, labels,
+                   np.array(starts, dtype="datetime64[D]"), qty_m, sales_m)
+
+    @classmethod
+    def from_frames(cls, frames):
+        """{ label: Product Mix frame } → one period per label, in label order"""
+        labels, parts, starts = [], [], []
+        for period, label in enumerate(frames):
+            df = frames[label]
+            labels.append(label)
+            week_start = get_week_start(label)
+            starts.append(week_start.date() if week_start else None)
+            parts.append((period, df["Item"],
+                          pd.to_numeric(df["Qty sold"], errors="coerce").to_numpy(float),
+                          pd.to_numeric(df["Net sales"], errors="coerce").to_numpy(float)
+                          if "Net sales" in df.columns else np.zeros(len(df)),
+                          df["Sales Category"].to_numpy(object)
+                          if "Sales Category" in df.columns else None))
+        return cls._build(parts, labels, starts)
+
+    @classmethod
+    def from_daily(cls, daily_sales):
+        """Long per-business-date sales (Business Date, Item, ...) → one period per date"""
+        day_codes, days = pd.factorize(pd.to_datetime(daily_sales["Business Date"]).dt.normalize(),
+                                       sort=True)
+        part = (day_codes.astype(np.int32), daily_sales["Item"],
+                pd.to_numeric(daily_sales["Qty sold"], errors="coerce").to_numpy(float),
+                pd.to_numeric(daily_sales["Net sales"], errors="coerce").to_numpy(float),
+                None)
+        return cls._build([part], [f"{d:%Y-%m-%d}" for d in days], [d.date() for d in days])
+
+    @property
+    def num_periods(self):
+        return len(self.labels)
+
+    @property
+    def nbytes(self):
+        return (self.qty.nbytes + self.sales.nbytes + self.item_category.nbytes
+                + self.starts.nbytes + sum(sys.getsizeof(n) for n in self.items))
+
+    def item_totals(self):
+        """Units sold per item over every period (float64)"""
+        return self.qty.sum(axis=1, dtype=np.float64)
+
+    def totals(self):
+        """(units, net sales) over everything loaded"""
+        return float(self.qty.sum(dtype=np.float64)), float(self.sales.sum(dtype=np.float64))
+
+    def category_of(self, item):
+        row = self.item_index.get(item)
+        if row is None or self.item_category[row] < 0:
+            return None
+        return self.categories[self.item_category[row]]
+
+    def to_frame(self):
+        """Item totals as a Product Mix-shaped frame"""
+        return pd.DataFrame({
+            "Item": self.items,
+            "Qty sold": self.item_totals(),
+            "Net sales": self.sales.sum(axis=1, dtype=np.float64),
+            "Sales Category": [self.categories[c] if c >= 0 else None for c in self.item_category],
+        })
+
+
+def sales_history(weekly_data):
+    """SalesHistory of a session's uploads — built once per data version when shared"""
+    if hasattr(weekly_data, "history"):
+        return weekly_data.history()
+    if not hasattr(weekly_data, "versions"):
+        return SalesHistory.from_frames(weekly_data)
+    key = f"{weekly_data.location}/sales_history/{_content_version(weekly_data.versions())}"
+    return weekly_data.cache.memo(key, lambda: SalesHistory.from_frames(weekly_data))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SHARED DATASET CACHE (one copy per location + data version, all sessions)
+# ─────────────────────────────────────────────────────────────────────────────
+
+SHARED_CACHE_MB = float(os.environ.get("HIGHDIVE_SHARED_CACHE_MB", 256))
+SHARED_CACHE_SPILL_DAYS = 14
+
+
+def data_location():
+    """Location the loaded data belongs to — Toast restaurant GUID when configured"""
+    if os.environ.get("HIGHDIVE_LOCATION"):
+        return os.environ["HIGHDIVE_LOCATION"]
+    try:
+        return st.secrets["toast"]["restaurant_guid"]
+    except Exception:
+        return "default"
+
+
+def frame_version(df):
+    """Content hash of a DataFrame — identical uploads get identical versions"""
+    h = hashlib.sha1(json.dumps([str(c) for c in df.columns]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()[:16]
+
+
+def _estimate_bytes(obj):
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if hasattr(obj, "nbytes"):                  # arrays, SalesHistory
+        return int(obj.nbytes)
+    if isinstance(obj, (tuple, list)):
+        return sum(_estimate_bytes(o) for o in obj)
+    if isinstance(obj, dict):
+        return 200 * len(obj) + sum(_estimate_bytes(v) for v in obj.values())
+    return 64
+
+
+class SharedDatasetCache:
+    """
+    Process-wide LRU of datasets and computed results, shared by every session.
+
+    Datasets are keyed "location/kind/version" where version is a content
+    hash, so three people loading the same Product Mix export share one
+    frame. Memory is capped at max_bytes; least recently used entries are
+    evicted. Datasets are also written to spill_dir when first stored, so an
+    evicted dataset reloads from disk instead of disappearing from sessions
+    that still reference it. Computed results (memo) are only kept in memory
+    and are recomputed after eviction.
+
+    Stored objects are never mutated: get() hands out shallow copies, and
+    pandas copy-on-write (switched on at import for pandas < 3) gives a
+    session its own column the moment it writes to one.
+    """
+
+    def __init__(self, spill_dir, max_bytes):
+        self.spill_dir = Path(spill_dir)
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._entries = {}            # key → (obj, nbytes); dict order = LRU order
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = self.misses = self.reloads = self.evictions = 0
+
+    def _spill_path(self, key):
+        return self.spill_dir / (hashlib.sha1(key.encode()).hexdigest() + ".pkl")
+
+    def _insert(self, key, obj):
+        nbytes = _estimate_bytes(obj)
+        self._entries[key] = (obj, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old_key = next(iter(self._entries))
+            self._bytes -= self._entries.pop(old_key)[1]
+            self.evictions += 1
+            telemetry.count("shared_cache", result="evict")
+
+    def _touch(self, key):
+        entry = self._entries.pop(key)
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, location, kind, df):
+        """Store a dataset; returns its key (existing key when already stored)"""
+        key = f"{location}/{kind}/{frame_version(df)}"
+        with self._lock:
+            if key in self._entries:
+                self._touch(key)
+                return key
+            path = self._spill_path(key)
+            if not path.exists():
+                df.to_pickle(path)
+            self._insert(key, df)
+        return key
+
+    def get(self, key):
+        """Shared dataset for key (copy-on-write view); KeyError when unknown"""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                telemetry.count("shared_cache", result="hit")
+                return self._touch(key).copy(deep=False)
+            path = self._spill_path(key)
+            if not path.exists():
+                raise KeyError(key)
+            df = pd.read_pickle(path)
+            self.reloads += 1
+            telemetry.count("shared_cache", result="reload")
+            self._insert(key, df)
+            return df.copy(deep=False)
+
+    def memo(self, key, fn):
+        """Computed result for key, running fn() once across all sessions"""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                telemetry.count("shared_cache", result="hit")
+                return self._touch(key)
+        result = fn()
+        with self._lock:
+            self.misses += 1
+            telemetry.count("shared_cache", result="miss")
+            if key not in self._entries:
+                self._insert(key, result)
+        return result
+
+    def has(self, key):
+        """Whether get(key) can return the dataset — in memory or spilled"""
+        with self._lock:
+            return key in self._entries or self._spill_path(key).exists()
+
+    def prune_spill(self, max_age_days=SHARED_CACHE_SPILL_DAYS, keep=()):
+        """Drop spilled datasets nobody has stored for max_age_days, except keep keys"""
+        cutoff = time.time() - max_age_days * 86400
+        kept = {self._spill_path(key) for key in keep}
+        for path in self.spill_dir.glob("*.pkl"):
+            if path not in kept and path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "mb": round(self._bytes / 1e6, 2),
+                    "max_mb": round(self.max_bytes / 1e6, 2), "hits": self.hits,
+                    "misses": self.misses, "reloads": self.reloads,
+                    "evictions": self.evictions}
+
+
+@st.cache_resource(show_spinner=False)
+def get_shared_cache():
+    cache = SharedDatasetCache(DATA_DIR / "shared_cache", int(SHARED_CACHE_MB * 1e6))
+    cache.prune_spill(keep=persisted_dataset_keys(get_user_state()))
+    return cache
+
+
+class DatasetRefs(MutableMapping):
+    """
+    A session's { label: DataFrame } held as references into the shared cache.
+
+    Behaves like the plain dict it replaces: assigning a frame stores it in
+    SharedDatasetCache and keeps only its key; reading returns the shared
+    frame as a copy-on-write view. Callers test for it with
+    hasattr(obj, "versions") — every rerun redefines the class, so an
+    isinstance check fails against refs made on an earlier run.
+    """
+
+    def __init__(self, kind, location=None, cache=None):
+        self.kind = kind
+        self.location = location or data_location()
+        self._cache = cache
+        self._keys = {}
+
+    @property
+    def cache(self):
+        return self._cache or get_shared_cache()
+
+    def __getitem__(self, label):
+        return self.cache.get(self._keys[label])
+
+    def __setitem__(self, label, df):
+        self._keys[label] = self.cache.put(self.location, self.kind, df)
+
+    def __delitem__(self, label):
+        del self._keys[label]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def version(self, label):
+        return self._keys[label].rsplit("/", 1)[1]
+
+    def versions(self):
+        """Stable (label, version) pairs — the data version of the whole set"""
+        return tuple(sorted((label, self.version(label)) for label in self._keys))
+
+    def refs(self):
+        """{ label: cache key } — enough to re-attach the set in a later session"""
+        return dict(self._keys)
+
+    def restore(self, refs):
+        """Re-attach saved refs whose datasets the cache (or its spill) still has"""
+        for label, key in refs.items():
+            if self.cache.has(key):
+                self._keys[label] = key
+
+
+def _content_version(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def shared_ingredient_totals(weekly_data, recipes, vendor_mapping, modifier_data=None):
+    """
+    compute_weekly_ingredient_totals, computed once per location and data
+    version for every session. The ingredient dicts are copied so a caller
+    adjusting quantities doesn't change them for everyone else.
+    """
+    if not hasattr(weekly_data, "versions"):
+        return compute_weekly_ingredient_totals(weekly_data, recipes, vendor_mapping,
+                                                modifier_data)
+    mod_versions = (tuple((label, modifier_data.version(label)) for label in sorted(weekly_data)
+                          if label in modifier_data)
+                    if hasattr(modifier_data, "versions") else _content_version(
+                        {k: frame_version(v) for k, v in (modifier_data or {}).items()
+                         if k in weekly_data}))
+    aliases = [get_item_resolver(recipes).aliases, get_vendor_resolver(vendor_mapping).aliases]
+    key = "/".join([weekly_data.location, "ingredient_totals", _content_version(
+        [weekly_data.versions(), mod_versions, recipes, vendor_mapping, aliases])])
+    totals, matched, unmatched, history = weekly_data.cache.memo(
+        key, lambda: compute_weekly_ingredient_totals(weekly_data, recipes, vendor_mapping,
+                                                      modifier_data))
+    return {k: dict(v) for k, v in totals.items()}, list(matched), list(unmatched), history
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# DATASET MANAGER (uploads, Toast pulls and the live feed merged by business date)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Higher wins a business date two loads both cover
+SOURCE_PRIORITY = {"upload": 1, "live": 2, "toast": 3}
+MERGE_POLICIES = {
+    "priority": "Source priority (Toast pulls > live feed > uploads)",
+    "latest":   "Latest load wins",
+}
+LIVE_FEED_LABEL = "Toast live feed"
+
+
+def _label_dates(label):
+    """Every YYYY-MM-DD in a dataset label or file name"""
+    found = []
+    for text in re.findall(r"\d{4}-\d{2}-\d{2}", str(label)):
+        try:
+            found.append(pd.Timestamp(text))
+        except ValueError:
+            continue
+    return found
+
+
+def spread_weekly_sales(df, dates):
+    """
+    Product Mix totals over dates → estimated per-day rows, split by
+    TYPICAL_WEIGHTS so each week keeps its share of the total.
+    """
+    weights = np.array([TYPICAL_WEIGHTS[DAY_ORDER[d.weekday()]] for d in dates])
+    weights = weights / weights.sum() if weights.sum() else np.full(len(dates), 1 / len(dates))
+    days = np.flatnonzero(weights)
+    qty = pd.to_numeric(df["Qty sold"], errors="coerce").fillna(0).to_numpy(float)
+    sales = (pd.to_numeric(df["Net sales"], errors="coerce").fillna(0).to_numpy(float)
+             if "Net sales" in df.columns else np.zeros(len(df)))
+    spread = pd.DataFrame({
+        "Business Date": np.repeat(pd.DatetimeIndex(dates)[days], len(df)),
+        "Item": np.tile(df["Item"].to_numpy(object), len(days)),
+        "Qty sold": np.outer(weights[days], qty).ravel(),
+        "Net sales": np.outer(weights[days], sales).ravel(),
+    })
+    if "Sales Category" in df.columns:
+        spread["Sales Category"] = np.tile(df["Sales Category"].to_numpy(object), len(days))
+    return spread
+
+
+class DatasetManager(DatasetRefs):
+    """
+    A session's sales loads merged at business-date granularity.
+
+    Every load — a Product Mix upload, a Toast pull, the live feed — is held
+    as a DatasetRefs entry together with the business dates it covers. Each
+    date is owned by exactly one load: under "priority" the higher
+    SOURCE_PRIORITY wins and equal priorities go to the later load; under
+    "latest" the later load always wins. Overlapping loads never double-count
+    and weeks is the span actually covered (days / 7).
+
+    Uploads carry weekly totals only, so their rows are spread over their
+    dates by TYPICAL_WEIGHTS. An upload whose file name has no date can't be
+    placed and counts as one separate week, as before.
+    """
+
+    def __init__(self, kind="sales", location=None, cache=None, policy="priority"):
+        super().__init__(kind, location, cache)
+        self.policy = policy
+        self.meta = {}        # label → {"source", "priority", "seq", "dates"}
+        self.owner = {}       # business date → label supplying it
+        self._seq = 0
+
+    def add(self, label, df, source=None, dates=None, refresh=False):
+        """
+        Store a load. dates: every business date it covers, sales or not
+        (inferred from the label or the rows when omitted). refresh: update
+        an existing load in place, keeping its place in load order.
+        """
+        super().__setitem__(label, df)
+        source = source or ("toast" if "Business Date" in df.columns else "upload")
+        if dates is None:
+            dates = self._infer_dates(label, df)
+        replaced = label in self.meta
+        if not (refresh and replaced):
+            self._seq += 1
+        self.meta[label] = {"source": source, "priority": SOURCE_PRIORITY.get(source, 0),
+                            "seq": self.meta[label]["seq"] if refresh and replaced else self._seq,
+                            "dates": sorted({pd.Timestamp(d).normalize() for d in dates})}
+        if replaced:
+            # Dates the old version owned may belong to another load again
+            self._rebuild()
+        else:
+            self._claim(label)
+
+    __setitem__ = add
+
+    def __delitem__(self, label):
+        super().__delitem__(label)
+        del self.meta[label]
+        self._rebuild()
+
+    @staticmethod
+    def _infer_dates(label, df):
+        named = _label_dates(label)
+        if "Business Date" in df.columns:
+            rows = pd.to_datetime(df["Business Date"])
+            start, end = (named[0], named[-1]) if len(named) >= 2 else (rows.min(), rows.max())
+        elif len(named) >= 2:
+            start, end = named[0], named[-1]
+        elif named:
+            start = named[0] - timedelta(days=named[0].weekday())
+            end = start + timedelta(days=6)
+        else:
+            return []
+        return [] if pd.isna(start) else list(pd.date_range(start, end))
+
+    def _wins(self, label, current):
+        if self.policy == "latest":
+            return self.meta[label]["seq"] >= self.meta[current]["seq"]
+        return ((self.meta[label]["priority"], self.meta[label]["seq"])
+                >= (self.meta[current]["priority"], self.meta[current]["seq"]))
+
+    def _claim(self, label):
+        for day in self.meta[label]["dates"]:
+            current = self.owner.get(day)
+            if current is None or self._wins(label, current):
+                self.owner[day] = label
+
+    def _rebuild(self):
+        self.owner = {}
+        for label in sorted(self.meta, key=lambda l: self.meta[l]["seq"]):
+            self._claim(label)
+
+    def set_policy(self, policy):
+        if policy != self.policy:
+            self.policy = policy
+            self._rebuild()
+
+    @property
+    def undated(self):
+        return [label for label, m in self.meta.items() if not m["dates"]]
+
+    @property
+    def days(self):
+        return len(self.owner)
+
+    @property
+    def weeks(self):
+        return self.days / 7 + len(self.undated)
+
+    def share_in_use(self, label):
+        """Fraction of a load's dates it still supplies (1.0 for undated uploads)"""
+        dates = self.meta[label]["dates"]
+        if not dates:
+            return 1.0
+        return sum(self.owner.get(d) == label for d in dates) / len(dates)
+
+    def versions(self):
+        """Policy plus every load in load order — merges depend on both"""
+        loads = sorted(self.meta.items(), key=lambda kv: kv[1]["seq"])
+        return (self.policy,) + tuple(
+            (label, self.version(label), m["source"],
+             str(m["dates"][0]) if m["dates"] else "", len(m["dates"]))
+            for label, m in loads)
+
+    def refs(self):
+        """Loads with their merge metadata; the live feed reloads from its own store"""
+        return {"policy": self.policy, "seq": self._seq, "loads": [
+            {"label": label, "key": self._keys[label], "source": m["source"], "seq": m["seq"],
+             "dates": [f"{d:%Y-%m-%d}" for d in m["dates"]]}
+            for label, m in self.meta.items() if m["source"] != "live"]}
+
+    def restore(self, refs):
+        """Re-attach saved loads whose datasets are still cached, then re-merge"""
+        self.policy = refs.get("policy", self.policy)
+        for load in refs.get("loads", []):
+            if not self.cache.has(load["key"]):
+                continue
+            self._keys[load["label"]] = load["key"]
+            self.meta[load["label"]] = {
+                "source": load["source"], "priority": SOURCE_PRIORITY.get(load["source"], 0),
+                "seq": load["seq"], "dates": [pd.Timestamp(d) for d in load["dates"]]}
+        self._seq = max(self._seq, refs.get("seq", 0))
+        self._rebuild()
+
+    def daily_rows(self, label):
+        """The per-day rows a load supplies — estimated for uploads"""
+        df = self[label]
+        if "Business Date" not in df.columns:
+            return spread_weekly_sales(df, self.meta[label]["dates"])
+        rows = df.copy(deep=False)
+        rows["Business Date"] = pd.to_datetime(rows["Business Date"]).dt.normalize()
+        return rows
+
+    def history(self):
+        """Merged SalesHistory, one period per covered date (plus undated uploads)"""
+        key = f"{self.location}/merged_history/{_content_version(self.versions())}"
+        return self.cache.memo(key, self._build_history)
+
+    def _build_history(self):
+        dates = sorted(self.owner)
+        position = pd.Series(np.arange(len(dates), dtype=np.int32), index=pd.DatetimeIndex(dates))
+        parts = []
+        for label, m in self.meta.items():
+            owned = [d for d in m["dates"] if self.owner.get(d) == label]
+            if not owned:
+                continue
+            rows = self.daily_rows(label)
+            rows = rows[rows["Business Date"].isin(owned)]
+            parts.append((position.reindex(rows["Business Date"]).to_numpy(np.int32), rows["Item"],
+                          pd.to_numeric(rows["Qty sold"], errors="coerce").to_numpy(float),
+                          pd.to_numeric(rows["Net sales"], errors="coerce").to_numpy(float),
+                          rows["Sales Category"].to_numpy(object)
+                          if "Sales Category" in rows.columns else None))
+        labels = [f"{d:%Y-%m-%d}" for d in dates]
+        starts = [d.date() for d in dates]
+        for label in self.undated:
+            df = self[label]
+            parts.append((len(labels), df["Item"],
+                          pd.to_numeric(df["Qty sold"], errors="coerce").to_numpy(float),
+                          pd.to_numeric(df["Net sales"], errors="coerce").to_numpy(float)
+                          if "Net sales" in df.columns else np.zeros(len(df)),
+                          df["Sales Category"].to_numpy(object)
+                          if "Sales Category" in df.columns else None))
+            labels.append(label)
+            starts.append(None)
+        return SalesHistory._build(parts, labels, starts)
+
+    def coverage_table(self):
+        """One row per load: what it covers and how much of that is still in use"""
+        rows = []
+        for label, m in sorted(self.meta.items(), key=lambda kv: kv[1]["seq"]):
+            dates = m["dates"]
+            used = sum(self.owner.get(d) == label for d in dates)
+            rows.append({
+                "Dataset": label,
+                "Source": m["source"].title() + (" (estimated daily)" if m["source"] == "upload"
+                                                 and dates else ""),
+                "Dates": f"{dates[0]:%b %d} – {dates[-1]:%b %d}" if dates else "undated (1 week)",
+                "Days": len(dates),
+                "In use": used if dates else "—",
+                "Superseded": len(dates) - used if dates else "—",
+            })
+        return pd.DataFrame(rows)
+
+
+def weeks_loaded(weekly_data):
+    """Weeks of sales the loaded datasets cover"""
+    return weekly_data.weeks if hasattr(weekly_data, "weeks") else len(weekly_data)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# USER STATE (adjustments, waste buffers and dataset refs kept across restarts)
+# ─────────────────────────────────────────────────────────────────────────────
+
+USER_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_state (
+    location  TEXT NOT NULL,
+    key       TEXT NOT NULL,
+    value     TEXT NOT NULL,
+    saved_at  TEXT NOT NULL,
+    PRIMARY KEY (location, key)
+);
+"""
+
+# Writes wait until the state has been still this long (a slider drag is one
+# write), but never longer than the max after the first unsaved change
+USER_STATE_DEBOUNCE_SECONDS = 2.0
+USER_STATE_MAX_DELAY_SECONDS = 10.0
+
+DEFAULT_WASTE_BUFFERS = {"orders": 10, "simulation": 10, "backtest": 10}
+
+# Session keys saved as cache refs — the frames stay in the shared cache spill
+PERSISTED_DATASETS = ("weekly_data", "modifier_data", "daily_sales", "daily_modifiers")
+
+
+class UserStateStore:
     """
-    Build an order for a specific vendor covering specific days.
+    Per-location session state in SQLite, written behind the session.
 
-    vendor_key: e.g. "GFS"
-    coverage_days: list of day names e.g. ["Wednesday", "Thursday"]
-    dow_averages: dict { "Monday": DataFrame of avg usage, ... }
-    Returns: DataFrame with ingredients and per-day + total quantities
+    save() only queues { key: JSON text } and returns; a writer thread
+    coalesces queued values and writes them in one transaction once they
+    have been still for `delay` seconds. Whatever is still queued is written
+    at interpreter exit.
     """
-    ingredient_rows = {}
 
-    for day in coverage_days:
-        if day not in dow_averages:
+    def __init__(self, db_path, delay=USER_STATE_DEBOUNCE_SECONDS,
+                 max_delay=USER_STATE_MAX_DELAY_SECONDS):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()           # the connection
+        self._queue = threading.Condition()     # _pending and its deadlines
+        self.delay, self.max_delay = delay, max_delay
+        self._pending = {}                      # (location, key) → JSON text
+        self._first = self._last = None         # monotonic time of oldest / newest change
+        self.writes = 0
+        with self._lock:
+            self._conn.executescript(USER_STATE_SCHEMA)
+        threading.Thread(target=self._run, name="user-state-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def load(self, location):
+        """{ key: JSON text } saved for a location, queued values included"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM user_state WHERE location = ?",
+                                      (location,)).fetchall()
+        values = dict(rows)
+        with self._queue:
+            values.update({key: text for (loc, key), text in self._pending.items()
+                           if loc == location})
+        return values
+
+    def values(self, key):
+        """{ location: JSON text } of one key across locations"""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT location, value FROM user_state WHERE key = ?", (key,)).fetchall())
+
+    def save(self, location, values):
+        """Queue { key: JSON text } for the writer; returns immediately"""
+        with self._queue:
+            for key, text in values.items():
+                self._pending[(location, key)] = text
+            self._last = time.monotonic()
+            self._first = self._first or self._last
+            self._queue.notify()
+
+    def _run(self):
+        while True:
+            with self._queue:
+                while not self._pending:
+                    self._queue.wait()
+                wait = min(self._last + self.delay,
+                           self._first + self.max_delay) - time.monotonic()
+                if wait > 0:
+                    self._queue.wait(wait)
+                    continue
+            self.flush()
+
+    def flush(self):
+        """Write everything queued now"""
+        with self._lock:
+            with self._queue:
+                batch, self._pending = self._pending, {}
+                self._first = self._last = None
+            if not batch:
+                return
+            saved_at = datetime.now().isoformat(timespec="seconds")
+            with telemetry.span("user_state.write", keys=len(batch)), self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO user_state (location, key, value, saved_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(loc, key, text, saved_at) for (loc, key), text in batch.items()])
+            self.writes += 1
+        telemetry.count("user_state", len(batch), result="written")
+
+
+@st.cache_resource
+def get_user_state():
+    return UserStateStore(DATA_DIR / "highdive.db")
+
+
+def persisted_dataset_keys(store):
+    """Cache keys saved sessions still point at — kept when the spill is pruned"""
+    keys = set()
+    for name in PERSISTED_DATASETS:
+        for text in store.values(name).values():
+            refs = json.loads(text)
+            if isinstance(refs, str):
+                keys.add(refs)
+            elif isinstance(refs, dict) and "loads" in refs:      # DatasetManager
+                keys.update(load["key"] for load in refs["loads"])
+            elif isinstance(refs, dict):                          # DatasetRefs
+                keys.update(refs.values())
+    return keys
+
+
+def _frame_ref(name, df, exclude_dates=()):
+    """
+    Shared cache key of a session frame. Hashed once per frame object — the
+    session keeps (frame, key) so unchanged frames cost nothing per rerun.
+    """
+    if df is None:
+        return None
+    memo = st.session_state.user_state_frames
+    if name in memo and memo[name][0] is df:
+        return memo[name][1]
+    stored = df[~df["Business Date"].isin(list(exclude_dates))] if exclude_dates else df
+    key = get_shared_cache().put(data_location(), name, stored) if not stored.empty else None
+    memo[name] = (df, key)
+    return key
+
+
+def user_state_values():
+    """This session's persisted state as { key: JSON-ready value }"""
+    ss = st.session_state
+    values = {"day_adjustments": ss.day_adjustments,
+              "sales_projections": ss.sales_projections,
+              "waste_buffers": ss.waste_buffers,
+              "active_scenarios": list(ss.get("active_scenarios", []))}
+    for name in ("weekly_data", "modifier_data"):
+        if hasattr(ss[name], "refs"):
+            values[name] = ss[name].refs()
+    # Live-feed rows refill on every session start; only bulk loads are saved
+    values["daily_sales"] = _frame_ref("daily_sales", ss.daily_sales, ss.live_dates)
+    values["daily_modifiers"] = _frame_ref("daily_modifiers", ss.daily_modifiers, ss.live_dates)
+    return values
+
+
+def restore_user_state():
+    """
+    Saved state for this location into a new session. Dataset refs are
+    re-attached without reading their frames; those load on first use.
+    """
+    ss = st.session_state
+    ss.user_state_saved = get_user_state().load(data_location())
+    ss.user_state_frames = {}
+    values = {}
+    for key, text in ss.user_state_saved.items():
+        try:
+            values[key] = json.loads(text)
+        except ValueError:
             continue
-        day_usage = dow_averages[day]  # dict { ingredient: qty }
-        for ingredient, qty in day_usage.items():
-            ing_lower = ingredient.lower()
-            vendor = vendor_mapping.get(ing_lower,
-                     vendor_mapping.get(ingredient, "UNMAPPED"))
-            if vendor != vendor_key:
-                continue
-            if ingredient not in ingredient_rows:
-                ingredient_rows[ingredient] = {d: 0 for d in DAY_ORDER}
-                ingredient_rows[ingredient]["unit"] = ""
-            ingredient_rows[ingredient][day] = round(qty, 2)
-
-    if not ingredient_rows:
-        return pd.DataFrame()
-
-    rows = []
-    for ingredient, data in ingredient_rows.items():
-        row = {"Ingredient": ingredient}
-        total = 0
-        for day in coverage_days:
-            val = data.get(day, 0)
-            row[DAY_SHORT[day]] = round(val, 2)
-            total += val
-        row["Total"] = round(total * waste_factor, 2)
-        row["Unit"]  = data.get("unit", "")
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
-    cols = ["Ingredient"] + [DAY_SHORT[d] for d in coverage_days] + ["Total", "Unit"]
-    df = df[[c for c in cols if c in df.columns]]
-    return df.sort_values("Total", ascending=False).reset_index(drop=True)
+    for name in ("day_adjustments", "sales_projections", "waste_buffers"):
+        ss[name].update({k: v for k, v in values.get(name, {}).items() if k in ss[name]})
+    if values.get("active_scenarios"):
+        ss.active_scenarios = values["active_scenarios"]
+    for name in ("weekly_data", "modifier_data"):
+        if values.get(name) and hasattr(ss[name], "restore"):
+            ss[name].restore(values[name])
+    if values.get("weekly_data"):
+        ss.merge_policy = ss.weekly_data.policy
+    for name in ("daily_sales", "daily_modifiers"):
+        key = values.get(name)
+        if key and get_shared_cache().has(key):
+            ss[name] = get_shared_cache().get(key)
+            ss.user_state_frames[name] = (ss[name], key)
+    if values:
+        telemetry.count("user_state", result="restored")
+
+
+def persist_user_state():
+    """Queue whatever changed since the last save; the store writes it in the background"""
+    saved = st.session_state.user_state_saved
+    changed = {}
+    for key, value in user_state_values().items():
+        text = json.dumps(value, sort_keys=True, default=float)
+        if saved.get(key) != text:
+            changed[key] = saved[key] = text
+    if changed:
+        get_user_state().save(data_location(), changed)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -651,7 +6299,7 @@ def build_order_for_vendor(vendor_key, coverage_days, dow_averages,
 # ─────────────────────────────────────────────────────────────────────────────
 
 if "weekly_data" not in st.session_state:
-    st.session_state.weekly_data = {}   # { "Week 1": DataFrame, ... }
+    st.session_state.weekly_data = DatasetManager()   # { "Week 1": DataFrame, ... } merged by date
 if "dow_averages" not in st.session_state:
     st.session_state.dow_averages = {}  # { "Monday": {ingredient: avg_qty}, ... }
 if "day_adjustments" not in st.session_state:
@@ -663,6 +6311,28 @@ if "sales_projections" not in st.session_state:
     st.session_state.sales_projections = {d: 0.0 for d in DAY_ORDER}
 if "toast_connected" not in st.session_state:
     st.session_state.toast_connected = False
+if "current_order" not in st.session_state:
+    st.session_state.current_order = None  # last calculated vendor order
+if "daily_sales" not in st.session_state:
+    st.session_state.daily_sales = None    # per-business-date item sales (Toast API)
+if "modifier_data" not in st.session_state:
+    st.session_state.modifier_data = DatasetRefs("modifiers")  # { dataset label: modifier counts }
+if "daily_modifiers" not in st.session_state:
+    st.session_state.daily_modifiers = None
+# Re-read every run so closures saved in another session apply here too
+st.session_state.calendar_exceptions = get_calendar_exception_store().load()
+if "fetch_jobs" not in st.session_state:
+    st.session_state.fetch_jobs = {}     # { job id: {"applied": set of days, ...} }
+if "live_version" not in st.session_state:
+    st.session_state.live_version = -1   # LiveOrderStore.version last merged
+    st.session_state.live_dates = set()  # business dates filled from the live feed
+    st.session_state.live_loaded = None  # (date, version) pairs in the live dataset
+if "active_scenarios" not in st.session_state:
+    st.session_state.active_scenarios = []   # saved scenario names layered onto orders
+if "waste_buffers" not in st.session_state:
+    st.session_state.waste_buffers = dict(DEFAULT_WASTE_BUFFERS)   # { page: waste buffer % }
+if "user_state_saved" not in st.session_state:
+    restore_user_state()   # { key: JSON text } as last saved for this location
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -670,8 +6340,71 @@ if "toast_connected" not in st.session_state:
 # ─────────────────────────────────────────────────────────────────────────────
 
 recipes         = load_recipes()
-vendor_mapping  = load_vendor_mapping()
+vendor_mapping  = get_vendor_mapping_store().mapping(load_vendor_mapping())
 vendor_schedules = load_vendor_schedules()
+calendar_start  = datetime.now().date() - timedelta(days=7)
+delivery_calendar = get_delivery_calendar(vendor_schedules, st.session_state.calendar_exceptions,
+                                          calendar_start, 42)
+live_orders     = get_live_order_store()
+webhook_receiver = get_webhook_receiver()
+apply_live_orders(live_orders)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# DOWNLOAD HELPERS
+# ─────────────────────────────────────────────────────────────────────────────
+
+DOWNLOAD_FORMATS = {
+    "xlsx":    ("📊 Excel", ".xlsx", EXPORT_FORMATS["xlsx"][1]),
+    "pdf":     ("🖨️ PDF", ".pdf", "application/pdf"),
+    "pdf_zip": ("🗂️ PDF per vendor (.zip)", ".zip", "application/zip"),
+    "csv":     ("🧾 CSV", ".csv", EXPORT_FORMATS["csv"][1]),
+    "json":    ("🔗 JSON", ".json", EXPORT_FORMATS["json"][1]),
+}
+
+
+def build_download(cache_key, orders, fmt, waste_pct=None, count_sheets=True):
+    """
+    File bytes for a download format, served from the fingerprint caches.
+    count_sheets: PDFs add an inventory count sheet after each order
+    """
+    if fmt == "pdf":
+        return telemetry.cache_lookup("order_pdf", cached_order_sheets_pdf, cache_key, orders,
+                                      count_sheets=count_sheets)
+    if fmt == "pdf_zip":
+        files = telemetry.cache_lookup("order_pdf", cached_order_sheets_pdf, cache_key, orders,
+                                       single_file=False, count_sheets=count_sheets)
+        zbuf = io.BytesIO()
+        with zipfile.ZipFile(zbuf, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, data in files.items():
+                zf.writestr(name, data)
+        return zbuf.getvalue()
+    return telemetry.cache_lookup("order_export", cached_order_export, cache_key, orders, fmt,
+                                  waste_pct)
+
+
+def lazy_download(cache_key, orders, formats, file_stem, key, waste_pct=None,
+                  count_sheets=True):
+    """
+    Format picker + Prepare button. Files are only built once asked for,
+    and orders may be a callable so the orders themselves are built lazily too.
+    """
+    prepared = st.session_state.setdefault("prepared_downloads", set())
+    fcol, bcol = st.columns([2, 1])
+    with fcol:
+        fmt = st.selectbox("Format", formats, format_func=lambda f: DOWNLOAD_FORMATS[f][0],
+                           key=f"{key}_fmt", label_visibility="collapsed")
+    token = (cache_key, fmt)
+    with bcol:
+        if token not in prepared and st.button("⚙️ Prepare Download", key=f"{key}_prep",
+                                               use_container_width=True):
+            prepared.add(token)
+        if token in prepared:
+            label, ext, mime = DOWNLOAD_FORMATS[fmt]
+            data = build_download(cache_key, orders() if callable(orders) else orders,
+                                  fmt, waste_pct, count_sheets)
+            st.download_button(f"📥 Download {label}", data=data, file_name=file_stem + ext,
+                               mime=mime, key=f"{key}_file", use_container_width=True)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -704,20 +6437,40 @@ with st.sidebar:
     st.markdown("### Navigation")
     page = st.radio(
         "",
-        ["📊 Sales Dashboard", "📋 Generate Orders", "⚙️ Settings", "❓ Help"],
+        ["📊 Sales Dashboard", "📋 Generate Orders", "🕒 Daypart Prep",
+         "📦 Stock Projection", "📒 Order History",
+         "🎯 Forecast Accuracy", "🩺 Diagnostics", "⚙️ Settings", "❓ Help"],
         label_visibility="collapsed"
     )
 
     st.markdown("---")
     st.markdown("### Data Status")
 
-    weeks_loaded = len(st.session_state.weekly_data)
-    if weeks_loaded == 0:
+    if st.session_state.fetch_jobs:
+        if any(getattr(get_fetch_jobs().get(j), "running", False)
+               for j in st.session_state.fetch_jobs):
+            st.fragment(fetch_jobs_panel, run_every=FETCH_POLL_SECONDS)()
+        else:
+            fetch_jobs_panel()
+
+    loaded = weeks_loaded(st.session_state.weekly_data)
+    if not st.session_state.weekly_data:
         st.warning("No data loaded")
-    elif weeks_loaded < 4:
-        st.warning(f"{weeks_loaded}/4 weeks loaded")
+    elif loaded < 4:
+        st.warning(f"{loaded:.3g}/4 weeks loaded")
+    else:
+        st.success(f"✅ {loaded:.3g} weeks loaded")
+
+    st.markdown("---")
+    st.markdown("### Due Today")
+    due_today = delivery_calendar.due_on(now.date())
+    if due_today:
+        for w in due_today:
+            st.markdown(f"📦 **{w['vendor']}** — for {w['delivery_date']:%a %m/%d} delivery")
     else:
-        st.success(f"✅ {weeks_loaded} weeks loaded")
+        st.markdown("No orders due today")
+    if not delivery_calendar.is_open(now.date()):
+        st.markdown("🔴 Restaurant closed today")
 
     st.markdown("---")
     st.markdown("### Recipes")
@@ -733,6 +6486,13 @@ with st.sidebar:
         else:
             st.markdown(f"**{v_key}** — ⚠️ schedule pending")
 
+# Saved here for changes the sidebar made and pages that st.stop() early, and
+# again after the page renders
+persist_user_state()
+
+# Timed through to the footer — pages that st.stop() early are not recorded
+page_span = telemetry.start_run("page.render", page=page)
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # PAGE: SALES DASHBOARD
@@ -764,8 +6524,14 @@ if page == "📊 Sales Dashboard":
     with col2:
         st.markdown("<br>", unsafe_allow_html=True)
         if st.button("🗑️ Clear All Data", use_container_width=True):
-            st.session_state.weekly_data = {}
+            st.session_state.weekly_data = DatasetManager(
+                policy=st.session_state.get("merge_policy", "priority"))
             st.session_state.dow_averages = {}
+            st.session_state.daily_sales = None
+            st.session_state.live_dates = set()
+            st.session_state.live_version = -1   # refill from the live feed
+            st.session_state.modifier_data = DatasetRefs("modifiers")
+            st.session_state.daily_modifiers = None
             st.rerun()
 
     if uploaded_files:
@@ -777,18 +6543,35 @@ if page == "📊 Sales Dashboard":
                     st.success(f"✅ Loaded: {uf.name} — {len(df)} items, "
                                f"${df['Net sales'].sum():,.0f} revenue")
 
+    if hasattr(st.session_state.weekly_data, "coverage_table") and st.session_state.weekly_data:
+        with st.expander("🧩 Loaded data and overlaps"):
+            def set_merge_policy():
+                st.session_state.merge_policy = st.session_state.merge_policy_widget
+
+            # The radio's own key is dropped whenever this expander isn't rendered,
+            # so the policy lives in merge_policy and is copied in on every render
+            st.session_state.merge_policy_widget = st.session_state.get(
+                "merge_policy", st.session_state.weekly_data.policy)
+            st.radio("When two loads cover the same business date",
+                     list(MERGE_POLICIES), format_func=MERGE_POLICIES.get,
+                     key="merge_policy_widget", on_change=set_merge_policy, horizontal=True)
+            st.session_state.weekly_data.set_policy(st.session_state.merge_policy_widget)
+            st.dataframe(st.session_state.weekly_data.coverage_table(),
+                         use_container_width=True, hide_index=True)
+            st.caption("Each business date is counted once, from the load that owns it. "
+                       "Uploads only have weekly totals, so their days are estimated.")
+
     # ── Summary Metrics ─────────────────────────────────────────────────────
     if st.session_state.weekly_data:
-        all_dfs = list(st.session_state.weekly_data.values())
-        total_items = sum(df["Qty sold"].sum() for df in all_dfs)
-        total_revenue = sum(df["Net sales"].sum() for df in all_dfs)
-        weeks = len(all_dfs)
+        history = sales_history(st.session_state.weekly_data)
+        total_items, total_revenue = history.totals()
+        weeks = weeks_loaded(st.session_state.weekly_data)
         avg_weekly_revenue = total_revenue / weeks if weeks else 0
 
         st.markdown(f"""
         <div class="metric-row">
             <div class="metric-card">
-                <div class="value">{weeks}</div>
+                <div class="value">{weeks:.3g}</div>
                 <div class="label">Weeks Loaded</div>
             </div>
             <div class="metric-card">
@@ -800,7 +6583,7 @@ if page == "📊 Sales Dashboard":
                 <div class="label">Avg Items / Week</div>
             </div>
             <div class="metric-card">
-                <div class="value">{weeks * 7}</div>
+                <div class="value">{round(weeks * 7)}</div>
                 <div class="label">Days Analysed</div>
             </div>
         </div>
@@ -921,6 +6704,117 @@ if page == "📊 Sales Dashboard":
             ])
             st.dataframe(proj_df, hide_index=True, use_container_width=True)
 
+        # ── Scenarios ────────────────────────────────────────────────────────
+        st.markdown('<div class="section-header"><span>🎭</span><h2>Scenarios</h2></div>',
+                    unsafe_allow_html=True)
+        st.markdown("Named what-ifs — a game day, a rainy weekend, a private event — with "
+                    "item or category multipliers and extra covers, on top of the sliders. "
+                    "Layered scenarios feed every order built on **Generate Orders**.")
+
+        scenario_store = get_scenario_store()
+        saved_scenarios = scenario_store.load()
+        def set_active_scenarios():
+            st.session_state.active_scenarios = st.session_state.active_scenarios_widget
+
+        # The widget's own key is dropped on pages that don't render it, so the
+        # selection lives in active_scenarios and is copied in on every render
+        st.session_state.active_scenarios = [n for n in st.session_state.active_scenarios
+                                             if n in saved_scenarios]
+        st.session_state.active_scenarios_widget = st.session_state.active_scenarios
+        st.multiselect("Layer onto this week's forecast", list(saved_scenarios),
+                       key="active_scenarios_widget", on_change=set_active_scenarios,
+                       help="Multipliers compound and covers add when several are layered")
+
+        with st.expander("✏️ Create or edit a scenario"):
+            start_options = (["(blank)"] + list(saved_scenarios)
+                             + [f"{name} (template)" for name in SCENARIO_TEMPLATES])
+            start = st.selectbox("Start from", start_options, key="scenario_start")
+            template = start.removesuffix(" (template)")
+            spec = normalize_scenario(
+                saved_scenarios.get(start)
+                or dict(SCENARIO_TEMPLATES.get(template, {}),
+                        name=template if template in SCENARIO_TEMPLATES else ""))
+            with st.form(f"scenario_form_{start}"):
+                name = st.text_input("Name", spec["name"])
+                description = st.text_input("Description", spec["description"])
+                days = st.multiselect("Days it applies to", OPEN_DAYS, default=spec["days"])
+                demand_pct = st.slider("Overall demand on those days", -50, 100,
+                                       int(spec["demand_pct"]), 5, format="%d%%")
+                c1, c2 = st.columns(2)
+                covers = c1.number_input("Extra covers per day", 0, 2000, int(spec["covers"]), 10)
+                items_per_cover = c2.number_input("Items per cover", 0.0, 10.0,
+                                                  spec["items_per_cover"], 0.1)
+                category_rows = st.data_editor(
+                    pd.DataFrame({"Category contains": pd.Series(list(spec["categories"]), dtype=object),
+                                  "Multiplier": pd.Series(list(spec["categories"].values()),
+                                                          dtype=float)}),
+                    num_rows="dynamic", use_container_width=True, key=f"scenario_cats_{start}",
+                    column_config={"Category contains": st.column_config.TextColumn(
+                        help="Matches any Sales Category containing the text, e.g. \"bev\"")})
+                item_rows = st.data_editor(
+                    pd.DataFrame({"Item": pd.Series(list(spec["items"]), dtype=object),
+                                  "Multiplier": pd.Series(list(spec["items"].values()), dtype=float)}),
+                    num_rows="dynamic", use_container_width=True, key=f"scenario_items_{start}",
+                    column_config={"Item": st.column_config.SelectboxColumn(
+                        "Item", options=sorted(map(str, history.items)))})
+                if st.form_submit_button("💾 Save scenario", type="primary"):
+                    if not name.strip():
+                        st.error("Give the scenario a name.")
+                    else:
+                        scenario_store.save({
+                            "name": name, "description": description, "days": days,
+                            "demand_pct": demand_pct, "covers": covers,
+                            "items_per_cover": items_per_cover,
+                            "categories": {str(r["Category contains"]): r["Multiplier"]
+                                           for _, r in category_rows.dropna().iterrows()},
+                            "items": {str(r["Item"]): r["Multiplier"]
+                                      for _, r in item_rows.dropna().iterrows()},
+                        })
+                        st.rerun()
+            if start in saved_scenarios and st.button(f"🗑️ Delete {start}", key="scenario_delete"):
+                scenario_store.delete(start)
+                st.rerun()
+
+        compare_names = st.multiselect("Compare side by side", list(saved_scenarios),
+                                       key="compare_scenarios", max_selections=5)
+        if compare_names or st.session_state.active_scenarios:
+            totals, _, _, totals_history = shared_ingredient_totals(
+                st.session_state.weekly_data, recipes, vendor_mapping,
+                st.session_state.modifier_data)
+            engine = ScenarioEngine(totals_history, weeks_loaded(st.session_state.weekly_data),
+                                    get_recipe_matrix(recipes, vendor_mapping), totals,
+                                    st.session_state.day_adjustments)
+            names = ["Baseline"] + compare_names
+            entries = [[]] + [saved_scenarios[n] for n in compare_names]
+            if len(st.session_state.active_scenarios) > 1 or (
+                    st.session_state.active_scenarios
+                    and st.session_state.active_scenarios[0] not in compare_names):
+                names.append("Layered: " + " + ".join(st.session_state.active_scenarios))
+                entries.append([saved_scenarios[n] for n in st.session_state.active_scenarios])
+            usage, demand = engine.evaluate(entries)
+
+            summary = engine.summary(names, demand)
+            st.dataframe(summary, hide_index=True, use_container_width=True, column_config={
+                "Revenue / week": st.column_config.NumberColumn(format="$%d"),
+                "vs baseline": st.column_config.NumberColumn(format="percent"),
+            })
+
+            week_windows = [w for w in delivery_calendar.windows
+                            if now.date() <= w["order_date"] < now.date() + timedelta(days=7)]
+            orders = engine.compare(names, usage, [(w["vendor"], delivery_calendar.usage_weights(w))
+                                                   for w in week_windows])
+            st.caption(f"Orders placed in the next 7 days ({len(week_windows)} vendor windows, "
+                       f"+10% buffer) under each scenario. Vendor totals add quantities across "
+                       f"units — compare them across columns, not down rows.")
+            st.dataframe(orders.groupby("Vendor")[names].sum().round(1),
+                         use_container_width=True)
+            with st.expander("Per-ingredient order quantities"):
+                vendor_pick = st.selectbox("Vendor", ["All"] + sorted(orders["Vendor"].unique()),
+                                           key="scenario_vendor")
+                st.dataframe(orders if vendor_pick == "All"
+                             else orders[orders["Vendor"] == vendor_pick],
+                             hide_index=True, use_container_width=True)
+
     else:
         st.markdown("""
         <div class="warning-box">
@@ -950,6 +6844,10 @@ elif page == "📋 Generate Orders":
         """, unsafe_allow_html=True)
         st.stop()
 
+    saved_scenarios = get_scenario_store().load()
+    layered_scenarios = [saved_scenarios[n] for n in st.session_state.active_scenarios
+                         if n in saved_scenarios]
+
     # ── Vendor + Order Day Selector ─────────────────────────────────────────
     col1, col2, col3 = st.columns([2, 2, 1])
 
@@ -958,97 +6856,205 @@ elif page == "📋 Generate Orders":
         selected_vendor = st.selectbox("Select Vendor", vendor_options)
 
     vendor_info = vendor_schedules.get(selected_vendor, {})
-    order_options = vendor_info.get("orders", [])
+    window_options = delivery_calendar.vendor_windows(selected_vendor, from_date=now.date())[:8]
 
     with col2:
-        if order_options:
-            order_labels = [
-                f"Order {o['order_day']} → Deliver {o['delivery_day']} "
-                f"(covers {', '.join(o['covers'])})"
-                for o in order_options
-            ]
-            selected_order_idx = st.selectbox("Select Order Window", range(len(order_labels)),
-                                               format_func=lambda i: order_labels[i])
-            selected_order = order_options[selected_order_idx]
+        if window_options:
+            selected_window_idx = st.selectbox(
+                "Select Order Window", range(len(window_options)),
+                format_func=lambda i: (
+                    f"Order {window_options[i]['order_date']:%a %b %d} → "
+                    f"Deliver {window_options[i]['delivery_date']:%a %b %d}"
+                )
+            )
+            selected_window = window_options[selected_window_idx]
+            selected_order = selected_window["order"]
         else:
             st.warning("No schedule configured for this vendor yet.")
             selected_order = None
 
     with col3:
         waste_pct = st.number_input("Waste Buffer %", min_value=0, max_value=30,
-                                     value=10, step=5)
+                                     value=st.session_state.waste_buffers["orders"], step=5)
+        st.session_state.waste_buffers["orders"] = waste_pct
         waste_factor = 1 + waste_pct / 100
 
+    shelf_cap = st.checkbox(
+        "🥑 Cap perishables to shelf life", value=True, key="shelf_cap",
+        help="Perishables only cover days they're still usable; later days move to the "
+             "vendor's next fresh delivery (shelf lives from ingredient_properties.json)"
+    )
+    shelf_life_plan = (get_shelf_life_plan(vendor_schedules, st.session_state.calendar_exceptions,
+                                           calendar_start, 42, recipes, vendor_mapping)
+                       if shelf_cap else None)
+
+    catalog = get_vendor_catalog()
+    cheapest = st.checkbox(
+        "💲 Buy each ingredient from the cheapest eligible vendor", value=False,
+        key="cheapest_vendor", disabled=catalog.prices().empty,
+        help="Uses the price catalog (Settings → Recipes & Vendors). Vendors must deliver often "
+             "enough for the ingredient's shelf life and reach their order minimums."
+    )
+    minimums = {v for v, t in catalog.terms().items() if t.get("order_minimum")}
+    balance = st.checkbox(
+        "⚖️ Balance orders to vendor minimums", value=False, key="balance_minimums",
+        disabled=not minimums or catalog.prices().empty,
+        help="Moves quantity between a vendor's neighbouring orders (e.g. GFS Wed → Sun) so each "
+             "reaches its order minimum. Only lines that keep long enough move, and only to an "
+             "earlier delivery; an order that still falls short joins the one before it."
+    )
+    storage_areas = get_storage_areas().areas()
+    storage_fit = st.checkbox(
+        "🧊 Fit deliveries to storage space", value=False, key="storage_fit",
+        disabled=not storage_areas,
+        help="Projects walk-in, freezer and dry storage use day by day across every vendor's "
+             "deliveries. Stock an overflowing delivery won't use before the vendor's next "
+             "delivery moves to that one. Set this location's capacities in Settings → "
+             "Recipes & Vendors first — nothing is checked until then."
+    ) and bool(storage_areas)
+    price_version = catalog.version if cheapest or balance else None
+    if cheapest:
+        assignment = cheapest_vendor_assignment(
+            shared_ingredient_totals(st.session_state.weekly_data, recipes, vendor_mapping,
+                                     st.session_state.modifier_data)[0],
+            vendor_mapping, vendor_schedules)
+        moved = assignment["table"][assignment["table"]["Vendor"]
+                                    != assignment["table"]["Mapped Vendor"]]
+        with st.expander(f"💲 Vendor assignment — {len(moved)} ingredients moved, "
+                         f"${assignment['weekly_savings']:,.2f}/week saved"):
+            st.dataframe(assignment["table"], hide_index=True, use_container_width=True)
+            if assignment["fees"]:
+                st.caption("Weekly delivery fees: " + ", ".join(
+                    f"{v} ${f:,.2f}" for v, f in assignment["fees"].items()))
+
     if selected_order:
-        coverage_days = selected_order["covers"]
+        coverage_weights = delivery_calendar.usage_weights(selected_window)
+        coverage_days = [f"{d:%a %m/%d}" for d in coverage_weights]
+        open_days = sum(coverage_weights.values())
+        absorbed = selected_window["absorbed"]
 
         st.markdown(f"""
         <div class="info-box">
             📦 <strong>{selected_vendor} — {vendor_info['full_name']}</strong><br>
-            Order by: <strong>{selected_order['order_day']}</strong> &nbsp;|&nbsp;
-            Delivery: <strong>{selected_order['delivery_day']}</strong> &nbsp;|&nbsp;
-            Covers: <strong>{' · '.join(coverage_days)}</strong>
-            ({len(coverage_days)} day{"s" if len(coverage_days) != 1 else ""})
+            Order by: <strong>{selected_window['order_date']:%A %b %d}</strong> &nbsp;|&nbsp;
+            Delivery: <strong>{selected_window['delivery_date']:%A %b %d}</strong> &nbsp;|&nbsp;
+            Covers: <strong>{describe_coverage(coverage_weights)}</strong>
+            ({open_days:g} open day{"s" if open_days != 1 else ""})
             &nbsp;|&nbsp; Buffer: <strong>+{waste_pct}%</strong>
+            {"<br>⚠️ Includes coverage of skipped deliveries: " +
+             ", ".join(f"{d:%a %b %d}" for d in absorbed) if absorbed else ""}
         </div>
         """, unsafe_allow_html=True)
 
+        if layered_scenarios:
+            st.caption("🎭 Scenarios layered onto this order: "
+                       + ", ".join(s["name"] for s in layered_scenarios)
+                       + " (change them on the Sales Dashboard)")
+
         # ── Calculate Button ─────────────────────────────────────────────────
+        window_label = order_window_label(selected_order)
+        fingerprint = order_fingerprint(
+            st.session_state.weekly_data, recipes, vendor_mapping,
+            st.session_state.day_adjustments, selected_vendor,
+            [window_label, selected_window["order_date"], sorted(coverage_weights.items()),
+             shelf_cap, load_ingredient_properties() if shelf_cap else None, layered_scenarios,
+             price_version, balance, storage_fit, storage_areas,
+             load_ingredient_properties()],
+            waste_pct, st.session_state.modifier_data
+        )
+
         if st.button(f"🔢 Calculate {selected_vendor} Order", type="primary",
                      use_container_width=True):
 
-            # Combine all weekly data
-            combined_df = pd.concat(list(st.session_state.weekly_data.values()),
-                                     ignore_index=True)
-
-            # Aggregate item sales across all weeks
-            item_totals = (combined_df.groupby("Item")["Qty sold"]
-                           .sum().reset_index()
-                           .rename(columns={"Qty sold": "Total Qty"}))
-            num_weeks = len(st.session_state.weekly_data)
-            item_totals["Weekly Avg"] = item_totals["Total Qty"] / num_weeks
-
             # Calculate ingredient totals (weekly average basis)
-            ingredient_totals, matched, unmatched = calculate_ingredient_usage(
-                item_totals.rename(columns={"Weekly Avg": "Qty sold"}),
-                recipes,
-                vendor_mapping
+            ingredient_totals, matched, unmatched, history = shared_ingredient_totals(
+                st.session_state.weekly_data, recipes, vendor_mapping,
+                st.session_state.modifier_data
             )
 
-            # Spread weekly ingredient totals by day-of-week weights
-            # Build per-day ingredient usage
-            order_rows = []
-            vendor_ingredients = {
-                ing: data for ing, data in ingredient_totals.items()
-                if data["vendor"] == selected_vendor
+            if cheapest:
+                ingredient_totals = with_vendors(ingredient_totals, assignment["vendors"])
+
+            # Spread weekly ingredient totals by day-of-week weights (and scenarios)
+            usage = scenario_usage(layered_scenarios, ingredient_totals, history,
+                                   st.session_state.weekly_data, recipes, vendor_mapping,
+                                   st.session_state.day_adjustments)
+            # Every vendor's windows are planned together — storage is shared and
+            # minimums trade quantity between a vendor's neighbouring orders
+            plan = plan_orders(
+                OrderBuilder(ingredient_totals, st.session_state.day_adjustments,
+                             waste_factor, usage),
+                delivery_calendar, delivery_calendar.windows, shelf_life_plan,
+                catalog if balance else None, vendor_mapping, storage_areas, storage_fit,
+                now.date())
+            window_key = (selected_vendor, selected_window["order_date"],
+                          selected_window["delivery_date"])
+            order_df = plan["orders"][window_key]
+            label = f"{selected_window['order_date']:%a %m/%d}"
+            moves = plan["moves"]
+            moves = moves[(moves["Vendor"] == selected_vendor)
+                          & ((moves["From"] == label) | (moves["To"] == label))]
+
+            food_unmatched = [u for u in set(unmatched)
+                              if "Food" in str(history.category_of(u))]
+
+            st.session_state.current_order = {
+                "vendor": selected_vendor,
+                "window": window_label,
+                "waste_pct": waste_pct,
+                "coverage_days": coverage_days,
+                "order_date": selected_window["order_date"],
+                "delivery_date": selected_window["delivery_date"],
+                "fingerprint": fingerprint,
+                "order_df": order_df,
+                "ingredient_totals": ingredient_totals,
+                "food_unmatched": food_unmatched,
+                "balanced": plan["balance"].get(window_key),
+                "moves": moves,
+                "storage": (plan["storage"].bottlenecks() if plan["storage"] is not None
+                            else pd.DataFrame()),
+                "recorded_id": None,
             }
 
-            if not vendor_ingredients:
+        current = st.session_state.current_order
+        if current and current["fingerprint"] == fingerprint:
+            order_df = current["order_df"]
+            balanced = current["balanced"]
+            if balanced and balanced["minimum"]:
+                st.caption(f"⚖️ ${balanced['value']:,.2f} of ${balanced['minimum']:,.2f} minimum "
+                           f"— {balanced['status']}")
+            if not current["moves"].empty:
+                with st.expander(f"↔️ {len(current['moves'])} lines moved between "
+                                 f"{selected_vendor} orders"):
+                    st.dataframe(current["moves"].drop(columns="Vendor"), hide_index=True,
+                                 use_container_width=True)
+            bottlenecks = current["storage"]
+            if not bottlenecks.empty:
+                tight = bottlenecks[bottlenecks["Days Over"] > 0]
+                for _, area in tight.iterrows():
+                    st.warning(f"🧊 {area['Area']} is over capacity on {area['Days Over']} "
+                               f"day{'s' if area['Days Over'] != 1 else ''} — peak "
+                               f"{area['Peak %']:.0f}% on {area['Peak Day']} "
+                               f"({area['Largest Lines']})")
+                worst = bottlenecks.iloc[0]
+                with st.expander(f"🧊 Storage — peak {worst['Peak %']:.0f}% of "
+                                 f"{worst['Area']} ({worst['Peak Day']})"):
+                    st.dataframe(bottlenecks, hide_index=True, use_container_width=True)
+
+            if order_df.empty:
                 st.warning(f"No ingredients mapped to {selected_vendor}. "
                            f"Check vendor mapping in Settings.")
             else:
-                for ingredient, data in vendor_ingredients.items():
-                    weekly_qty = data["qty_used"]
-                    row = {"Ingredient": ingredient, "Unit": data["unit"]}
-
-                    total_order = 0
-                    for day in DAY_ORDER:
-                        if day in CLOSED_DAYS:
-                            # Restaurant closed — zero usage
-                            row[DAY_SHORT[day]] = 0.0
-                        else:
-                            adj_factor = 1 + st.session_state.day_adjustments.get(day, 0) / 100
-                            daily_qty = weekly_qty * TYPICAL_WEIGHTS[day] * adj_factor
-                            row[DAY_SHORT[day]] = round(daily_qty, 1)
-                            if day in coverage_days:
-                                total_order += daily_qty
-
-                    row["ORDER QTY"] = round(total_order * waste_factor, 1)
-                    order_rows.append(row)
-
-                order_df = pd.DataFrame(order_rows)
-                order_df = order_df.sort_values("ORDER QTY", ascending=False)
-                order_df = order_df[order_df["ORDER QTY"] > 0]
+                # ── Compare with the previous recorded order ─────────────────
+                ledger = get_order_ledger()
+                previous_id = ledger.previous_order(selected_vendor, window_label,
+                                                    current["delivery_date"])
+                if previous_id:
+                    prev_lines = ledger.lines(previous_id).set_index("Ingredient")["Qty"]
+                    order_df = order_df.assign(
+                        **{"vs Last": (order_df["ORDER QTY"]
+                                       - order_df["Ingredient"].map(prev_lines).fillna(0.0)).round(1)}
+                    )
 
                 # ── Display Order ─────────────────────────────────────────────
                 st.markdown(f"""
@@ -1063,11 +7069,11 @@ elif page == "📋 Generate Orders":
                 # Highlight coverage days
                 display_cols = (["Ingredient"] +
                                 [DAY_SHORT[d] for d in DAY_ORDER] +
-                                ["ORDER QTY", "Unit"])
+                                ["ORDER QTY", "vs Last", "Unit"])
                 display_df = order_df[[c for c in display_cols if c in order_df.columns]]
 
                 # Style the dataframe
-                coverage_short = [DAY_SHORT[d] for d in coverage_days]
+                coverage_short = [DAY_SHORT[DAY_ORDER[d.weekday()]] for d in coverage_weights]
 
                 def highlight_coverage(col):
                     if col.name in coverage_short:
@@ -1075,6 +7081,9 @@ elif page == "📋 Generate Orders":
                     elif col.name == "ORDER QTY":
                         return ["background-color: #dcfce7; font-weight: 700; "
                                 "color: #166534"] * len(col)
+                    elif col.name == "vs Last":
+                        return ["color: #166534" if v > 0 else "color: #b91c1c" if v < 0 else ""
+                                for v in col]
                     return [""] * len(col)
 
                 st.dataframe(
@@ -1093,60 +7102,173 @@ elif page == "📋 Generate Orders":
                 </div>
                 """, unsafe_allow_html=True)
 
+                # ── Runout before the next delivery ───────────────────────────
+                profile = get_demand_profile().snapshot()
+                next_window = min((w for w in delivery_calendar.windows
+                                   if w["vendor"] == selected_vendor
+                                   and w["delivery_date"] > current["delivery_date"]),
+                                  key=lambda w: w["delivery_date"], default=None)
+                with st.expander("⏱️ Will this last until the next delivery?"):
+                    if not profile.dates:
+                        st.info("Fetch orders from the Toast API to build the time-of-day "
+                                "profile this check uses.")
+                    elif next_window is None:
+                        st.info(f"No later {selected_vendor} delivery in the calendar.")
+                    else:
+                        arrival = delivery_arrival(selected_window)
+                        next_arrival = delivery_arrival(next_window)
+                        runout_df = runout_check(
+                            profile, get_recipe_matrix(recipes, vendor_mapping),
+                            current["ingredient_totals"], current["order_df"],
+                            arrival, next_arrival, st.session_state.day_adjustments,
+                            delivery_calendar.closed_dates
+                        )
+                        at_risk = runout_df[runout_df["Shortfall"] > 0]
+                        st.caption(f"Delivery lands {arrival:%a %b %d %H:%M}; the next "
+                                   f"{selected_vendor} delivery lands {next_arrival:%a %b %d %H:%M}. "
+                                   "Assumes nothing is left on the shelf when this one arrives.")
+                        if at_risk.empty:
+                            st.success("Every ingredient lasts until the next delivery.")
+                        else:
+                            st.warning(f"{len(at_risk)} ingredients run out before the next delivery.")
+                            st.dataframe(at_risk, hide_index=True, use_container_width=True)
+
+                # ── Shelf life ────────────────────────────────────────────────
+                if shelf_life_plan:
+                    changes = shelf_life_plan.window_changes(selected_window)
+                    spoilage = shelf_life_plan.spoilage_report(
+                        current["ingredient_totals"], st.session_state.day_adjustments, waste_factor)
+                    spoilage = spoilage[spoilage["Vendor"] == selected_vendor].drop(columns=["Vendor"])
+                    with st.expander(f"🥑 Shelf life — {len(changes)} perishables adjusted"):
+                        if changes.empty:
+                            st.caption("Every perishable in this order stays usable for all "
+                                       "of its covered days.")
+                        else:
+                            st.dataframe(changes, hide_index=True, use_container_width=True)
+                            st.caption("Uncovered days have no delivery fresh enough — prep "
+                                       "from the next delivery or expect to run out.")
+                        if not spoilage.empty:
+                            plan_end = shelf_life_plan.start + timedelta(days=shelf_life_plan.num_days - 1)
+                            st.markdown(f"**Expected {selected_vendor} spoilage, "
+                                        f"{shelf_life_plan.start:%b %d} → {plan_end:%b %d}**")
+                            st.dataframe(spoilage, hide_index=True, use_container_width=True)
+
+                # ── Order History ─────────────────────────────────────────────
+                hcol1, hcol2 = st.columns([1, 2])
+                with hcol1:
+                    if st.button("📒 Save to Order History", use_container_width=True):
+                        current["recorded_id"] = ledger.record(
+                            selected_vendor, window_label,
+                            current["order_date"], current["delivery_date"],
+                            coverage_days,
+                            dict(zip(order_df["Ingredient"],
+                                     zip(order_df["ORDER QTY"], order_df["Unit"]))),
+                            fingerprint, waste_pct
+                        )
+                with hcol2:
+                    if current["recorded_id"]:
+                        st.success(f"Recorded as order #{current['recorded_id']} for "
+                                   f"{current['delivery_date']:%a %b %d} delivery")
+                    elif previous_id:
+                        st.caption("'vs Last' compares with the previous recorded "
+                                   f"{selected_vendor} {window_label} order.")
+
                 # ── Downloads ─────────────────────────────────────────────────
                 st.markdown("**Download Your Order:**")
-                dcol1, dcol2 = st.columns(2)
-
-                # Excel download
-                with dcol1:
-                    import io
-                    buffer = io.BytesIO()
-                    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-                        display_df.to_excel(writer, index=False,
-                                            sheet_name=f"{selected_vendor} Order")
-                        # Summary sheet
-                        pd.DataFrame({
-                            "Detail": ["Vendor", "Delivery Day", "Coverage Days",
-                                       "Order Date", "Waste Buffer", "Items"],
-                            "Value": [vendor_info["full_name"],
-                                      selected_order["delivery_day"],
-                                      ", ".join(coverage_days),
-                                      now.strftime("%Y-%m-%d"),
-                                      f"{waste_pct}%",
-                                      len(order_df)]
-                        }).to_excel(writer, index=False, sheet_name="Summary")
-                    buffer.seek(0)
-
-                    filename = (f"{selected_vendor}_Order_"
-                                f"{selected_order['delivery_day']}_"
-                                f"{now.strftime('%Y%m%d')}.xlsx")
-                    st.download_button(
-                        "📥 Download Excel",
-                        data=buffer,
-                        file_name=filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True
-                    )
-
-                with dcol2:
-                    # Print-friendly view
-                    if st.button("🖨️ Print-Friendly View", use_container_width=True):
-                        st.markdown("""
-                        <div class="info-box">
-                            💡 Use your browser's Print function (Ctrl+P / Cmd+P) to save as PDF.
-                            The sidebar and buttons will be hidden in the printed version.
-                        </div>
-                        """, unsafe_allow_html=True)
+                export_order = {
+                    "vendor": selected_vendor,
+                    "full_name": vendor_info["full_name"],
+                    "color": vendor_info.get("color", "#0f3460"),
+                    "order_date": current["order_date"],
+                    "delivery_date": current["delivery_date"],
+                    "coverage_days": coverage_days,
+                    "order_df": current["order_df"],
+                }
+                lazy_download(
+                    fingerprint, [export_order], ["xlsx", "pdf", "csv", "json"],
+                    file_stem=(f"{selected_vendor}_Order_"
+                               f"{selected_order['delivery_day']}_"
+                               f"{now.strftime('%Y%m%d')}"),
+                    key="order_dl", waste_pct=waste_pct
+                )
 
                 # Show unmatched items
-                food_unmatched = [u for u in set(unmatched)
-                                  if "Food" in str(combined_df[combined_df["Item"] == u]
-                                                    ["Sales Category"].values)]
+                food_unmatched = current["food_unmatched"]
                 if food_unmatched:
                     with st.expander(f"⚠️ {len(food_unmatched)} food items without recipes"):
                         for item in sorted(food_unmatched)[:20]:
                             st.write(f"- {item}")
 
+    # ── Print & Export All Orders ───────────────────────────────────────────
+    st.markdown('<div class="section-header"><span>🖨️</span>'
+                '<h2>Print & Export All Orders</h2></div>',
+                unsafe_allow_html=True)
+
+    pcol1, pcol2, pcol3 = st.columns([2, 2, 1])
+    with pcol1:
+        print_date = st.date_input("Starting Order Day", now.date(), key="print_date")
+    with pcol2:
+        print_span = st.radio("Orders placed", ["That day", "That day + next 6 days"],
+                              horizontal=True, key="print_span")
+    with pcol3:
+        print_counts = st.checkbox("Count sheets", value=True, key="print_counts",
+                                   help="Add an inventory count sheet after each order in PDFs")
+    print_days = [print_date + timedelta(days=i)
+                  for i in range(1 if print_span == "That day" else 7)]
+
+    # Start a week early and run two past the last day so perishables can be
+    # handed between neighbouring windows
+    print_start = print_date - timedelta(days=7)
+    print_calendar = get_delivery_calendar(vendor_schedules, st.session_state.calendar_exceptions,
+                                           print_start, len(print_days) + 21)
+    print_plan = (get_shelf_life_plan(vendor_schedules, st.session_state.calendar_exceptions,
+                                      print_start, len(print_days) + 21, recipes, vendor_mapping)
+                  if shelf_cap else None)
+    due = [w for d in print_days for w in print_calendar.due_on(d)]
+    if not due:
+        st.info(f"No vendor orders are placed on {print_date:%A}.")
+    else:
+        st.caption(f"{len(due)} vendor orders: " + ", ".join(
+            f"{w['vendor']} {w['order_date']:%a}" for w in due))
+
+        def batch_orders():
+            totals, _, _, totals_history = shared_ingredient_totals(
+                st.session_state.weekly_data, recipes, vendor_mapping,
+                st.session_state.modifier_data)
+            if cheapest:
+                totals = with_vendors(totals, assignment["vendors"])
+            usage = scenario_usage(layered_scenarios, totals, totals_history,
+                                   st.session_state.weekly_data, recipes, vendor_mapping,
+                                   st.session_state.day_adjustments)
+            planned = None
+            if balance or storage_fit:
+                planned = plan_orders(
+                    OrderBuilder(totals, st.session_state.day_adjustments, waste_factor, usage),
+                    print_calendar, print_calendar.windows, print_plan,
+                    catalog if balance else None, vendor_mapping, storage_areas, storage_fit,
+                    now.date())["orders"]
+            return [o for d in print_days
+                    for o in build_orders_due(print_calendar, d, totals, vendor_schedules,
+                                              st.session_state.day_adjustments, waste_factor,
+                                              print_plan, usage, planned)]
+
+        batch_key = order_fingerprint(
+            st.session_state.weekly_data, recipes, vendor_mapping,
+            st.session_state.day_adjustments, "ALL",
+            [str(d) for d in print_days] + [st.session_state.calendar_exceptions, shelf_cap,
+                                            load_ingredient_properties() if shelf_cap else None,
+                                            layered_scenarios, price_version, balance,
+                                            storage_fit, storage_areas],
+            waste_pct,
+            st.session_state.modifier_data
+        )
+        lazy_download(
+            batch_key, batch_orders, ["pdf", "pdf_zip", "xlsx", "csv", "json"],
+            file_stem=f"HighDive_Orders_{print_date:%Y%m%d}"
+                      + (f"_to_{print_days[-1]:%Y%m%d}" if len(print_days) > 1 else ""),
+            key="batch_dl", waste_pct=waste_pct, count_sheets=print_counts
+        )
+
     # ── All Vendors Quick Overview ───────────────────────────────────────────
     st.markdown('<div class="section-header"><span>🏪</span>'
                 '<h2>Vendor Schedule Overview</h2></div>',
@@ -1181,6 +7303,470 @@ elif page == "📋 Generate Orders":
         st.info("No vendor schedules configured yet.")
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+# PAGE: DAYPART PREP
+# ─────────────────────────────────────────────────────────────────────────────
+
+elif page == "🕒 Daypart Prep":
+
+    st.markdown('<div class="section-header"><span>🕒</span><h2>Daypart Prep</h2></div>',
+                unsafe_allow_html=True)
+
+    st.markdown("""
+    <div class="info-box">
+        Splits a day's projected ingredient usage into breakfast, lunch and dinner using
+        when each item actually sells, learned from Toast order timestamps. Every Toast
+        fetch adds its business days to the time-of-day profile.
+    </div>
+    """, unsafe_allow_html=True)
+
+    profile = get_demand_profile().snapshot()
+    if not st.session_state.weekly_data or not profile.dates:
+        st.markdown("""
+        <div class="warning-box">
+            ⚠️ Needs sales data and a time-of-day profile. Fetch orders from the Toast API
+            (Settings → Toast API) — Product Mix exports carry no timestamps.
+        </div>
+        """, unsafe_allow_html=True)
+        st.stop()
+
+    first_day, last_day = min(profile.dates), max(profile.dates)
+    st.caption(f"Profile: {len(profile.dates)} business days "
+               f"({datetime.strptime(first_day, '%Y%m%d'):%b %d} → "
+               f"{datetime.strptime(last_day, '%Y%m%d'):%b %d, %Y}) · "
+               f"{profile.bin_minutes}-minute bins")
+
+    pcol1, pcol2 = st.columns([2, 3])
+    with pcol1:
+        prep_date = st.date_input("Prep Day", now.date(), key="prep_date")
+    with pcol2:
+        prep_vendors = st.multiselect("Vendors", list(vendor_schedules.keys()), key="prep_vendors")
+
+    if not delivery_calendar.is_open(prep_date):
+        st.info(f"High Dive is closed on {prep_date:%A, %b %d}.")
+    else:
+        totals = shared_ingredient_totals(st.session_state.weekly_data, recipes,
+                                          vendor_mapping, st.session_state.modifier_data)[0]
+        prep_df = daypart_prep(profile, get_recipe_matrix(recipes, vendor_mapping), totals,
+                               prep_date, st.session_state.day_adjustments)
+        if prep_vendors and not prep_df.empty:
+            prep_df = prep_df[prep_df["Vendor"].isin(prep_vendors)]
+        st.dataframe(prep_df, hide_index=True, use_container_width=True, height=400)
+
+    st.markdown("**Items sold by hour**")
+    hourly = profile.hourly()
+    fig = px.imshow(
+        hourly[[DAY_ORDER.index(d) for d in OPEN_DAYS]],
+        x=[f"{(PROFILE_DAY_START_HOUR + h) % 24:02d}:00" for h in range(hourly.shape[1])],
+        y=[DAY_SHORT[d] for d in OPEN_DAYS],
+        color_continuous_scale="Blues", aspect="auto"
+    )
+    fig.update_layout(height=280, margin=dict(t=20, b=20, l=20, r=20),
+                      plot_bgcolor="white", paper_bgcolor="white")
+    st.plotly_chart(fig, use_container_width=True)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# PAGE: STOCK PROJECTION
+# ─────────────────────────────────────────────────────────────────────────────
+
+elif page == "📦 Stock Projection":
+
+    st.markdown('<div class="section-header"><span>📦</span><h2>Stock Projection</h2></div>',
+                unsafe_allow_html=True)
+
+    st.markdown("""
+    <div class="info-box">
+        Simulates every ingredient's stock day by day — each vendor delivery as Generate
+        Orders would calculate it, projected usage, and spoilage once product passes its
+        shelf life (<code>ingredient_properties.json</code>). With Monte Carlo samples,
+        demand is redrawn from your daily Toast history to give the chance of running out.
+    </div>
+    """, unsafe_allow_html=True)
+
+    if not st.session_state.weekly_data:
+        st.markdown("""
+        <div class="warning-box">
+            ⚠️ No sales data loaded. Upload Product Mix files on the Sales Dashboard first.
+        </div>
+        """, unsafe_allow_html=True)
+        st.stop()
+
+    scol1, scol2, scol3, scol4 = st.columns(4)
+    with scol1:
+        sim_horizon = st.selectbox("Horizon", [14, 21, 28], index=2,
+                                   format_func=lambda d: f"{d} days", key="sim_horizon")
+    with scol2:
+        sim_samples = st.selectbox(
+            "Demand Samples", [1, 500, 1000, 2000], index=2, key="sim_samples",
+            format_func=lambda n: "Expected only" if n == 1 else f"{n:,} simulated runs"
+        )
+    with scol3:
+        sim_waste = st.number_input("Waste Buffer %", min_value=0, max_value=30,
+                                    value=st.session_state.waste_buffers["simulation"],
+                                    step=5, key="sim_waste")
+        st.session_state.waste_buffers["simulation"] = sim_waste
+    with scol4:
+        sim_start = st.date_input("Starting", now.date(), key="sim_start")
+
+    daily_sales = st.session_state.daily_sales
+    if sim_samples > 1:
+        st.caption("Demand variation: " + (
+            "resampled from daily Toast history" if daily_sales is not None and not daily_sales.empty
+            else f"±{DEFAULT_DEMAND_CV:.0%} per day (fetch daily history from Toast for real variation)"))
+
+    if st.button("▶️ Run Simulation", type="primary", use_container_width=True):
+        started = datetime.now()
+        matrix = get_recipe_matrix(recipes, vendor_mapping)
+        history = None
+        if daily_sales is not None and not daily_sales.empty:
+            history = DailyUsageHistory(daily_sales, matrix, st.session_state.daily_modifiers,
+                                        load_modifier_deltas())
+        totals = shared_ingredient_totals(st.session_state.weekly_data, recipes,
+                                          vendor_mapping, st.session_state.modifier_data)[0]
+        sim = run_inventory_simulation(
+            totals, matrix, vendor_schedules, st.session_state.calendar_exceptions,
+            sim_start, int(sim_horizon), st.session_state.day_adjustments,
+            waste_factor=1 + sim_waste / 100, history=history, samples=int(sim_samples)
+        )
+        sim["elapsed"] = (datetime.now() - started).total_seconds()
+        sim["samples"] = int(sim_samples)
+        st.session_state.inventory_sim = sim
+
+    sim = st.session_state.get("inventory_sim")
+    if sim:
+        risk_df = inventory_risk_table(sim)
+        no_vendor = risk_df[risk_df["Delivered"] == 0]
+        risk_df = risk_df[risk_df["Delivered"] > 0]
+        at_risk = risk_df[risk_df["Stockout Risk %"] >= 20]
+
+        st.markdown(f"""
+        <div class="metric-row">
+            <div class="metric-card">
+                <div class="value">{len(at_risk)}</div>
+                <div class="label">Ingredients ≥20% Stockout Risk</div>
+            </div>
+            <div class="metric-card">
+                <div class="value">{int((risk_df["Expected Spoilage"] > 0).sum())}</div>
+                <div class="label">Ingredients Spoiling</div>
+            </div>
+            <div class="metric-card">
+                <div class="value">{sim["samples"]:,} × {len(sim["dates"])}d</div>
+                <div class="label">Runs × Days</div>
+            </div>
+            <div class="metric-card">
+                <div class="value">{sim["elapsed"]:.2f}s</div>
+                <div class="label">Run Time</div>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
+        sim_vendors = st.multiselect("Vendors", sorted(risk_df["Vendor"].unique()),
+                                     key="sim_vendors")
+        if sim_vendors:
+            risk_df = risk_df[risk_df["Vendor"].isin(sim_vendors)]
+        st.dataframe(risk_df, hide_index=True, use_container_width=True, height=360)
+        if not no_vendor.empty:
+            st.caption(f"{len(no_vendor)} ingredients have no scheduled vendor and are never "
+                       "delivered — assign vendors in Settings → Recipes & Vendors.")
+
+        top = risk_df.head(15)
+        if not top.empty and top["Stockout Risk %"].max() > 0:
+            st.markdown("**Chance of running short, by day**")
+            rows = [sim["ingredients"].index(i) for i in top["Ingredient"]]
+            fig = px.imshow(
+                sim["p_short"][rows] * 100,
+                x=[f"{d:%a %m/%d}" for d in sim["dates"]], y=top["Ingredient"].tolist(),
+                color_continuous_scale="Reds", zmin=0, zmax=100, aspect="auto"
+            )
+            fig.update_layout(height=120 + 22 * len(rows), margin=dict(t=20, b=20, l=20, r=20),
+                              plot_bgcolor="white", paper_bgcolor="white")
+            st.plotly_chart(fig, use_container_width=True)
+
+        if not risk_df.empty:
+            sim_ing = st.selectbox("Projected stock for", risk_df["Ingredient"].tolist(),
+                                   key="sim_ingredient")
+            j = sim["ingredients"].index(sim_ing)
+            labels = [f"{d:%a %m/%d}" for d in sim["dates"]]
+            fig = go.Figure()
+            fig.add_bar(x=labels, y=sim["deliveries"][j], name="Delivered", marker_color="#93c5fd")
+            fig.add_scatter(x=labels, y=sim["mean_level"][j], name="End-of-day stock",
+                            line=dict(color="#0f3460", width=3))
+            fig.add_scatter(x=labels, y=sim["expected"][j], name="Expected usage",
+                            line=dict(color="#f59e0b", dash="dot"))
+            fig.update_layout(height=320, margin=dict(t=20, b=20, l=20, r=20),
+                              plot_bgcolor="white", paper_bgcolor="white",
+                              yaxis_title=sim["units"][j])
+            st.plotly_chart(fig, use_container_width=True)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# PAGE: ORDER HISTORY
+# ─────────────────────────────────────────────────────────────────────────────
+
+elif page == "📒 Order History":
+
+    st.markdown('<div class="section-header"><span>📒</span><h2>Order History</h2></div>',
+                unsafe_allow_html=True)
+
+    st.markdown("""
+    <div class="info-box">
+        Every order saved from <strong>Generate Orders</strong> is recorded here with its
+        delivery date and quantities. Recorded orders can't be edited — recalculate and
+        save again to record a revised order.
+    </div>
+    """, unsafe_allow_html=True)
+
+    ledger = get_order_ledger()
+
+    hcol1, hcol2, hcol3 = st.columns([2, 2, 2])
+    with hcol1:
+        history_vendor = st.selectbox("Vendor", ["All vendors"] + list(vendor_schedules.keys()))
+    with hcol2:
+        history_start = st.date_input("Delivered from", now.date() - timedelta(days=90))
+    with hcol3:
+        history_end = st.date_input("Delivered to", now.date() + timedelta(days=14))
+
+    vendor_filter = None if history_vendor == "All vendors" else history_vendor
+    history_df = ledger.orders(vendor_filter, history_start, history_end)
+
+    if history_df.empty:
+        st.markdown("""
+        <div class="warning-box">
+            No recorded orders in this range. Calculate an order and click
+            <strong>📒 Save to Order History</strong> to start the ledger.
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.dataframe(
+            history_df[["order_id", "vendor", "order_window", "order_date",
+                        "delivery_date", "coverage", "waste_pct", "created_at"]]
+            .rename(columns={"order_id": "#", "vendor": "Vendor", "order_window": "Window",
+                             "order_date": "Order Date", "delivery_date": "Delivery",
+                             "coverage": "Covers", "waste_pct": "Buffer %",
+                             "created_at": "Recorded"}),
+            hide_index=True,
+            use_container_width=True
+        )
+
+        selected_id = st.selectbox(
+            "View order",
+            history_df["order_id"].tolist(),
+            format_func=lambda oid: (
+                lambda r: f"#{oid} — {r['vendor']} {r['order_window']} "
+                          f"(delivery {r['delivery_date']:%a %b %d})"
+            )(history_df.set_index("order_id").loc[oid])
+        )
+        selected_row = history_df.set_index("order_id").loc[selected_id]
+        previous_id = ledger.previous_order(selected_row["vendor"], selected_row["order_window"],
+                                            selected_row["delivery_date"])
+        current_lines = ledger.lines(selected_id)
+        diff_df = ledger.compare(dict(zip(current_lines["Ingredient"], current_lines["Qty"])),
+                                 previous_id)
+        diff_df["Unit"] = diff_df["Ingredient"].map(
+            dict(zip(current_lines["Ingredient"], current_lines["Unit"])))
+        if previous_id:
+            st.caption(f"Compared with previous {selected_row['vendor']} "
+                       f"{selected_row['order_window']} order #{previous_id}")
+        else:
+            st.caption("No earlier order for this window — nothing to compare against yet.")
+        st.dataframe(diff_df, hide_index=True, use_container_width=True)
+
+        with st.expander("Total ordered per ingredient in this range"):
+            st.dataframe(ledger.ordered_totals(history_start, history_end, vendor_filter),
+                         hide_index=True, use_container_width=True)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# PAGE: FORECAST ACCURACY
+# ─────────────────────────────────────────────────────────────────────────────
+
+elif page == "🎯 Forecast Accuracy":
+
+    st.markdown('<div class="section-header"><span>🎯</span><h2>Forecast Accuracy Backtest</h2></div>',
+                unsafe_allow_html=True)
+
+    st.markdown("""
+    <div class="info-box">
+        Replays the order calculation on every past order day in your daily sales history
+        — using only the weeks before that day — and compares each vendor order with the
+        ingredient usage that actually followed. Requires daily data from the Toast API
+        (Settings → Toast API → Fetch Date Range), at least a few weeks longer than the
+        lookback period.
+    </div>
+    """, unsafe_allow_html=True)
+
+    daily_sales = st.session_state.daily_sales
+    if daily_sales is None or daily_sales.empty:
+        st.markdown("""
+        <div class="warning-box">
+            ⚠️ No daily sales history loaded. Product Mix exports are weekly totals, so
+            backtesting needs orders fetched from the Toast API.
+        </div>
+        """, unsafe_allow_html=True)
+        st.stop()
+
+    first_day = daily_sales["Business Date"].min()
+    last_day = daily_sales["Business Date"].max()
+    st.caption(f"History: {first_day:%b %d, %Y} → {last_day:%b %d, %Y} "
+               f"({(last_day - first_day).days + 1} days)")
+
+    bcol1, bcol2, bcol3, bcol4 = st.columns(4)
+    with bcol1:
+        bt_lookback = st.number_input("Lookback Weeks", min_value=1, max_value=12, value=4)
+    with bcol2:
+        bt_method = st.selectbox(
+            "Forecast Method", ["weights", "dow"],
+            format_func=lambda m: {"weights": "Weekly avg × day weights (current)",
+                                   "dow": "Same-weekday average"}[m]
+        )
+    with bcol3:
+        bt_waste = st.number_input("Waste Buffer %", min_value=0, max_value=30,
+                                   value=st.session_state.waste_buffers["backtest"],
+                                   step=5, key="bt_waste")
+        st.session_state.waste_buffers["backtest"] = bt_waste
+    with bcol4:
+        bt_workers = st.number_input("Parallel Workers", min_value=1, max_value=16,
+                                     value=min(4, os.cpu_count() or 1))
+
+    if st.button("▶️ Run Backtest", type="primary", use_container_width=True):
+        started = datetime.now()
+        st.session_state.backtest_result = run_backtest(
+            daily_sales, get_recipe_matrix(recipes, vendor_mapping), vendor_schedules,
+            lookback_weeks=int(bt_lookback), waste_factor=1 + bt_waste / 100,
+            method=bt_method, workers=int(bt_workers),
+            unit_costs=get_vendor_catalog().unit_costs(
+                get_recipe_matrix(recipes, vendor_mapping).ingredients,
+                get_vendor_resolver(vendor_mapping), get_recipe_matrix(recipes, vendor_mapping).units),
+            daily_modifiers=st.session_state.daily_modifiers,
+            modifier_deltas=load_modifier_deltas()
+        )
+        st.session_state.backtest_result["elapsed"] = (datetime.now() - started).total_seconds()
+
+    result = st.session_state.get("backtest_result")
+    if result:
+        if result["by_ingredient"].empty:
+            st.warning("Not enough history for the selected lookback — fetch a longer "
+                       "date range or reduce Lookback Weeks.")
+        else:
+            by_vendor = result["by_vendor"]
+            by_week = result["by_week"]
+            overall_wape = result["by_ingredient"]["WAPE %"].median()
+            st.markdown(f"""
+            <div class="metric-row">
+                <div class="metric-card">
+                    <div class="value">{len(by_week)}</div>
+                    <div class="label">Order Windows Replayed</div>
+                </div>
+                <div class="metric-card">
+                    <div class="value">{overall_wape:.1f}%</div>
+                    <div class="label">Median Ingredient Error</div>
+                </div>
+                <div class="metric-card">
+                    <div class="value">{int(result["by_ingredient"]["Short Weeks"].sum())}</div>
+                    <div class="label">Short Ingredient-Weeks</div>
+                </div>
+                <div class="metric-card">
+                    <div class="value">{result["elapsed"]:.2f}s</div>
+                    <div class="label">Run Time</div>
+                </div>
+            </div>
+            """, unsafe_allow_html=True)
+
+            fig = px.bar(by_vendor, x="Vendor", y="Median WAPE %",
+                         color="Median Bias %", color_continuous_scale="RdBu",
+                         color_continuous_midpoint=0)
+            fig.update_layout(height=300, margin=dict(t=20, b=20, l=20, r=20),
+                              plot_bgcolor="white", paper_bgcolor="white")
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("**By Vendor**")
+            st.dataframe(by_vendor.round(1), hide_index=True, use_container_width=True)
+
+            st.markdown("**By Ingredient**")
+            bt_vendor = st.selectbox("Vendor", by_vendor["Vendor"].tolist(), key="bt_vendor")
+            st.dataframe(
+                result["by_ingredient"][result["by_ingredient"]["Vendor"] == bt_vendor]
+                .drop(columns=["Vendor"]).round(2),
+                hide_index=True, use_container_width=True
+            )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# PAGE: DIAGNOSTICS
+# ─────────────────────────────────────────────────────────────────────────────
+
+elif page == "🩺 Diagnostics":
+
+    st.markdown('<div class="section-header"><span>🩺</span><h2>Diagnostics</h2></div>',
+                unsafe_allow_html=True)
+
+    st.markdown("""
+    <div class="info-box">
+        Times every pipeline stage — Toast requests, Excel parsing, aggregation, ingredient
+        usage, order building, exports and page rendering — with row counts, bytes and cache
+        hits. Recording is shared by everyone using the app and costs next to nothing while
+        off. Set <code>HIGHDIVE_TELEMETRY=1</code> to record from startup.
+    </div>
+    """, unsafe_allow_html=True)
+
+    dcol1, dcol2 = st.columns([3, 1])
+    def set_recording():
+        telemetry.enabled = st.session_state.telemetry_on
+
+    st.session_state.telemetry_on = telemetry.enabled    # shared across sessions
+    with dcol1:
+        st.toggle("Record timings", key="telemetry_on", on_change=set_recording)
+    with dcol2:
+        if st.button("🔄 Reset", use_container_width=True):
+            telemetry.reset()
+
+    summary = telemetry.summary()
+    if summary.empty:
+        st.info("Nothing recorded yet — turn on recording, then use the app "
+                "(fetch from Toast, upload files, calculate orders).")
+    else:
+        st.caption(f"Recording since {telemetry.since:%b %d %H:%M:%S} · "
+                   f"{len(telemetry.spans)} recent spans kept")
+        fig = px.bar(summary.head(15), x="Total ms", y="Span", orientation="h",
+                     hover_data=["Calls", "Mean ms", "Max ms", "Rows", "Bytes"])
+        fig.update_layout(height=120 + 24 * min(len(summary), 15),
+                          margin=dict(t=20, b=20, l=20, r=20), yaxis=dict(autorange="reversed"),
+                          plot_bgcolor="white", paper_bgcolor="white")
+        st.plotly_chart(fig, use_container_width=True)
+
+        st.markdown("**By Stage**")
+        st.dataframe(summary, hide_index=True, use_container_width=True)
+
+        counters = telemetry.counter_table()
+        if not counters.empty:
+            st.markdown("**Counters**")
+            st.dataframe(counters, hide_index=True, use_container_width=True)
+
+        with st.expander("Recent spans"):
+            recent = pd.DataFrame(list(telemetry.spans)[-200:][::-1])
+            st.dataframe(recent, hide_index=True, use_container_width=True)
+
+    item_stats = get_item_resolver(recipes).stats
+    st.caption(f"Menu item name cache: {item_stats['hits']:,} hits / "
+               f"{item_stats['misses']:,} misses since startup")
+    shared = get_shared_cache().stats()
+    st.caption(f"Shared dataset cache ({data_location()}): "
+               f"{shared['entries']} entries, {shared['mb']:,.1f} / {shared['max_mb']:,.0f} MB · "
+               f"{shared['hits']:,} hits, {shared['misses']:,} computed, "
+               f"{shared['reloads']:,} reloaded from disk, {shared['evictions']:,} evicted")
+
+    ecol1, ecol2 = st.columns(2)
+    with ecol1:
+        st.download_button("📥 Export JSON", data=telemetry.to_json(),
+                           file_name=f"highdive_telemetry_{now:%Y%m%d_%H%M}.json",
+                           mime="application/json", use_container_width=True)
+    with ecol2:
+        st.download_button("📥 Export Prometheus", data=telemetry.to_prometheus(),
+                           file_name="highdive_metrics.prom", mime="text/plain",
+                           use_container_width=True)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # PAGE: SETTINGS
 # ─────────────────────────────────────────────────────────────────────────────
@@ -1190,7 +7776,8 @@ elif page == "⚙️ Settings":
     st.markdown('<div class="section-header"><span>⚙️</span><h2>System Settings</h2></div>',
                 unsafe_allow_html=True)
 
-    tab1, tab2, tab3 = st.tabs(["🔌 Toast API", "📖 Recipes & Vendors", "📅 Vendor Schedules"])
+    tab1, tab2, tab3, tab4 = st.tabs(["🔌 Toast API", "📖 Recipes & Vendors",
+                                      "📅 Vendor Schedules", "🔗 Name Matching"])
 
     with tab1:
         st.markdown("### Toast POS API Connection")
@@ -1222,22 +7809,10 @@ elif page == "⚙️ Settings":
             
             with col2:
                 if st.button("📥 Fetch Last 4 Weeks", use_container_width=True):
-                    with st.spinner("Fetching orders from Toast (this may take a minute)..."):
-                        try:
-                            end_date = datetime.now()
-                            start_date = end_date - timedelta(days=28)
-                            
-                            orders = toast_client.get_orders_for_date_range(start_date, end_date)
-                            
-                            if orders:
-                                df = aggregate_toast_orders_to_product_mix(orders)
-                                st.session_state.weekly_data["Toast API (Last 4 Weeks)"] = df
-                                st.success(f"✅ Loaded {len(orders)} orders → {len(df)} menu items")
-                                st.session_state.toast_connected = True
-                            else:
-                                st.warning("No orders found in the last 4 weeks")
-                        except Exception as e:
-                            st.error(f"❌ Error: {e}")
+                    end_date = datetime.now().date()
+                    start_fetch_job(toast_client, "Toast API (Last 4 Weeks)",
+                                    end_date - timedelta(days=28), end_date)
+                    st.rerun()
             
             st.markdown("---")
             st.markdown("**Fetch Specific Date Range:**")
@@ -1249,21 +7824,16 @@ elif page == "⚙️ Settings":
                 fetch_end = st.date_input("End Date", datetime.now())
             
             if st.button("📅 Fetch Date Range"):
-                with st.spinner(f"Fetching orders from {fetch_start} to {fetch_end}..."):
-                    try:
-                        orders = toast_client.get_orders_for_date_range(
-                            datetime.combine(fetch_start, datetime.min.time()),
-                            datetime.combine(fetch_end, datetime.max.time())
-                        )
-                        if orders:
-                            df = aggregate_toast_orders_to_product_mix(orders)
-                            label = f"Toast {fetch_start} to {fetch_end}"
-                            st.session_state.weekly_data[label] = df
-                            st.success(f"✅ Loaded {len(orders)} orders → {len(df)} items")
-                        else:
-                            st.warning("No orders found in that date range")
-                    except Exception as e:
-                        st.error(f"❌ Error: {e}")
+                if fetch_end < fetch_start:
+                    st.error("End date is before start date")
+                else:
+                    start_fetch_job(toast_client, f"Toast {fetch_start} to {fetch_end}",
+                                    fetch_start, fetch_end)
+                    st.rerun()
+
+            st.caption("Fetches run in the background, one business date at a time — "
+                       "progress shows in the sidebar and each finished day is added to "
+                       "your data right away, so you can keep working while it loads.")
         
         else:
             st.warning("⚠️ Toast API credentials not configured")
@@ -1287,6 +7857,41 @@ elif page == "⚙️ Settings":
             - Email: **apisupport@toasttab.com**
             """)
 
+        with st.expander("📡 Live order feed (Toast webhooks)"):
+            if webhook_receiver is None:
+                st.caption("Receiver off — set HIGHDIVE_WEBHOOK_PORT (and HIGHDIVE_WEBHOOK_SECRET "
+                           "to check Toast-Signature) and restart the app.")
+            elif isinstance(webhook_receiver, dict):
+                st.error(f"Receiver failed to start: {webhook_receiver['error']}")
+            else:
+                host, port = webhook_receiver.server_address[:2]
+                st.caption(f"Listening on http://{host}:{port}{WEBHOOK_PATH}"
+                           + (" · signatures checked" if WEBHOOK_SECRET else ""))
+            stats = live_orders.stats
+            st.caption(", ".join(f"{v:,} {k}" for k, v in stats.items())
+                       + (f" · last event {live_orders.last_event:%H:%M:%S}"
+                          if live_orders.last_event else " · no events since startup"))
+
+            live_date = st.date_input("Business date", now.date(), key="live_date")
+            live_orders.attach_matrix(get_recipe_matrix(recipes, vendor_mapping))
+            live_items = live_orders.daily_sales(live_date, live_date)
+            if live_items.empty:
+                st.info("No live orders for this date yet.")
+            else:
+                st.markdown(f"**{live_orders.order_count(live_date):,} orders, "
+                            f"{live_items['Qty sold'].sum():,.0f} items, "
+                            f"${live_items['Net sales'].sum():,.2f}**")
+                lcol1, lcol2 = st.columns(2)
+                with lcol1:
+                    st.dataframe(live_items[["Item", "Qty sold", "Net sales"]]
+                                 .sort_values("Qty sold", ascending=False),
+                                 hide_index=True, use_container_width=True, height=300)
+                with lcol2:
+                    st.dataframe(live_orders.theoretical_usage(live_date),
+                                 hide_index=True, use_container_width=True, height=300)
+                st.caption("Live counts fill business dates no Toast pull has loaded into "
+                           "daily sales; a pull of the same date replaces them.")
+
     with tab2:
         col1, col2 = st.columns(2)
 
@@ -1298,6 +7903,25 @@ elif page == "⚙️ Settings":
                 for recipe_name, ingredients in sorted(recipes.items()):
                     st.markdown(f"**{recipe_name}** — {len(ingredients)} ingredients")
 
+            with st.expander("Modifier adjustments"):
+                modifier_deltas = load_modifier_deltas()
+                st.caption("Loaded from modifier_deltas.json. Modifiers not listed fall back to "
+                           "prefix rules (No/Add/Extra/Light) against the item's recipe.")
+                for key, deltas in sorted(modifier_deltas.items()):
+                    st.markdown(f"**{key}** — " + ", ".join(
+                        f"{ing} {d['qty']:+g} {d.get('unit', '')}".strip()
+                        for ing, d in deltas.items()))
+                loaded_mods = [st.session_state.modifier_data[label]
+                               for label in st.session_state.weekly_data
+                               if label in st.session_state.modifier_data]
+                if loaded_mods:
+                    _, unmatched_mods = modifier_usage(
+                        pd.concat(loaded_mods, ignore_index=True),
+                        get_recipe_matrix(recipes, vendor_mapping), modifier_deltas)
+                    if unmatched_mods:
+                        st.warning(f"{len(unmatched_mods)} modifiers have no ingredient effect: "
+                                   + ", ".join(unmatched_mods[:15]))
+
             st.markdown("**Update Recipes:**")
             new_plate_cost = st.file_uploader(
                 "Upload updated plate cost file",
@@ -1305,8 +7929,29 @@ elif page == "⚙️ Settings":
                 key="recipe_upload"
             )
             if new_plate_cost:
-                st.info("Recipe import will process the new plate cost file.")
-                st.button("🔄 Import Recipes from File", type="primary")
+                try:
+                    _, parsed = import_plate_cost(new_plate_cost.getvalue())
+                except Exception as e:
+                    st.error(f"Couldn't read {new_plate_cost.name}: {e}")
+                else:
+                    diff = diff_recipes(recipes, parsed)
+                    st.info(f"**{len(parsed)} recipes** in {new_plate_cost.name} — "
+                            f"{len(diff['added'])} new, {len(diff['changed'])} changed, "
+                            f"{diff['unchanged']} unchanged, {len(diff['removed'])} current "
+                            f"recipes not in the file")
+                    if not diff["lines"].empty:
+                        with st.expander(f"Changes ({len(diff['lines'])} lines)"):
+                            st.dataframe(diff["lines"], hide_index=True, use_container_width=True)
+                    remove_missing = st.checkbox(
+                        f"Remove the {len(diff['removed'])} recipes missing from the file",
+                        value=False, key="recipe_remove_missing",
+                        disabled=not diff["removed"])
+                    pending = diff["added"] or diff["changed"] or (remove_missing and diff["removed"])
+                    if st.button("🔄 Import Recipes from File", type="primary",
+                                 disabled=not pending):
+                        apply_recipe_import(recipes, parsed, diff, vendor_mapping,
+                                            remove_missing)
+                        st.rerun()
 
         with col2:
             st.markdown("### Vendor Mapping")
@@ -1321,19 +7966,195 @@ elif page == "⚙️ Settings":
 
             unmapped = vm_counts.get("UNMAPPED", 0)
             if unmapped > 0:
-                st.warning(f"{unmapped} ingredients need vendor assignment")
-                st.markdown("Download and edit the vendor mapping file, then re-upload:")
-                try:
-                    vm_path = Path(__file__).parent / "vendor_mapping_smart.json"
-                    with open(vm_path) as f:
-                        st.download_button(
-                            "📥 Download Vendor Mapping",
-                            data=f.read(),
-                            file_name="vendor_mapping.json",
-                            mime="application/json"
-                        )
-                except FileNotFoundError:
-                    st.info("Vendor mapping file not found locally")
+                st.warning(f"{unmapped} ingredients need vendor assignment — "
+                           "assign them in the editor below")
+
+            mapping_store = get_vendor_mapping_store()
+            vendor_choices = sorted(set(vendor_schedules) | set(vendor_mapping.values())
+                                    | {"UNMAPPED"})
+            with st.expander("✏️ Edit vendor mapping"):
+                matrix = get_recipe_matrix(recipes, vendor_mapping)
+                names = list(dict.fromkeys(list(vendor_mapping) + [
+                    i for i, v in zip(matrix.ingredients, matrix.vendors)
+                    if v == "UNMAPPED" and i.lower() not in vendor_mapping.index.ids]))
+                fc1, fc2 = st.columns([3, 2])
+                name_filter = fc1.text_input("Ingredient contains (or a * pattern)",
+                                             key="vm_filter")
+                vendor_filter = fc2.selectbox("Vendor", ["All vendors"] + vendor_choices,
+                                              key="vm_vendor_filter")
+                shown = [n for n, hit in zip(names, mapping_rule_matches(name_filter, names)
+                                             if name_filter.strip() else [True] * len(names))
+                         if hit and (vendor_filter == "All vendors"
+                                     or vendor_mapping.get(n, "UNMAPPED") == vendor_filter)]
+                mapping_df = pd.DataFrame({
+                    "Ingredient": pd.Series(shown, dtype=object),
+                    "Vendor": pd.Series([vendor_mapping.get(n, "UNMAPPED") for n in shown],
+                                        dtype=object),
+                    "Source": pd.Series([vendor_mapping.sources.get(n, "recipe only")
+                                         for n in shown], dtype=object),
+                })
+                edited_mapping = st.data_editor(
+                    mapping_df, hide_index=True, use_container_width=True,
+                    disabled=["Ingredient", "Source"], key="vm_editor",
+                    column_config={"Vendor": st.column_config.SelectboxColumn(
+                        "Vendor", options=vendor_choices, required=True)})
+                mapping_note = st.text_input("Note for this change", key="vm_note")
+                bc1, bc2 = st.columns(2)
+                if bc1.button("💾 Save mapping edits", key="vm_save", use_container_width=True):
+                    changed = {row["Ingredient"]: row["Vendor"]
+                               for (_, row), was in zip(edited_mapping.iterrows(),
+                                                        mapping_df["Vendor"])
+                               if row["Vendor"] != was}
+                    if mapping_store.save(changed, note=mapping_note):
+                        st.rerun()
+                    st.info("Nothing changed")
+                bulk_vendor = bc2.selectbox("Assign all shown to", vendor_choices,
+                                            key="vm_bulk_vendor", label_visibility="collapsed")
+                if bc2.button(f"↪️ Assign {len(shown)} shown to {bulk_vendor}", key="vm_bulk",
+                              disabled=not shown, use_container_width=True):
+                    if mapping_store.save({n: bulk_vendor for n in shown},
+                                          note=mapping_note or f"Bulk: {name_filter} → {bulk_vendor}"):
+                        st.rerun()
+                    st.info("Nothing changed")
+
+            with st.expander("🧩 Pattern rules"):
+                st.caption("Rules apply to every ingredient in the mapping file — the first "
+                           "matching rule wins, and individual edits win over rules. A pattern "
+                           "matches ingredient names containing it (\"lettuce\"), or use * and ? "
+                           "as wildcards (\"*greens\").")
+                rules = mapping_store.rules()
+                rules_df = pd.DataFrame({
+                    "Pattern": pd.Series([p for p, _ in rules], dtype=object),
+                    "Vendor": pd.Series([v for _, v in rules], dtype=object),
+                })
+                edited_rules = st.data_editor(
+                    rules_df, hide_index=True, use_container_width=True, num_rows="dynamic",
+                    key="vm_rules",
+                    column_config={"Vendor": st.column_config.SelectboxColumn(
+                        "Vendor", options=vendor_choices)})
+                edited_rules = edited_rules.dropna()
+                load_file = load_vendor_mapping()
+                for _, rule in edited_rules.iterrows():
+                    st.caption(f"`{rule['Pattern']}` → {rule['Vendor']}: "
+                               f"{int(mapping_rule_matches(rule['Pattern'], load_file).sum())} "
+                               "ingredients")
+                if st.button("💾 Save rules", key="vm_rules_save"):
+                    if mapping_store.save(rules=list(zip(edited_rules["Pattern"],
+                                                         edited_rules["Vendor"])),
+                                          note=st.session_state.get("vm_note", "")):
+                        st.rerun()
+                    st.info("Nothing changed")
+
+            with st.expander("🕘 Mapping history"):
+                history_df = mapping_store.history()
+                if history_df.empty:
+                    st.caption("No in-app changes yet — the mapping is vendor_mapping_smart.json "
+                               "as deployed.")
+                else:
+                    st.dataframe(history_df, hide_index=True, use_container_width=True)
+                    picked = st.selectbox("Version", history_df["Version"].tolist(),
+                                          key="vm_version")
+                    st.dataframe(mapping_store.changes(picked), hide_index=True,
+                                 use_container_width=True)
+                    rc1, rc2 = st.columns(2)
+                    if rc1.button(f"⏪ Revert to version {picked}", key="vm_revert",
+                                  use_container_width=True,
+                                  help="Undo every change saved after it (saved as a new version)"):
+                        mapping_store.revert(picked)
+                        st.rerun()
+                    if rc2.button("⏮️ Revert all in-app changes", key="vm_revert_all",
+                                  use_container_width=True):
+                        mapping_store.revert(0)
+                        st.rerun()
+                st.download_button(
+                    "📥 Download Vendor Mapping", data=json.dumps(dict(vendor_mapping), indent=1),
+                    file_name="vendor_mapping.json", mime="application/json",
+                    key="vm_download")
+
+            with st.expander("💲 Vendor price catalog"):
+                catalog = get_vendor_catalog()
+                st.caption("Upload vendor price sheets (CSV or Excel) with an item/description "
+                           "column, a price column and a pack size (units per pack); lines without "
+                           "a pack size aren't priced. A unit column (lb, oz, gal, each…) is "
+                           "converted to each recipe's unit — lines whose unit can't be are "
+                           "skipped. An ingredient column is optional. Each upload replaces "
+                           "that vendor's previous sheet. Unmatched lines can be aliased on the "
+                           "Name Matching tab.")
+                price_files = st.file_uploader("Price sheets", type=["csv", "xlsx", "xls"],
+                                               accept_multiple_files=True, key="price_upload")
+                sheet_vendor = st.selectbox(
+                    "Vendor", ["From the sheet's vendor column"] + sorted(vendor_schedules),
+                    key="price_vendor")
+                if price_files and st.button("📥 Import Price Sheets", key="price_import"):
+                    resolver = get_vendor_resolver(vendor_mapping)
+                    for pf in price_files:
+                        try:
+                            lines = parse_price_sheet(pf)
+                        except ValueError as e:
+                            st.error(str(e))
+                            continue
+                        if sheet_vendor in vendor_schedules:
+                            groups = [(sheet_vendor, lines)]
+                        elif "vendor" in lines:
+                            groups = list(lines.groupby("vendor"))
+                        else:
+                            st.error(f"{pf.name}: pick a vendor — the sheet has no vendor column")
+                            continue
+                        for vendor, vendor_lines in groups:
+                            stored, matched = catalog.ingest(vendor, vendor_lines, pf.name, resolver)
+                            st.success(f"✅ {vendor}: {stored} lines from {pf.name}, "
+                                       f"{matched} matched to ingredients")
+                st.dataframe(catalog.summary(), hide_index=True, use_container_width=True)
+                if st.button("🔁 Re-match all lines", key="price_reindex",
+                             help="After adding aliases on the Name Matching tab"):
+                    catalog.reindex(get_vendor_resolver(vendor_mapping))
+                    st.rerun()
+
+                st.markdown("**Order minimums & delivery fees**")
+                terms = catalog.terms()
+                terms_df = pd.DataFrame([{
+                    "Vendor": v,
+                    "Order minimum ($)": terms.get(v, {}).get("order_minimum", 0.0),
+                    "Delivery fee ($)": terms.get(v, {}).get("delivery_fee", 0.0),
+                    "Free delivery over ($)": terms.get(v, {}).get("free_delivery"),
+                } for v in sorted(set(vendor_schedules) | set(terms))])
+                edited_terms = st.data_editor(
+                    terms_df, hide_index=True, use_container_width=True, key="vendor_terms",
+                    disabled=["Vendor"],
+                    column_config={"Free delivery over ($)": st.column_config.NumberColumn(
+                        help="Leave empty when the fee always applies")})
+                if st.button("💾 Save terms", key="vendor_terms_save"):
+                    for _, row in edited_terms.iterrows():
+                        catalog.set_terms(row["Vendor"], row["Order minimum ($)"],
+                                          row["Delivery fee ($)"], row["Free delivery over ($)"])
+                    st.success("Vendor terms saved")
+
+            with st.expander("🧊 Storage areas"):
+                storage_store = get_storage_areas()
+                st.caption(f"Usable shelf space at this location ({data_location()}). Ingredients "
+                           "are assigned an area by \"storage\" in ingredient_properties.json "
+                           "(per ingredient, or a vendor default) and take up \"unit_liters\" "
+                           "per recipe unit — estimated from the unit when not set, so set it "
+                           "for bulky lines. Storage isn't projected or enforced until an area "
+                           "has a capacity; an area left blank or at zero isn't checked.")
+                areas = storage_store.areas()
+                areas_df = pd.DataFrame(
+                    [{"Area": a, "Name": d["name"], "Capacity (L)": d["capacity_liters"]}
+                     for a, d in areas.items()]
+                    or [{"Area": a, "Name": name, "Capacity (L)": None}
+                        for a, name in STORAGE_AREA_TEMPLATE.items()])
+                areas_df["Capacity (L)"] = areas_df["Capacity (L)"].astype(float)
+                edited_areas = st.data_editor(
+                    areas_df, hide_index=True, use_container_width=True, num_rows="dynamic",
+                    key="storage_areas_editor",
+                    column_config={"Area": st.column_config.TextColumn(
+                        help="Key used by \"storage\" in ingredient_properties.json, e.g. walk_in")})
+                if st.button("💾 Save storage areas", key="storage_areas_save"):
+                    for _, row in edited_areas.dropna(subset=["Area"]).iterrows():
+                        storage_store.set_area(
+                            row["Area"], row["Name"] if pd.notna(row["Name"]) else row["Area"],
+                            row["Capacity (L)"] if pd.notna(row["Capacity (L)"]) else 0.0)
+                    st.success("Storage areas saved")
 
     with tab3:
         st.markdown("### Vendor Delivery Schedules")
@@ -1341,6 +8162,7 @@ elif page == "⚙️ Settings":
         <div class="info-box">
             These schedules determine which days each order covers. Currently loaded from
             <code>vendor_schedules.json</code>. Contact your developer to update.
+            Holidays and one-off skips below are applied to the dated order windows.
         </div>
         """, unsafe_allow_html=True)
 
@@ -1356,6 +8178,7 @@ elif page == "⚙️ Settings":
                             f"- **Order {o['order_day']}** → "
                             f"Delivery {o['delivery_day']} → "
                             f"Covers: *{covers_str}*"
+                            + (f" · {o['cover_days']:g}-day supply" if o.get("cover_days") else "")
                         )
                 else:
                     st.warning("⚠️ No schedule configured yet — "
@@ -1363,6 +8186,178 @@ elif page == "⚙️ Settings":
                     if v_data.get("note"):
                         st.info(v_data["note"])
 
+        st.markdown("### Upcoming Calendar")
+        calendar_rows = []
+        for i in range(14):
+            d = now.date() + timedelta(days=i)
+            calendar_rows.append({
+                "Date": f"{d:%a %b %d}",
+                "Open": "✅" if delivery_calendar.is_open(d) else "🔴 Closed",
+                "Orders Due": ", ".join(w["vendor"] for w in delivery_calendar.due_on(d)),
+                "Deliveries": ", ".join(w["vendor"] for w in delivery_calendar.deliveries_on(d)),
+            })
+        st.dataframe(pd.DataFrame(calendar_rows), hide_index=True, use_container_width=True)
+
+        st.markdown("### Holidays, Closures & Skipped Deliveries")
+        exceptions = st.session_state.calendar_exceptions
+        exception_store = get_calendar_exception_store()
+        ecol1, ecol2, ecol3 = st.columns([2, 2, 1])
+        with ecol1:
+            exc_date = st.date_input("Date", now.date() + timedelta(days=7), key="exc_date")
+        with ecol2:
+            exc_kind = st.selectbox("Type", list(CALENDAR_EXCEPTION_KINDS),
+                                    format_func=CALENDAR_EXCEPTION_KINDS.get, key="exc_kind")
+            exc_vendor = ""
+            if exc_kind != "closed":
+                exc_vendor = st.selectbox(
+                    "Vendor",
+                    (["ALL"] if exc_kind == "holiday" else []) + list(vendor_schedules.keys()),
+                    key="exc_vendor"
+                )
+        with ecol3:
+            st.markdown("<br>", unsafe_allow_html=True)
+            if st.button("➕ Add", use_container_width=True):
+                exception_store.add(exc_kind, exc_date.isoformat(), exc_vendor)
+                st.rerun()
+
+        saved_exceptions = calendar_exception_rows(exceptions)
+        if saved_exceptions:
+            rcol1, rcol2 = st.columns([4, 1])
+            with rcol1:
+                to_remove = st.multiselect(
+                    "Remove", saved_exceptions, key="exc_remove",
+                    format_func=lambda r: (f"{r[2]} · {CALENDAR_EXCEPTION_KINDS[r[0]]}"
+                                           + (f" · {r[1]}" if r[1] else "")))
+            with rcol2:
+                st.markdown("<br>", unsafe_allow_html=True)
+                if st.button("🗑️ Remove", disabled=not to_remove, use_container_width=True,
+                             key="exc_remove_btn"):
+                    for kind, vendor, date in to_remove:
+                        exception_store.remove(kind, date, vendor)
+                    st.rerun()
+
+        if delivery_calendar.skipped:
+            st.markdown("**Skipped deliveries** (coverage moved to the vendor's previous delivery):")
+            for w in delivery_calendar.skipped:
+                st.markdown(f"- {w['vendor']} {w['delivery_date']:%a %b %d}")
+        st.json(exceptions, expanded=False)
+        st.download_button(
+            "📥 Download calendar_exceptions.json",
+            data=json.dumps(exceptions, indent=2),
+            file_name="calendar_exceptions.json",
+            mime="application/json"
+        )
+
+
+    with tab4:
+        st.markdown("### Name Matching")
+        st.markdown("""
+        <div class="info-box">
+            Toast item names are matched to recipes ignoring case, punctuation, quantities
+            ("12oz"), "Reg" / "Single" and word order. Portion sizes ("Lg", "(Half)",
+            "Double") are not ignored, since they change usage. Items that still don't match are listed
+            here with the closest recipes — save an alias once and it is used for every
+            future calculation.
+        </div>
+        """, unsafe_allow_html=True)
+
+        alias_store = get_alias_store()
+        item_resolver = get_item_resolver(recipes)
+        vendor_resolver = get_vendor_resolver(vendor_mapping)
+
+        histories = []
+        if st.session_state.weekly_data:
+            histories.append(sales_history(st.session_state.weekly_data))
+        if st.session_state.daily_sales is not None:
+            histories.append(SalesHistory.from_daily(st.session_state.daily_sales))
+
+        mcol1, mcol2 = st.columns(2)
+
+        with mcol1:
+            st.markdown("**Menu items → recipes**")
+            if not histories:
+                st.info("Load sales data to see unmatched menu items.")
+            else:
+                item_qty = (pd.concat([pd.Series(h.item_totals(), index=h.items) for h in histories])
+                            .groupby(level=0).sum())
+                resolved = item_resolver.resolve_many(item_qty.index)
+                unmatched_qty = item_qty[resolved.isna().to_numpy()].sort_values(ascending=False)
+                fuzzy_hits = [(n, r) for n, r in zip(item_qty.index, resolved)
+                              if pd.notna(r) and str(n).strip().upper() != r.upper()]
+
+                if unmatched_qty.empty:
+                    st.success("✅ Every menu item matches a recipe")
+                else:
+                    st.caption(f"{len(unmatched_qty)} unmatched items, "
+                               f"{unmatched_qty.sum():,.0f} units sold")
+                    alias_item = st.selectbox(
+                        "Unmatched item", unmatched_qty.index.tolist(),
+                        format_func=lambda n: f"{n} ({unmatched_qty[n]:,.0f} sold)",
+                        key="alias_item"
+                    )
+                    suggestions = item_resolver.suggest(alias_item)
+                    options = ([t for t, _ in suggestions]
+                               + sorted(t for t in recipes if t not in dict(suggestions)))
+                    scores = dict(suggestions)
+                    alias_target = st.selectbox(
+                        "Recipe", options,
+                        format_func=lambda t: f"{t} — {scores[t]:.0%} match" if t in scores else t,
+                        key="alias_item_target"
+                    )
+                    if st.button("🔗 Save Item Alias", key="save_item_alias"):
+                        save_name_alias("item", item_resolver, alias_item, alias_target)
+                        st.rerun()
+
+                if fuzzy_hits:
+                    with st.expander(f"{len(fuzzy_hits)} items matched by normalized name"):
+                        st.dataframe(pd.DataFrame(fuzzy_hits, columns=["Menu Item", "Recipe"]),
+                                     hide_index=True, use_container_width=True)
+
+        with mcol2:
+            st.markdown("**Recipe ingredients → vendor mapping**")
+            ingredients_all = sorted({i for r in recipes.values() for i in r
+                                      if not is_recipe_meta_line(i)})
+            unmapped_ings = [i for i in ingredients_all
+                             if resolve_vendor(i, vendor_mapping, vendor_resolver) == "UNMAPPED"
+                             and vendor_resolver.resolve(i) is None]
+            if not unmapped_ings:
+                st.success("✅ Every ingredient has a vendor mapping entry")
+            else:
+                st.caption(f"{len(unmapped_ings)} ingredients missing from the vendor mapping")
+                alias_ing = st.selectbox("Ingredient", unmapped_ings, key="alias_ing")
+                ing_suggestions = vendor_resolver.suggest(alias_ing)
+                ing_scores = dict(ing_suggestions)
+                ing_options = ([t for t, _ in ing_suggestions]
+                               + sorted(t for t in vendor_mapping if t not in ing_scores))
+                alias_ing_target = st.selectbox(
+                    "Mapping entry", ing_options,
+                    format_func=lambda t: (f"{t} → {vendor_mapping[t]}"
+                                           + (f" — {ing_scores[t]:.0%} match"
+                                              if t in ing_scores else "")),
+                    key="alias_ing_target"
+                )
+                if st.button("🔗 Save Ingredient Alias", key="save_ing_alias"):
+                    save_name_alias("ingredient", vendor_resolver, alias_ing, alias_ing_target)
+                    st.rerun()
+
+        st.markdown("**Saved aliases**")
+        saved = ([("Menu item", a, t) for a, t in alias_store.load("item").items()]
+                 + [("Ingredient", a, t) for a, t in alias_store.load("ingredient").items()])
+        if not saved:
+            st.caption("No aliases saved yet.")
+        else:
+            st.dataframe(pd.DataFrame(saved, columns=["Kind", "Name", "Matches"]),
+                         hide_index=True, use_container_width=True)
+            remove_alias = st.selectbox("Remove alias", range(len(saved)),
+                                        format_func=lambda i: f"{saved[i][1]} → {saved[i][2]}",
+                                        key="remove_alias")
+            if st.button("🗑️ Remove Alias"):
+                kind_label, alias_name, _ = saved[remove_alias]
+                kind = "item" if kind_label == "Menu item" else "ingredient"
+                alias_store.remove(kind, alias_name)
+                (item_resolver if kind == "item" else vendor_resolver).remove_alias(alias_name)
+                st.rerun()
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # PAGE: HELP
@@ -1382,9 +8377,12 @@ elif page == "❓ Help":
             - Export from Toast: Reports → Product Mix → Last 7 days → Export Excel
             - Upload up to 4 weeks for best accuracy
         3. **Review projections** — adjust sliders for weather/events
+            - Save named **Scenarios** (game day, rainy weekend, private event) and
+              layer them onto the forecast, or compare up to five side by side
         4. **Generate each vendor's order:**
             - Generate Orders → Select vendor → Select order window → Calculate
-            - Download Excel or use Print View for PDF
+            - Pick a format (Excel, PDF, CSV, JSON) → Prepare Download → Download
+            - Or export every order due this day or week under **Print & Export All Orders**
         5. **Walk the restaurant** with printed orders, verify inventory
         6. **Place orders** with each vendor
 
@@ -1434,6 +8432,53 @@ elif page == "❓ Help":
         typical restaurant day-of-week weights. The API provides actual daily breakdowns.
         """)
 
+    with st.expander("🕒 Daypart Prep & Runout Checks"):
+        st.markdown("""
+        Toast orders carry the time each item was rung in. Every Toast fetch adds its
+        business days to a time-of-day profile (15-minute bins per item and weekday);
+        fetching a day again replaces it rather than counting it twice.
+
+        - **Daypart Prep** splits a day's projected ingredient usage into breakfast,
+          lunch and dinner
+        - **Generate Orders → Will this last until the next delivery?** walks usage from
+          this delivery's arrival to the vendor's next one and shows when anything runs out
+
+        Deliveries are assumed to land at 10:00 — add `"delivery_time": "HH:MM"` to an
+        order entry in `vendor_schedules.json` to change it.
+        """)
+
+    with st.expander("🥑 Perishables & Shelf Life"):
+        st.markdown("""
+        With **Cap perishables to shelf life** on (Generate Orders), a perishable only covers
+        the days it's still usable after delivery:
+
+        - Days past its shelf life move to the vendor's next delivery that lands in time
+        - If no delivery is fresh enough, the day is left **uncovered** instead of ordered to spoil
+        - The 🥑 panel under each order lists the changes and the vendor's expected spoilage
+
+        Shelf lives are set in `ingredient_properties.json` — per ingredient, with a default
+        per vendor. Ingredients without one are treated as non-perishable.
+        """)
+
+    with st.expander("📦 Stock Projection"):
+        st.markdown("""
+        Steps every ingredient through the coming weeks: deliveries arrive as Generate Orders
+        would calculate them, projected usage draws stock down oldest-first, and anything
+        past its shelf life is counted as spoilage.
+
+        - **Stockout Risk %** — share of simulated runs that ran short at least once
+        - **Expected Short / Spoilage** — average quantity short or thrown out over the horizon
+        - Shelf lives come from `ingredient_properties.json` (per ingredient, with vendor defaults)
+        """)
+
+    with st.expander("🩺 Diagnostics"):
+        st.markdown("""
+        When a fetch or page feels slow, open **Diagnostics**, switch on **Record timings**
+        and repeat what was slow. Each stage (Toast requests, file parsing, aggregation,
+        ingredient usage, order building, exports, page rendering) shows its calls, time,
+        rows and bytes. Export the numbers as JSON or Prometheus text to share them.
+        """)
+
     with st.expander("🔌 Setting Up Toast API"):
         st.markdown("""
         **Why:** Automates data fetching so you never manually export files again.
@@ -1472,22 +8517,36 @@ elif page == "❓ Help":
     with st.expander("❓ Common Questions"):
         st.markdown("""
         **Q: How accurate are the projections?**
-        Based on 4 weeks of actual data, typically within 5-10% of actual needs.
+        Measure it: the **Forecast Accuracy** page replays past order days against your
+        Toast history and reports the error per vendor and ingredient.
         Accuracy improves with more weeks of data.
 
         **Q: What if a recipe changes?**
-        Go to Settings → Recipes → Upload updated plate cost file.
+        Go to Settings → Recipes → Upload updated plate cost file. The import lists new,
+        changed and missing recipes line by line before anything is replaced.
 
         **Q: Can I manually edit the order quantities?**
         Download the Excel file and edit before placing your order.
 
+        **Q: Can I see what we ordered last week?**
+        Click **📒 Save to Order History** after calculating an order. Saved orders appear
+        under **Order History**, and the next order for the same window shows a
+        "vs Last" column with the change per ingredient.
+
         **Q: What about items with no recipe?**
         Liquor, beer, wine, and non-food items don't need recipes.
         The system flags food items without recipes so you can add them.
+        If Toast just names a dish differently ("Noodle Bowl - Lg"), link it to its
+        recipe under Settings → Name Matching.
 
         **Q: What if Toast API goes down?**
         Upload files manually in the Sales Dashboard. The system works either way.
 
+        **Q: Do I have to re-upload after closing the tab?**
+        No. Loaded sales, the sliders and the waste buffers are saved for the location
+        a couple of seconds after they change and come back on the next visit, even after
+        a restart. **Clear All Data** clears the saved datasets too.
+
         **Q: How do I add a new vendor?**
         Contact your developer to update `vendor_schedules.json`.
         """)
@@ -1506,3 +8565,5 @@ st.markdown(
     "</div>",
     unsafe_allow_html=True
 )
+persist_user_state()
+page_span.end()